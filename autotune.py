@@ -0,0 +1,170 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+import torch
+
+import page_scale
+import segmentation_to_classifier as segToClass
+
+
+logger = logging.getLogger(__name__)
+
+# Where the profile with the best settings for this computer is saved
+PROFILE_PATH = "./tuning_profile.json"
+
+# The batch sizes of the classifier that are tried
+BATCH_SIZES = [32, 64, 128, 256, 512]
+
+# How much faster a setting has to be than the best so far to be chosen, so that noise in the timings does not change
+# the settings
+MIN_GAIN = 0.02
+
+
+# Returns 1, 2, 4 and so on up to the number of cores of the computer, which is always included
+def thread_counts():
+    cores = os.cpu_count() or 1
+    counts = []
+    count = 1
+    while count < cores:
+        counts.append(count)
+        count *= 2
+    return counts + [cores]
+
+
+# Returns the computer the profile is made on, so that a profile copied to another computer is not used there
+def host():
+    return {"cpu_count": os.cpu_count(), "machine": platform.machine(), "system": platform.system()}
+
+
+# Returns a page made of copies of an image on top of each other, so that the tuning can be done on a larger page
+def synthetic_page(image, copies):
+    return np.concatenate([image] * copies, axis=0)
+
+
+# Sets the number of threads torch and OpenCV use, the batch size of the classifier and the line workers of the
+# segmentor to the settings
+def apply_settings(settings, classifier=None, segmentor=None):
+    torch.set_num_threads(settings["torch_threads"])
+    cv2.setNumThreads(settings["cv2_threads"])
+    if classifier is not None and hasattr(classifier, "batch_size"):
+        classifier.batch_size = settings["batch_size"]
+    if segmentor is not None:
+        segmentor.line_workers = settings["line_workers"]
+
+
+# Returns the fewest seconds it takes to segment and classify the pages with the settings, out of some repeats
+def time_settings(settings, pages, classifier, engine, repeats):
+    # The stage cache is not used so that every repeat preprocesses the pages again
+    segmentor = segToClass.Segmentor(letter_height=page_scale.CANONICAL_LETTER_HEIGHT, engine=engine,
+                                     stage_cache=None)
+    apply_settings(settings, classifier, segmentor)
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for page in pages:
+            segmentor.segment_clear_background(page, classifier)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# Finds the settings that segment and classify the pages fastest. The settings are tuned one at a time while the
+# others are kept at their best values so far, which is repeated until no setting changes or passes have been done.
+# Returns the best settings, how long they took and how long the default settings took.
+def tune(pages, classifier, engine="tesseract", repeats=2, passes=2):
+    candidates = {"torch_threads": thread_counts(), "cv2_threads": thread_counts(), "batch_size": BATCH_SIZES,
+                  "line_workers": thread_counts()}
+    cores = os.cpu_count() or 1
+    settings = {"torch_threads": torch.get_num_threads(), "cv2_threads": cv2.getNumThreads(), "batch_size": 256,
+                "line_workers": cores}
+
+    # Runs once before timing, so that the model and the first allocations are not part of the first timing
+    time_settings(settings, pages, classifier, engine, 1)
+    default_seconds = time_settings(settings, pages, classifier, engine, repeats)
+    best_seconds = default_seconds
+    print("default settings: {:.2f} s".format(default_seconds))
+
+    for _ in range(passes):
+        changed = False
+        for name, values in candidates.items():
+            for value in values:
+                if value == settings[name]:
+                    continue
+                trial = dict(settings, **{name: value})
+                seconds = time_settings(trial, pages, classifier, engine, repeats)
+                print("{}={}: {:.2f} s".format(name, value, seconds))
+                if seconds < best_seconds * (1 - MIN_GAIN):
+                    settings, best_seconds, changed = trial, seconds, True
+        if not changed:
+            break
+
+    apply_settings(settings, classifier)
+    return settings, best_seconds, default_seconds
+
+
+# Saves settings as the profile of this computer
+def save_profile(settings, seconds, default_seconds, path=PROFILE_PATH):
+    profile = dict(settings, host=host(), seconds=round(seconds, 3), default_seconds=round(default_seconds, 3))
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(profile, file, indent=2)
+
+
+# Returns the settings in the profile, or None if there is no profile or it was made on another computer
+def load_profile(path=PROFILE_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, encoding="utf-8") as file:
+            profile = json.load(file)
+    except ValueError:
+        logger.warning("The tuning profile %s could not be read and is not used", path)
+        return None
+    if profile.get("host") != host():
+        logger.warning("The tuning profile %s was made on another computer and is not used. Run autotune.py again "
+                       "to make one for this computer.", path)
+        return None
+    return {name: profile[name] for name in ("torch_threads", "cv2_threads", "batch_size", "line_workers")}
+
+
+# Loads the profile and applies its thread counts and the batch size of the classifier. Returns the settings of the
+# profile, or None if there is none, in which case nothing is changed.
+def apply_profile(classifier=None, path=PROFILE_PATH):
+    settings = load_profile(path)
+    if settings is not None:
+        apply_settings(settings, classifier)
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Finds the number of threads, batch size and line workers that "
+                                                 "segment and classify fastest on this computer and saves them to a "
+                                                 "profile that the user interface and batch_runner.py use")
+    parser.add_argument("images", nargs="*", default=["test.jpg"], help="images to tune on")
+    parser.add_argument("--synthetic", type=int, default=1,
+                        help="make larger pages out of this many copies of each image on top of each other")
+    parser.add_argument("--engine", default="tesseract", choices=segToClass.ENGINES)
+    parser.add_argument("--repeats", type=int, default=2, help="how many times each setting is timed")
+    parser.add_argument("--out", default=PROFILE_PATH, help="where the profile is saved")
+    args = parser.parse_args()
+
+    pages = []
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError("The image " + str(path) + " could not be read")
+        pages.append(synthetic_page(image, args.synthetic))
+    classifier = segToClass.get_classifier(segToClass.MODEL_PATH)
+    settings, seconds, default_seconds = tune(pages, classifier, args.engine, args.repeats)
+    save_profile(settings, seconds, default_seconds, args.out)
+    print("best settings: " + ", ".join(name + "=" + str(value) for name, value in settings.items()) +
+          " ({:.2f} s instead of {:.2f} s), saved to ".format(seconds, default_seconds) + args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import argparse
+import math
+
+import cv2
+import numpy as np
+
+
+# The backgrounds an image can be segmented with. "auto" detects whether the background is varied with
+# detect_background, and "clear" and "varied" choose segment_clear_background or segment_varied_background.
+BACKGROUNDS = ["auto", "clear", "varied"]
+
+# Length of the longest side of the small copy of the image the background is detected on
+DETECTION_SIZE = 256
+
+# The spread of the brightness of the background above which the background is varied, and how much the spread has to
+# differ from it to be about 73% sure (one step of the logistic function). They were set on test.jpg and on copies of
+# it with stains, a brightness gradient, parchment colours and a blotchy texture added, where the varied background
+# preprocessing found the letters better than the clear background preprocessing from a spread of about 0.2. On copies
+# with only a smooth gradient or smooth blotches it catches up from about 0.25 to 0.3, which is why pages just above
+# 0.2 are only detected as varied with a low confidence.
+VARIED_SPREAD = 0.2
+SPREAD_SCALE = 0.04
+
+
+# Returns a grayscale copy of an image that is scaled down so that its longest side is at most DETECTION_SIZE
+def _small_gray(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if len(image.shape) == 3 else image
+    scale = min(DETECTION_SIZE / max(gray.shape), 1.0)
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+# Returns the brightness of the background around each pixel of a small grayscale image. The dark letters are closed
+# away with a kernel that is larger than the letters, and what is left is smoothed.
+def background_map(small):
+    kernel_size = max(3, (max(small.shape) // 16) | 1)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    return cv2.medianBlur(cv2.morphologyEx(small, cv2.MORPH_CLOSE, kernel), 5)
+
+
+# Returns how much the brightness of the background varies over the image, as the difference between the 95th and
+# the 5th percentile of the background map, from 0 to 1. A clean scan has about the same background everywhere, while
+# stains, darker areas and uneven light make the spread large.
+def background_spread(image):
+    background = background_map(_small_gray(image))
+    histogram = np.cumsum(np.bincount(background.ravel(), minlength=256)) / background.size
+    low = int(np.searchsorted(histogram, 0.05))
+    high = int(np.searchsorted(histogram, 0.95))
+    return (high - low) / 255
+
+
+# Detects whether the background of an image is varied. Returns whether it is varied and how sure the detection is,
+# from 0.5 to 1. It takes a few milliseconds, also for large images.
+def detect_background(image):
+    spread = background_spread(image)
+    probability = 1 / (1 + math.exp(-(spread - VARIED_SPREAD) / SPREAD_SCALE))
+    varied = probability >= 0.5
+    return varied, probability if varied else 1 - probability
+
+
+# Returns whether an image should be segmented as having a varied background for one of the BACKGROUNDS, and how sure
+# the detection is, or None if the background was chosen and not detected
+def choose_background(image, background="auto"):
+    if background == "auto":
+        return detect_background(image)
+    elif background in BACKGROUNDS:
+        return background == "varied", None
+    raise ValueError("Unknown background '" + str(background) + "', choose one of: " + ", ".join(BACKGROUNDS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detects whether the background of scroll images is varied")
+    parser.add_argument("images", nargs="+", help="paths to scroll images")
+    args = parser.parse_args()
+
+    for path in args.images:
+        image = cv2.imread(path)
+        if image is None:
+            print(path + ": the image could not be read")
+            continue
+        varied, confidence = detect_background(image)
+        print(path + ": " + ("varied" if varied else "clear") + " background ({:.0%} sure, spread {:.3f})".format(
+            confidence, background_spread(image)))
+
+
+if __name__ == "__main__":
+    main()
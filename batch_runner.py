@@ -0,0 +1,277 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+import autotune
+import inference_server
+from background_detection import BACKGROUNDS, choose_background
+import page_scale
+import segmentation_to_classifier as segToClass
+from hashing import file_hash
+from memory_governor import MemoryGovernor
+from result_cache import save_table
+
+
+# The file extensions of the images that are found in folders
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+
+# Name of the manifest in the output folder
+MANIFEST_NAME = "manifest.jsonl"
+
+
+# Record of the pages that have been processed, saved as one json line for each time a page has been processed in the
+# manifest file. Lines are only added to the file, so a crash can at most leave the last line half written, and the
+# last line of a page is the one that counts. A line has:
+# key      hash of the content of the image and the parameters, which is also the name of the output file
+# image    path to the image, with its size, modification time and the hash of its content
+# params   the parameters the page was segmented and classified with
+# status   "done" or "failed"
+# output   path to the .npz file with the results (see result_cache.load_table)
+# attempts how many times the page has failed in a row
+# background "clear" or "varied", the background the page was segmented with, and background_confidence how sure the
+#          detection of the background was if it was detected
+# refined  only with a time budget: False when the results of the quick segmentation are saved, and True when the
+#          results of the page refined afterwards are saved over them
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.records = {}
+        # Size, modification time and hash of the images in the manifest, so that they do not have to be read again
+        self.hashes = {}
+
+        ends_with_newline = True
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    ends_with_newline = line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # The line was half written when the run stopped
+                        continue
+                    self.records[record["key"]] = record
+                    self.hashes[record["image"]] = (record["size"], record["mtime"], record["hash"])
+
+        self.file = open(path, "a", encoding="utf-8")
+        # Lines are added by the thread that refines the pages too
+        self.lock = threading.Lock()
+        if not ends_with_newline:
+            self.file.write("\n")
+
+    # Returns the hash of the content of an image. Images that are in the manifest with the same size and
+    # modification time are not read again.
+    def image_hash(self, path):
+        stat = os.stat(path)
+        saved = self.hashes.get(path)
+        if saved is not None and saved[0] == stat.st_size and saved[1] == stat.st_mtime:
+            return saved[2]
+        return file_hash(path)
+
+    # Adds a record to the manifest. It is written to the disk before the method returns.
+    def add(self, record):
+        with self.lock:
+            self.records[record["key"]] = record
+            self.hashes[record["image"]] = (record["size"], record["mtime"], record["hash"])
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+# Returns the key of a page from the hash of its content and the parameters it is processed with
+def page_key(content_hash, params):
+    return hashlib.sha1((content_hash + "|" + json.dumps(params, sort_keys=True)).encode()).hexdigest()
+
+
+# Returns the paths to the images given as files or folders, sorted within each folder
+def find_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                 if name.lower().endswith(IMAGE_EXTENSIONS)))
+        else:
+            images.append(path)
+    return images
+
+
+# Refines the letters of a page that was segmented with a time budget and saves them over its quick results. Returns
+# whether the page was refined.
+def refine_page(manifest, segmentor, classifier, record, letters, image_shape, progress):
+    start = time.perf_counter()
+    try:
+        letters = segmentor.refine(letters, classifier, image_shape)
+        save_table(record["output"], letters)
+    except Exception as error:
+        manifest.add(dict(record, status="failed", attempts=record["attempts"] + 1, error=repr(error)))
+        print(progress + ": refining failed: " + repr(error))
+        return False
+
+    seconds = time.perf_counter() - start
+    manifest.add(dict(record, letters=len(letters), refined=True, refine_seconds=round(seconds, 3)))
+    print(progress + ": refined to " + str(len(letters)) + " letters in {:.1f} s".format(seconds))
+    return True
+
+
+# Segments and classifies the images and saves the results in the output folder. background is one of BACKGROUNDS,
+# and with "auto" the background of each image is detected. Pages that have been done with the same parameters before
+# are skipped, and pages that failed are tried again, unless they have failed max_attempts times in a row. Returns how
+# many pages were done, skipped and failed.
+# If the segmentor has a time budget, the results of each page are saved as soon as it is segmented, and the page is
+# then refined (see Segmentor.refine) on another thread while the next page is segmented. Pages whose refined results
+# were not saved, for example because the run was stopped, are done again the next time.
+def run(paths, out_dir, segmentor, classifier, params, background="auto", max_attempts=3):
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(out_dir, MANIFEST_NAME))
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+
+    refiner = ThreadPoolExecutor(max_workers=1) if segmentor.time_budget is not None else None
+    # The page that is being refined. Only one page is refined at a time, so that the images of the pages that are
+    # waiting to be refined do not fill the memory.
+    refining = None
+
+    try:
+        for number, path in enumerate(paths, 1):
+            stat = os.stat(path)
+            content_hash = manifest.image_hash(path)
+            key = page_key(content_hash, params)
+            output = os.path.join(out_dir, key + ".npz")
+            record = {"key": key, "image": path, "size": stat.st_size, "mtime": stat.st_mtime,
+                      "hash": content_hash, "params": params, "output": output}
+
+            previous = manifest.records.get(key)
+            if previous is not None and previous["status"] == "done" and previous.get("refined", True) and \
+                    os.path.exists(output):
+                # The same image can be in the corpus under another path, which is added so that it is not read
+                # again the next time
+                if manifest.hashes.get(path) != (stat.st_size, stat.st_mtime, content_hash):
+                    manifest.add(dict(previous, image=path, size=stat.st_size, mtime=stat.st_mtime))
+                counts["skipped"] += 1
+                continue
+
+            attempts = previous["attempts"] if previous is not None and previous["status"] == "failed" else 0
+            if attempts >= max_attempts:
+                print("[" + str(number) + "/" + str(len(paths)) + "] " + path + ": skipped after " +
+                      str(attempts) + " failed attempts")
+                counts["failed"] += 1
+                continue
+
+            start = time.perf_counter()
+            try:
+                image = cv2.imread(path)
+                if image is None:
+                    raise ValueError("the image could not be read")
+                varied_background, confidence = choose_background(image, background)
+                record["background"] = "varied" if varied_background else "clear"
+                if confidence is not None:
+                    record["background_confidence"] = round(confidence, 3)
+                if varied_background:
+                    letters = segmentor.segment_varied_background(image, classifier)
+                else:
+                    letters = segmentor.segment_clear_background(image, classifier)
+                save_table(output, letters)
+            except Exception as error:
+                manifest.add(dict(record, status="failed", attempts=attempts + 1, error=repr(error)))
+                print("[" + str(number) + "/" + str(len(paths)) + "] " + path + ": failed: " + repr(error))
+                counts["failed"] += 1
+                continue
+
+            seconds = time.perf_counter() - start
+            record = dict(record, status="done", attempts=0, letters=len(letters), seconds=round(seconds, 3))
+            progress = "[" + str(number) + "/" + str(len(paths)) + "] " + path
+            print(progress + ": " + str(len(letters)) + " letters in {:.1f} s".format(seconds))
+            counts["done"] += 1
+
+            if refiner is not None:
+                manifest.add(dict(record, refined=False))
+                if refining is not None and not refining.result():
+                    counts["done"] -= 1
+                    counts["failed"] += 1
+                refining = refiner.submit(refine_page, manifest, segmentor, classifier, record, letters, image.shape,
+                                          progress)
+            else:
+                manifest.add(record)
+
+        if refining is not None and not refining.result():
+            counts["done"] -= 1
+            counts["failed"] += 1
+    finally:
+        if refiner is not None:
+            refiner.shutdown()
+        manifest.close()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segments and classifies many images and saves the results. "
+                                                 "The run can be stopped and started again, and then only does the "
+                                                 "images that are not done yet.")
+    parser.add_argument("images", nargs="+", help="paths to images or folders with images")
+    parser.add_argument("--out", default="./batch_results", help="folder for the results and the manifest")
+    parser.add_argument("--background", default="auto", choices=BACKGROUNDS,
+                        help="the background of the images, detected for each image with auto")
+    parser.add_argument("--varied", action="store_true", help="the same as --background varied")
+    parser.add_argument("--engine", default="tesseract", choices=segToClass.ENGINES)
+    parser.add_argument("--model", default=segToClass.MODEL_PATH, help="path to the model")
+    parser.add_argument("--server",
+                        help="address of an inference server, like " + inference_server.DEFAULT_ADDRESS + ", that "
+                             "classifies all the letters, also the letters that are checked while the words are split, "
+                             "instead of loading the model here")
+    parser.add_argument("--max-attempts", type=int, default=3, help="how many times a failing image is tried")
+    parser.add_argument("--memory-budget", type=float,
+                        help="gigabytes of memory the run should stay under, by using fewer line workers and smaller "
+                             "batches of letters when the images are large")
+    parser.add_argument("--time-budget", type=float,
+                        help="seconds each page should be segmented in. The quick results are saved first, and then "
+                             "replaced by the results of the page refined while the next page is segmented.")
+    parser.add_argument("--profile", default=autotune.PROFILE_PATH,
+                        help="tuning profile made by autotune.py with the threads, batch size and line workers to use")
+    args = parser.parse_args()
+    if args.varied:
+        args.background = "varied"
+
+    # The model is identified by the hash of its file, which is the file of the server if a server is used
+    if args.server:
+        classifier = inference_server.InferenceClient(args.server)
+        # The letters that are checked while the wide boxes are split are also classified on the server
+        segToClass.set_letter_checker(classifier)
+        model_hash = classifier.status()["model_hash"]
+    else:
+        classifier = segToClass.get_classifier(args.model)
+        model_hash = file_hash(args.model)
+
+    # Uses the threads, batch size and line workers of the tuning profile if there is one
+    tuning = autotune.apply_profile(classifier, args.profile)
+    line_workers = tuning["line_workers"] if tuning is not None else os.cpu_count()
+
+    governor = None
+    if args.memory_budget is not None:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        max_batch = tuning["batch_size"] if tuning is not None else 256
+        governor = MemoryGovernor(int(args.memory_budget * 2 ** 30), max_workers=line_workers, max_batch=max_batch)
+
+    segmentor = segToClass.Segmentor(letter_height=page_scale.CANONICAL_LETTER_HEIGHT, engine=args.engine,
+                                     line_workers=line_workers, time_budget=args.time_budget,
+                                     memory_governor=governor)
+
+    # The parameters that change the results
+    params = {"background": args.background, "engine": args.engine, "letter_height": segmentor.letter_height,
+              "denoiser": segmentor.denoiser, "model": model_hash}
+
+    counts = run(find_images(args.images), args.out, segmentor, classifier, params, args.background, args.max_attempts)
+    print("done: " + str(counts["done"]) + ", skipped: " + str(counts["skipped"]) + ", failed: " +
+          str(counts["failed"]))
+
+
+if __name__ == "__main__":
+    main()
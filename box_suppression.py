@@ -0,0 +1,102 @@
+import numpy as np
+
+from spatial_index import LetterIndex
+
+
+# Ways the letters that overlap a letter with a higher confidence are handled:
+# "suppress"  the letters are removed
+# "merge"     the letters are removed and the letter with the highest confidence gets the box around all of them
+MODES = ["suppress", "merge"]
+
+
+# Returns the pairs of letters in a LetterIndex whose boxes are in the same cell of the grid, as two arrays of letter
+# indices where the first index is the smaller one. Only letters in the same cell can overlap, so the pairs are found
+# without comparing all the letters with each other. Each pair is only returned once.
+def candidate_pairs(index):
+    counts = np.diff(index.cell_starts)
+    position = np.arange(len(index.entries))
+    cell_end = np.repeat(index.cell_starts[1:], counts)
+
+    # Pairs each entry with the entries after it in its cell
+    later = cell_end - position - 1
+    first = np.repeat(position, later)
+    second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(later) - later, later)
+
+    a, b = index.entries[first], index.entries[second]
+    keys = np.unique(np.minimum(a, b) * len(index) + np.maximum(a, b))
+    return keys // len(index), keys % len(index)
+
+
+# Returns the intersection over union of the boxes of the pairs of letters in a LetterIndex
+def pair_iou(index, first, second):
+    width = np.minimum(index.right[first], index.right[second]) - np.maximum(index.left[first], index.left[second])
+    height = np.minimum(index.bottom[first], index.bottom[second]) - np.maximum(index.top[first], index.top[second])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+
+    area = (index.right - index.left) * (index.bottom - index.top)
+    return intersection / (area[first] + area[second] - intersection)
+
+
+# Removes the letters that overlap a letter with a higher confidence with an intersection over union above
+# iou_threshold (non-maximum suppression), or merges them into that letter if mode is "merge". Letters that are not
+# classified are treated as having the lowest confidence, and letters with the same confidence keep the first of them.
+# h_img is the height of the image the boxes are in. A merged letter gets its image cropped from the source of the
+# table if the table has it and the boxes are in it. Returns a new table with the kept letters in the same order.
+# The overlapping pairs are found with a LetterIndex and their overlap computed at once, so the time grows with
+# n log n for n letters instead of with n * n.
+def suppress_overlaps(letters, h_img, iou_threshold=0.5, mode="suppress"):
+    if mode not in MODES:
+        raise ValueError("Unknown overlap mode '" + str(mode) + "', choose one of: " + ", ".join(MODES))
+    if len(letters) < 2:
+        return letters
+
+    index = LetterIndex(letters, h_img)
+    first, second = candidate_pairs(index)
+    overlapping = pair_iou(index, first, second) > iou_threshold
+    first, second = first[overlapping], second[overlapping]
+    if len(first) == 0:
+        return letters
+
+    # Orders the letters by confidence, so that rank 0 is the letter with the highest confidence
+    confidences = np.nan_to_num(letters.confidences.astype(np.float64), nan=-1.0)
+    rank = np.empty(len(letters), dtype=np.int64)
+    rank[np.argsort(-confidences, kind="stable")] = np.arange(len(letters))
+
+    # Each pair as the letter with the higher and the letter with the lower rank
+    swap = rank[first] > rank[second]
+    higher = np.where(swap, second, first)
+    lower = np.where(swap, first, second)
+
+    # A letter is removed if it overlaps a kept letter with a higher rank. The pairs are gone through in the order of
+    # the rank of their lower letter, so whether the higher letter is kept is known when the pair is reached.
+    kept = np.ones(len(letters), dtype=bool)
+    owner = np.arange(len(letters))
+    for i in np.argsort(rank[lower], kind="stable"):
+        if kept[higher[i]] and kept[lower[i]]:
+            kept[lower[i]] = False
+            owner[lower[i]] = higher[i]
+
+    result = letters.take(np.flatnonzero(kept))
+    if mode == "merge":
+        _merge_boxes(letters, result, kept, owner, h_img)
+    return result
+
+
+# Sets the boxes of the kept letters to the box around them and the letters that were merged into them
+def _merge_boxes(letters, result, kept, owner, h_img):
+    boxes = letters.boxes
+    merged = boxes.copy()
+    np.minimum.at(merged[:, 0], owner, boxes[:, 0])
+    np.minimum.at(merged[:, 1], owner, boxes[:, 1])
+    np.maximum.at(merged[:, 2], owner, boxes[:, 2])
+    np.maximum.at(merged[:, 3], owner, boxes[:, 3])
+
+    kept_indices = np.flatnonzero(kept)
+    changed = np.flatnonzero(np.any(merged[kept_indices] != boxes[kept_indices], axis=1))
+    result.boxes[changed] = merged[kept_indices[changed]]
+
+    source = letters.source
+    if source is not None and source.shape[0] == h_img:
+        for i in changed:
+            x, y, w, h = result.boxes[i]
+            result.images[i] = source[(h_img - h):(h_img - y), x:w]
@@ -0,0 +1,239 @@
+import argparse
+import math
+import time
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as nnf
+from PIL import Image
+
+import segmentation_to_classifier as segToClass
+
+
+# Path to the small model used as the first stage of the cascade
+TINY_MODEL_PATH = "./tiny.model"
+
+
+# A much smaller version of the Convolutional network that classifies 32x32 images
+class TinyConvolutional(nn.Module):
+    def __init__(self, input_size=32):
+        super(TinyConvolutional, self).__init__()
+        # Convolutional layers and Max pooling with activation functions
+        self.convolutional = nn.Sequential(
+            nn.Conv2d(1, 8, 3),
+            nn.ReLU(),
+            nn.MaxPool2d(2, 2),
+            nn.Conv2d(8, 16, 3),
+            nn.ReLU(),
+            nn.MaxPool2d(2, 2)
+        )
+
+        # Fully connected layer with activation functions
+        size = int(((input_size - 2) / 2 - 2) / 2)
+        self.fullyconnected = nn.Sequential(
+            nn.Linear(16 * size * size, 64),
+            nn.ReLU(),
+            nn.Linear(64, 22)
+        )
+
+    def forward(self, x):
+        x = self.convolutional(x)
+        x = torch.flatten(x, 1)
+        x = self.fullyconnected(x)
+        return x
+
+
+# Puts an image of a letter in the middle of a white 100x100 image, the same way the Classifier does, and scales it
+# down to the input size of the small model. Returns the image with values between 0 and 1. A missing image (None) is
+# black, the same as in the Classifier.
+def tiny_input(image, input_size=32):
+    if image is None:
+        return np.zeros((input_size, input_size), dtype=np.float32)
+    image = Image.fromarray(image)
+    new_image = Image.new(image.mode, (100, 100), 255)
+    x, y = int((100 / 2)) - int(image.width / 2), int(100 / 2) - int(image.height / 2)
+    new_image.paste(image, (x, y))
+    small = cv2.resize(np.array(new_image), (input_size, input_size), interpolation=cv2.INTER_AREA)
+    return small.astype(np.float32) / 255
+
+
+# Classifier that first classifies the letters with the small model, and only uses the full classifier for the
+# letters the small model is uncertain about. The small model only labels a letter when its confidence is at least
+# upper. When its confidence is at most lower, it only answers how confident the letter is classified for
+# class_letter_checker (through LetterConfidence), since it is then clear that the confidence is under the
+# thresholds the segmentation checks, but the letter still gets its label from the full classifier.
+class CascadeClassifier:
+    def __init__(self, full_classifier, tiny_model=TINY_MODEL_PATH, lower=20, upper=95, input_size=32):
+        self.full_classifier = full_classifier
+        self.classes = full_classifier.classes
+        self.lower = lower
+        self.upper = upper
+        self.input_size = input_size
+
+        # Setup model
+        self.model = TinyConvolutional(input_size)
+        self.model.load_state_dict(torch.load(tiny_model, map_location=torch.device('cpu')))
+        self.model.eval()
+
+        # How many letters each of the models has classified
+        self.tiny_count = 0
+        self.full_count = 0
+
+    # Returns the predictions and confidences (in percent) of the small model for a list of images
+    def _tiny_predict(self, images):
+        batch = np.stack([tiny_input(image, self.input_size) for image in images])
+        with torch.no_grad():
+            results = nnf.softmax(self.model(torch.from_numpy(batch).unsqueeze(1)), dim=1).numpy()
+        predictions = np.argmax(results, axis=1)
+        return predictions, results[np.arange(len(images)), predictions] * 100
+
+    # Returns whether the small model is confident enough of a letter to label it
+    def _confident(self, confidence):
+        return confidence >= self.upper
+
+    # Returns whether the small model is sure enough that a letter can't be classified with a high confidence
+    def _unlikely(self, confidence):
+        return confidence <= self.lower
+
+    def SimplyClassify(self, image):
+        predictions, confidences = self._tiny_predict([image])
+        if self._confident(confidences[0]):
+            self.tiny_count += 1
+            return self.classes[predictions[0]], confidences[0]
+
+        self.full_count += 1
+        return self.full_classifier.SimplyClassify(image)
+
+    # Returns the confidence of a letter for class_letter_checker, which only compares it with the thresholds of the
+    # segmentation. The small model answers it when it is confident or when the confidence is at most lower.
+    def LetterConfidence(self, image):
+        predictions, confidences = self._tiny_predict([image])
+        if self._confident(confidences[0]) or self._unlikely(confidences[0]):
+            self.tiny_count += 1
+            return confidences[0]
+
+        self.full_count += 1
+        return self.full_classifier.SimplyClassify(image)[1]
+
+    def Classify(self, letters):
+        if len(letters) == 0:
+            return letters
+
+        images = [letter.image for letter in letters]
+        predictions, confidences = self._tiny_predict(images)
+        confident = self._confident(confidences)
+
+        for i in np.flatnonzero(confident):
+            letters[i].add_label(self.classes[predictions[i]], math.trunc(float(confidences[i])))
+
+        # Classifies the letters the small model is uncertain about with the full classifier
+        uncertain = np.flatnonzero(~confident)
+        if len(uncertain) > 0:
+            rest = segToClass.LetterTable.from_letters([letters[i] for i in uncertain])
+            rest = self.full_classifier.Classify(rest)
+            for i, letter in zip(uncertain, rest):
+                letters[i].add_label(letter.label, letter.confidence)
+
+        self.tiny_count += int(np.count_nonzero(confident))
+        self.full_count += len(uncertain)
+        return letters
+
+
+# Trains the small model to give the same predictions as the full classifier on a list of letter images
+# (knowledge distillation). Returns the trained small model.
+def distill(full_classifier, images, epochs=20, batch_size=64, learning_rate=1e-3, input_size=32):
+    # The predictions of the full classifier are the targets. The full classifier gets the images in its own size.
+    with torch.no_grad():
+        targets = nnf.softmax(full_classifier.model(torch.from_numpy(
+            np.stack([tiny_input(image, 100) for image in images])).unsqueeze(1)), dim=1)
+
+    inputs = torch.from_numpy(np.stack([tiny_input(image, input_size) for image in images])).unsqueeze(1)
+
+    model = TinyConvolutional(input_size)
+    optimizer = torch.optim.Adam(model.parameters(), lr=learning_rate)
+    for _ in range(epochs):
+        order = torch.randperm(len(images))
+        for start in range(0, len(images), batch_size):
+            batch = order[start:start + batch_size]
+            optimizer.zero_grad()
+            loss = nnf.kl_div(nnf.log_softmax(model(inputs[batch]), dim=1), targets[batch], reduction="batchmean")
+            loss.backward()
+            optimizer.step()
+
+    model.eval()
+    return model
+
+
+# Returns the letter images of the scroll images, segmented with the connected component engine
+def letter_images(paths):
+    segmentor = segToClass.Segmentor(engine="components")
+    images = []
+    for path in paths:
+        letters = segmentor.segment_clear_background(cv2.imread(path))
+        images.extend(letter.image for letter in letters if letter.image is not None and letter.image.size > 0)
+    return images
+
+
+# Prints how many letters the cascade labels the same as the full classifier, how many it sends to the full
+# classifier and how fast it is, for different thresholds. It also prints how many letters LetterConfidence answers
+# the same as the full classifier for the thresholds of the segmentation (above 60 and above 90).
+def report(full_classifier, tiny_model, images, thresholds):
+    start = time.perf_counter()
+    reference = full_classifier.Classify(segToClass.LetterTable.from_letters(
+        [segToClass.Letter(image, 0, 0, 0, 0) for image in images]))
+    full_time = time.perf_counter() - start
+    reference_checks = [(confidence > 60, confidence > 90) for confidence in reference.confidences.astype(np.float64)]
+
+    print("{:>7}{:>7}{:>12}{:>12}{:>14}{:>14}".format("lower", "upper", "agreement", "deferred", "letters/s",
+                                                      "checks agree"))
+    print("{:>7}{:>7}{:>12.3f}{:>12.3f}{:>14.0f}{:>14.3f}".format("-", "full", 1.0, 1.0, len(images) / full_time, 1.0))
+
+    for lower, upper in thresholds:
+        cascade = CascadeClassifier(full_classifier, tiny_model, lower, upper)
+        letters = segToClass.LetterTable.from_letters([segToClass.Letter(image, 0, 0, 0, 0) for image in images])
+        start = time.perf_counter()
+        cascade.Classify(letters)
+        cascade_time = time.perf_counter() - start
+
+        agreement = np.mean(letters.label_ids == reference.label_ids)
+        deferred = cascade.full_count / max(len(images), 1)
+
+        checks = []
+        for image in images:
+            confidence = cascade.LetterConfidence(image)
+            checks.append((confidence > 60, confidence > 90))
+        checks_agree = np.mean([check == reference_check for check, reference_check in zip(checks, reference_checks)])
+
+        print("{:>7}{:>7}{:>12.3f}{:>12.3f}{:>14.0f}{:>14.3f}".format(lower, upper, agreement, deferred,
+                                                                      len(images) / cascade_time, checks_agree))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Trains and evaluates the small first stage model of the cascade")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="trains the small model on the letters of scroll images")
+    train_parser.add_argument("images", nargs="+", help="paths to scroll images")
+    train_parser.add_argument("--out", default=TINY_MODEL_PATH, help="where the small model is saved")
+    train_parser.add_argument("--epochs", type=int, default=20)
+
+    report_parser = subparsers.add_parser("report", help="shows the accuracy and speed of the cascade")
+    report_parser.add_argument("images", nargs="+", help="paths to scroll images")
+    report_parser.add_argument("--tiny", default=TINY_MODEL_PATH, help="path to the small model")
+    args = parser.parse_args()
+
+    full_classifier = segToClass.get_classifier(segToClass.MODEL_PATH)
+    images = letter_images(args.images)
+
+    if args.command == "train":
+        model = distill(full_classifier, images, epochs=args.epochs)
+        torch.save(model.state_dict(), args.out)
+        print("Trained the small model on " + str(len(images)) + " letters and saved it to " + args.out)
+    else:
+        report(full_classifier, args.tiny, images, [(10, 90), (20, 95), (30, 98)])
+
+
+if __name__ == "__main__":
+    main()
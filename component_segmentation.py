@@ -0,0 +1,168 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import denoise
+
+
+# Finds the parent of a component in the union find structure used when merging components
+def _find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+# Makes a box around each letter/word on the scroll from the connected components of the black pixels in the image.
+# Components that are parts of the same letter, like broken strokes, are merged when one of them is above the other
+# and they overlap horizontally by at least min_overlap of the narrowest one, with a vertical gap of at most max_gap
+# times the height of the letters, as long as the box around the two merged groups of components is at most max_height
+# times the height of the letters so that letters on different lines are not merged, also through a chain of merges. Components smaller than min_area pixels are seen as noise.
+# Returns the boxes in the same coordinates as tesseract_boxes, ordered from the top line to the bottom line and from
+# right to left on each line:
+# x = Distance between the top left corner of the box to the left frame
+# y = Distance between the top of the box to the bottom frame
+# w = Distance between the right side of the box to the left frame
+# h = Distance between the bottom of the box to the bottom frame
+def component_boxes(image, min_area=10, min_overlap=0.5, max_gap=0.3, max_height=1.8):
+    if len(image.shape) == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    h_img = image.shape[0]
+
+    # The letters are black, so the pixels darker than 128 are the components
+    ink = (image < 128).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+
+    # Skips the background, which is the first component, and the noise
+    stats = stats[1:]
+    stats = stats[stats[:, cv2.CC_STAT_AREA] >= min_area]
+    if len(stats) == 0:
+        return []
+
+    left = stats[:, cv2.CC_STAT_LEFT].astype(np.int64)
+    top = stats[:, cv2.CC_STAT_TOP].astype(np.int64)
+    right = left + stats[:, cv2.CC_STAT_WIDTH]
+    bottom = top + stats[:, cv2.CC_STAT_HEIGHT]
+
+    letter_height = float(np.median(bottom - top))
+    gap = max_gap * letter_height
+
+    # Goes through the components sorted by their left side, so that the components that can overlap a component
+    # horizontally are the ones after it that start before it ends
+    order = np.argsort(left, kind="stable")
+    sorted_left = left[order]
+    parents = list(range(len(stats)))
+    # The top and bottom of the components in each group, saved at the root of the group
+    group_top = top.tolist()
+    group_bottom = bottom.tolist()
+    max_merged_height = max_height * letter_height
+    for position, i in enumerate(order):
+        end = np.searchsorted(sorted_left, right[i], side="left")
+        others = order[position + 1:end]
+        if len(others) == 0:
+            continue
+
+        overlap = np.minimum(right[others], right[i]) - np.maximum(left[others], left[i])
+        narrowest = np.minimum(right[others] - left[others], right[i] - left[i])
+        vertical_gap = np.maximum(top[others], top[i]) - np.minimum(bottom[others], bottom[i])
+
+        merge = (overlap >= min_overlap * narrowest) & (vertical_gap <= gap)
+        for j in others[merge]:
+            root_i, root_j = _find(parents, i), _find(parents, j)
+            if root_i == root_j:
+                continue
+            merged_top = min(group_top[root_i], group_top[root_j])
+            merged_bottom = max(group_bottom[root_i], group_bottom[root_j])
+            if merged_bottom - merged_top <= max_merged_height:
+                parents[root_j] = root_i
+                group_top[root_i], group_bottom[root_i] = merged_top, merged_bottom
+
+    # Makes one box around all the components that have been merged
+    groups = np.array([_find(parents, i) for i in range(len(stats))])
+    _, groups = np.unique(groups, return_inverse=True)
+    count = groups.max() + 1
+    box_left = np.full(count, np.iinfo(np.int64).max)
+    box_top = np.full(count, np.iinfo(np.int64).max)
+    box_right = np.zeros(count, dtype=np.int64)
+    box_bottom = np.zeros(count, dtype=np.int64)
+    np.minimum.at(box_left, groups, left)
+    np.minimum.at(box_top, groups, top)
+    np.maximum.at(box_right, groups, right)
+    np.maximum.at(box_bottom, groups, bottom)
+
+    # Orders the boxes in reading order, line by line from the top and from right to left on each line
+    line = np.round((box_top + box_bottom) / 2 / max(letter_height, 1)).astype(np.int64)
+    reading_order = np.lexsort((-box_right, line))
+
+    return [(int(box_left[i]), int(h_img - box_bottom[i]), int(box_right[i]), int(h_img - box_top[i]))
+            for i in reading_order]
+
+
+# Returns the intersection over union of two boxes in the coordinates returned by component_boxes
+def box_iou(box, other):
+    width = min(box[2], other[2]) - max(box[0], other[0])
+    height = min(box[3], other[3]) - max(box[1], other[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area = (box[2] - box[0]) * (box[3] - box[1]) + (other[2] - other[0]) * (other[3] - other[1])
+    return intersection / (area - intersection)
+
+
+# Compares boxes against reference boxes. Each reference box is matched to the unmatched box it has the highest
+# intersection over union with, if it is at least min_iou. Returns the amount of matched boxes and their mean iou.
+def match_boxes(boxes, reference, min_iou=0.5):
+    unmatched = list(range(len(boxes)))
+    ious = []
+    for reference_box in reference:
+        if not unmatched:
+            break
+        scores = [box_iou(boxes[i], reference_box) for i in unmatched]
+        best = int(np.argmax(scores))
+        if scores[best] >= min_iou:
+            ious.append(scores[best])
+            unmatched.pop(best)
+    return len(ious), float(np.mean(ious)) if ious else 0.0
+
+
+# Prints a report comparing the boxes found with the connected components against the boxes found with Tesseract
+def main():
+    # Imported here since segmentation_to_classifier imports this module
+    import segmentation_to_classifier as segToClass
+
+    parser = argparse.ArgumentParser(description="Compares the connected component segmentation with Tesseract")
+    parser.add_argument("image", nargs="?", default="test.jpg", help="path to a scroll image")
+    parser.add_argument("--varied", action="store_true", help="the image has a varied background")
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    segmentor = segToClass.Segmentor()
+    if args.varied:
+        binarized = segmentor.binarize_varied_background(image)
+    else:
+        binarized = segmentor.binarize_clear_background(image)
+    denoised = denoise.denoise(binarized, segmentor.denoiser)
+
+    start = time.perf_counter()
+    boxes = component_boxes(denoised)
+    component_time = time.perf_counter() - start
+    print("components: {} boxes in {:.1f} ms".format(len(boxes), component_time * 1000))
+
+    try:
+        start = time.perf_counter()
+        reference = segToClass.tesseract_boxes(denoised)
+        tesseract_time = time.perf_counter() - start
+    except Exception as error:
+        print("Tesseract could not be run, so there is nothing to compare with: " + str(error))
+        return
+    print("tesseract:  {} boxes in {:.1f} ms".format(len(reference), tesseract_time * 1000))
+
+    matched, mean_iou = match_boxes(boxes, reference)
+    print("matched {} of {} Tesseract boxes (iou >= 0.5), mean iou {:.3f}".format(matched, len(reference), mean_iou))
+    print("speed-up: {:.1f}x".format(tesseract_time / max(component_time, 1e-9)))
+
+
+if __name__ == "__main__":
+    main()
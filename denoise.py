@@ -0,0 +1,116 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+
+# The different ways the binarized image can be denoised before it is segmented. The images have black letters on a
+# white background.
+
+# Non-local means denoising. This is the denoising that has been used in the segmentation from the start, and the
+# one the other denoisers are compared against.
+def denoise_nl_means(image):
+    return cv2.fastNlMeansDenoising(image, h=60.0, templateWindowSize=7, searchWindowSize=21)
+
+
+# Removes the black connected components that are smaller than min_area pixels
+def denoise_components(image, min_area=10):
+    # The letters have to be white for them to be found as connected components
+    inverted = cv2.bitwise_not(image)
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(inverted, connectivity=8)
+
+    # Looks up whether the component of each pixel is large enough to be kept. The background is never kept.
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[0] = False
+    return np.where(keep[labels], image, 255).astype(np.uint8)
+
+
+# Median filtering, which removes single pixels and thin lines of noise
+def denoise_median(image, ksize=3):
+    return cv2.medianBlur(image, ksize)
+
+
+# Non-local means denoising of a downsampled image, scaled back up to the size of the image afterwards
+def denoise_nl_means_downsampled(image, factor=2):
+    h_img, w_img = image.shape[:2]
+    small = cv2.resize(image, (max(w_img // factor, 1), max(h_img // factor, 1)), interpolation=cv2.INTER_AREA)
+    small = cv2.fastNlMeansDenoising(small, h=60.0, templateWindowSize=7, searchWindowSize=21)
+    return cv2.resize(small, (w_img, h_img), interpolation=cv2.INTER_LINEAR)
+
+
+# The denoisers that can be chosen by name
+DENOISERS = {
+    "nl_means": denoise_nl_means,
+    "components": denoise_components,
+    "median": denoise_median,
+    "nl_means_downsampled": denoise_nl_means_downsampled,
+}
+
+# The denoiser that is used if no other is chosen
+DEFAULT_DENOISER = "nl_means"
+
+
+# Denoises an image with the denoiser with the given name
+def denoise(image, method=DEFAULT_DENOISER):
+    if method not in DENOISERS:
+        raise ValueError("Unknown denoiser '" + str(method) + "', choose one of: " + ", ".join(DENOISERS))
+    return DENOISERS[method](image)
+
+
+# Compares how similar a denoised image is to the reference. Returns the intersection over union of the letter
+# pixels (the pixels darker than 128) in the two images, and the mean absolute difference of the pixel values.
+def quality(denoised, reference):
+    letters = denoised < 128
+    reference_letters = reference < 128
+    union = np.count_nonzero(letters | reference_letters)
+    iou = np.count_nonzero(letters & reference_letters) / union if union > 0 else 1.0
+    difference = np.mean(np.abs(denoised.astype(np.int16) - reference.astype(np.int16)))
+    return iou, float(difference)
+
+
+# Runs each denoiser on the image and returns how long it took and the quality compared to the reference denoiser
+def compare_denoisers(image, methods=None, repeats=3):
+    if methods is None:
+        methods = list(DENOISERS)
+
+    reference = denoise(image, DEFAULT_DENOISER)
+
+    report = []
+    for method in methods:
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            denoised = denoise(image, method)
+            seconds.append(time.perf_counter() - start)
+        iou, difference = quality(denoised, reference)
+        report.append({"method": method, "seconds": min(seconds), "iou": iou, "mean_abs_diff": difference})
+    return report
+
+
+# Prints a report of the speed and quality of the denoisers on an image
+def main():
+    # Imported here since segmentation_to_classifier imports this module
+    import segmentation_to_classifier as segToClass
+
+    parser = argparse.ArgumentParser(description="Compares the speed and quality of the denoisers on an image")
+    parser.add_argument("image", help="path to a scroll image")
+    parser.add_argument("--varied", action="store_true", help="the image has a varied background")
+    parser.add_argument("--repeats", type=int, default=3, help="how many times each denoiser is timed")
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    segmentor = segToClass.Segmentor()
+    if args.varied:
+        binarized = segmentor.binarize_varied_background(image)
+    else:
+        binarized = segmentor.binarize_clear_background(image)
+
+    print("{:<22}{:>12}{:>10}{:>16}".format("denoiser", "time (ms)", "iou", "mean abs diff"))
+    for row in compare_denoisers(binarized, repeats=args.repeats):
+        print("{:<22}{:>12.1f}{:>10.3f}{:>16.2f}".format(row["method"], row["seconds"] * 1000, row["iou"],
+                                                         row["mean_abs_diff"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,37 @@
 import sys, os
 import glob
+import threading
 import traceback
 from pathlib import Path
 
-import cv2
 from PyQt5 import QtWidgets, QtGui, QtCore
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QGridLayout, QShortcut, QFileDialog
 from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot, QRunnable, QObject, QThreadPool
 from PyQt5.QtGui import QPixmap, QKeySequence, QFont, QMovie
 
-import segmentation_to_classifier as segToClass
-
 import numpy as np
-from PIL import Image
 
 import qimage2ndarray
 
+# cv2, PIL, torch and the modules that use them are imported in the methods that need them, so that the window is
+# shown without waiting for them. They are imported in the background by App.warm_up when the window is shown.
+
+# How many images in the job queue are classified at the same time. The line workers each image is segmented on are
+# divided between them, so that the images together do not use more threads than there are cores.
+CLASSIFY_JOBS = min(2, os.cpu_count() or 1)
+
 
 # Gotten a lot from: https://stackoverflow.com/questions/35508711/how-to-enable-pan-and-zoom-in-a-qgraphicsview
 # Date: 10.03.2022
 # Class that represents the photoviewer object
 class PhotoViewer(QtWidgets.QGraphicsView):
     photo_clicked = QtCore.pyqtSignal(QtCore.QPoint)
+    # Emitted when the image is clicked without dragging it
+    letter_clicked = QtCore.pyqtSignal(QtCore.QPoint)
+    # Emitted when the mouse is moved over the image without any buttons pressed
+    photo_hovered = QtCore.pyqtSignal(QtCore.QPoint)
+    # Emitted when a rectangle is selected by dragging with shift pressed
+    region_selected = QtCore.pyqtSignal(QtCore.QRect)
 
     def __init__(self, parent):
         super(PhotoViewer, self).__init__(parent)
@@ -63,6 +73,15 @@ class PhotoViewer(QtWidgets.QGraphicsView):
         self.zoom_level = 100
         self.cropped_img = None
 
+        # Makes it so that the mouse move events are received also when no button is pressed
+        self.setMouseTracking(True)
+        # Where the mouse was pressed, used to check if the image was clicked or dragged
+        self.press_pos = None
+        # Boolean to check if the user is selecting letters with the rubberband
+        self.selecting = False
+        # The rectangles that highlight the selected letters
+        self.highlight_items = []
+
     # Method for removing image from pixmap
     def remove_item(self):
         # Clears the scene
@@ -80,6 +99,24 @@ class PhotoViewer(QtWidgets.QGraphicsView):
         item.setZValue(-1)
         self.draggable = False
         self.rubber_band_item.hide()
+        self.selecting = False
+        # The highlight rectangles were removed when the scene was cleared
+        self.highlight_items = []
+
+    # Method that highlights rectangles (x, y, width, height) in the scene
+    def highlight(self, rectangles):
+        self.clear_highlight()
+        pen = QtGui.QPen(QtGui.QColor("red"))
+        pen.setWidth(2)
+        for x, y, width, height in rectangles:
+            item = self.scene.addRect(QtCore.QRectF(x, y, width, height), pen)
+            self.highlight_items.append(item)
+
+    # Method that removes the highlight rectangles from the scene
+    def clear_highlight(self):
+        for item in self.highlight_items:
+            self.scene.removeItem(item)
+        self.highlight_items = []
 
     # Method to check if pixmap has image or not
     def has_photo(self):
@@ -161,7 +198,17 @@ class PhotoViewer(QtWidgets.QGraphicsView):
             self.rubber_band_item.show()
             self.draggable = True
             super(PhotoViewer, self).mousePressEvent(event)
+        elif event.modifiers() & Qt.ShiftModifier and self.has_photo():
+            # Holding shift while dragging selects the letters inside the rectangle instead of moving the image
+            self.setDragMode(QtWidgets.QGraphicsView.NoDrag)
+            self.origin = self.mapToScene(event.pos()).toPoint()
+            self.rubber_band_item.setGeometry(
+                QtCore.QRect(self.origin, QtCore.QSize())
+            )
+            self.rubber_band_item.show()
+            self.selecting = True
         else:
+            self.press_pos = event.pos()
             if self.photo.isUnderMouse():
                 self.photo_clicked.emit(self.mapToScene(event.pos()).toPoint())
             super(PhotoViewer, self).mousePressEvent(event)
@@ -176,8 +223,17 @@ class PhotoViewer(QtWidgets.QGraphicsView):
                 )
                 self.rubber_band_item.show()
 
+        elif self.selecting:
+            end_pos = self.mapToScene(event.pos()).toPoint()
+            self.rubber_band_item.setGeometry(
+                QtCore.QRect(self.origin, end_pos).normalized()
+            )
+            return
+
         elif not self.photo.pixmap().isNull() and not self.rubber_bool:
             self.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
+            if event.buttons() == Qt.NoButton and self.photo.isUnderMouse():
+                self.photo_hovered.emit(self.mapToScene(event.pos()).toPoint())
         super(PhotoViewer, self).mouseMoveEvent(event)
 
     # Method that happens when the left-click is released
@@ -204,14 +260,27 @@ class PhotoViewer(QtWidgets.QGraphicsView):
 
             # Saving the cropped image so that it later can be used to crop letters from
             # with the "Save Letters" button.
+            from PIL import Image
             im = Image.fromarray(self.cropped_img)
             im.save("./cropped_img.png")
 
             self.rubber_band_item.hide()
             self.rubber_bool = False
             self.is_cropped = True
+        elif self.selecting:
+            end_pos = self.mapToScene(event.pos()).toPoint()
+            self.rubber_band_item.hide()
+            self.selecting = False
+            self.region_selected.emit(QtCore.QRect(self.origin, end_pos).normalized())
+            self.setDragMode(QtWidgets.QGraphicsView.ScrollHandDrag)
+            return
         elif not self.photo.pixmap().isNull() and not self.rubber_bool:
             self.setDragMode(QtWidgets.QGraphicsView.NoDrag)
+            # The image is clicked if the mouse has not moved since it was pressed
+            if self.press_pos is not None and (event.pos() - self.press_pos).manhattanLength() < 4 and \
+                    self.photo.isUnderMouse():
+                self.letter_clicked.emit(self.mapToScene(event.pos()).toPoint())
+        self.press_pos = None
         super(PhotoViewer, self).mouseMoveEvent(event)
 
 
@@ -220,12 +289,11 @@ class PhotoViewer(QtWidgets.QGraphicsView):
 # https://stackoverflow.com/questions/63393099/how-to-display-a-loading-animated-gif-while-a-code-is-executing-in-backend-of-my
 # Date: 25.03.2022
 class WorkerSignals(QObject):
+    started = pyqtSignal()
     finished = pyqtSignal()
     error = pyqtSignal(tuple)
     result = pyqtSignal(object)
     progress = pyqtSignal(int)
-    add_photo = pyqtSignal()
-    add_cropped_photo = pyqtSignal()
 
 
 # Class that allows for multithreading in the gui
@@ -249,6 +317,7 @@ class Worker(QRunnable):
         """
 
         # Retrieve args/kwargs here; and fire processing using them
+        self.signals.started.emit()
         try:
             result = self.fn(*self.args, **self.kwargs)
         except:
@@ -287,36 +356,97 @@ class TimerMessageBox(QtWidgets.QMessageBox):
 
 
 # Class that represents radiobuttons where the user can change between two different
-# image enhancement processes for their image
+# image enhancement processes for their image. With "Auto" the background of the image is detected when it is
+# classified, and "Yes" and "No" override the detection.
 class GroupBox(QtWidgets.QWidget):
     def __init__(self):
         super().__init__()
         self.selected_yes = False
+        self.selected_auto = True
         self.layout = QtWidgets.QGridLayout(self)
         self.groupbox = QtWidgets.QGroupBox("Does the DSS image have varying background?")
         self.layout.addWidget(self.groupbox)
 
         self.hbox = QtWidgets.QHBoxLayout()
         self.groupbox.setLayout(self.hbox)
+        self.auto_radiobutton = QtWidgets.QRadioButton("Auto")
         self.yes_radiobutton = QtWidgets.QRadioButton("Yes")
         self.no_radiobutton = QtWidgets.QRadioButton("No")
 
+        self.auto_radiobutton.toggled.connect(self.auto_selected)
         self.yes_radiobutton.toggled.connect(self.yes_selected)
         self.no_radiobutton.toggled.connect(self.no_selected)
 
-        self.no_radiobutton.toggle()
+        self.auto_radiobutton.toggle()
 
+        self.hbox.addWidget(self.auto_radiobutton, alignment=QtCore.Qt.AlignTop)
         self.hbox.addWidget(self.yes_radiobutton, alignment=QtCore.Qt.AlignTop)
         self.hbox.addWidget(self.no_radiobutton, alignment=QtCore.Qt.AlignTop)
         self.hbox.addStretch()
         self.layout.setColumnStretch(1, 1)
         self.layout.setRowStretch(1, 1)
 
+    def auto_selected(self):
+        self.selected_auto = True
+
     def yes_selected(self):
         self.selected_yes = True
+        self.selected_auto = False
 
     def no_selected(self):
         self.selected_yes = False
+        self.selected_auto = False
+
+    # Returns whether the image has a varied background, or None if it should be detected
+    def varied_background(self):
+        if self.selected_auto:
+            return None
+        return self.selected_yes
+
+
+# Class that represents an image in the job queue. The pixels of the image and the options it is classified with are
+# copied when the job is made on the gui thread, and the copy of the pixels is read only, so the job can be classified
+# on the thread pool while the user keeps working with the application. The results are set when the job is done.
+class ClassifyJob:
+    def __init__(self, image_path, image, varied_background, rectangle=None, page=None, display_id=None):
+        self.image_path = image_path
+        self.name = os.path.basename(image_path) if image_path else "Image"
+        self.image = np.array(image, dtype=np.uint8)
+        self.image.setflags(write=False)
+        # None if the background is detected when the job is classified
+        self.varied_background = varied_background
+        # How sure the detection of the background was, None if the background was not detected
+        self.background_confidence = None
+        # The cropped rectangle (x, y, width, height), None if the whole image is classified
+        self.rectangle = rectangle
+        # The results, image and varied background of the whole image if it has been classified before the crop
+        self.page = page
+        # Which image was displayed when the job was made, used to show the results when they are done
+        self.display_id = display_id
+
+        # "Queued", "Running", "Done" or "Failed"
+        self.status = "Queued"
+        # The letters, the spatial index over them, the image they were classified in and the image with the boxes drawn
+        # on it, set when the job is done
+        self.results = None
+        self.letter_index = None
+        self.classified_image = None
+        self.drawn = None
+        self.error = None
+
+    # The text of the job in the job queue
+    def text(self):
+        text = self.name + (" (cropped)" if self.rectangle is not None else "") + ": " + self.status
+        if self.status == "Done":
+            text += ", " + str(len(self.results)) + " letters"
+            if self.background_confidence is not None:
+                text += ", " + self.background_text()
+        return text
+
+    # The text that tells which background was detected
+    def background_text(self):
+        return ("varied" if self.varied_background else "clear") + " background detected ({:.0%} sure)".format(
+            self.background_confidence)
 
 
 # Class that represents the application
@@ -366,6 +496,11 @@ class App(QWidget):
         self.zoom_label.setAlignment(Qt.AlignRight)
         self.grid.addWidget(self.zoom_label, 1, 1)
 
+        # Connects the clicks, mouse movement and selection in the photoViewer to the letters
+        self.photo_viewer.letter_clicked.connect(self.inspect_letter)
+        self.photo_viewer.photo_hovered.connect(self.show_letter_tooltip)
+        self.photo_viewer.region_selected.connect(self.select_letters)
+
         # Adds the photoViewer in the grid
         self.grid.addWidget(self.photo_viewer, 3, 0, 1, 2)
 
@@ -451,6 +586,17 @@ class App(QWidget):
         self.help_button.clicked.connect(self.help_box)
         self.grid.addWidget(self.help_button, 7, 1)
 
+        # Creates the job queue, which lists the images that are classified or waiting to be classified. A finished
+        # job is shown when it is clicked.
+        self.job_label = QLabel("Jobs")
+        self.grid.addWidget(self.job_label, 0, 2)
+        self.job_list = QtWidgets.QListWidget(self)
+        self.job_list.itemClicked.connect(self.job_clicked)
+        self.grid.addWidget(self.job_list, 1, 2, 7, 1)
+        self.grid.setColumnStretch(0, 3)
+        self.grid.setColumnStretch(1, 3)
+        self.grid.setColumnStretch(2, 2)
+
         self.setLayout(self.grid)
 
         # Creates shortcuts to the gui
@@ -461,9 +607,18 @@ class App(QWidget):
 
         # Allows for multithreading
         self.thread_pool = QThreadPool()
-        self.worker = Worker(None)
-
-        self.segmented_letters = []
+        # The images in the job queue are classified on their own pool, CLASSIFY_JOBS at a time
+        self.job_pool = QThreadPool()
+        self.job_pool.setMaxThreadCount(CLASSIFY_JOBS)
+
+        # The jobs in the job queue, in the same order as the items of the job list, and how many of them are running
+        self.jobs = []
+        self.running_jobs = 0
+        # The job whose results are displayed, None if the displayed image has not been classified
+        self.shown_job = None
+        # Changed every time another image is displayed, so that the results of a job are only shown when they are
+        # done if the image the job was made from is still displayed
+        self.display_id = 0
 
         self.img = None
 
@@ -471,6 +626,49 @@ class App(QWidget):
 
         self.results_from_classifier = None
 
+        # Cache for the results of images that have already been classified. The results are also saved in the folder
+        # in the DSS_RESULT_CACHE_DIR environment variable if it is set, so that they are kept when the application is
+        # restarted. Made the first time an image is classified.
+        self.result_cache = None
+
+        # Client for a running inference server, if one is set in the DSS_INFERENCE_SERVER environment variable.
+        # The images are then segmented and classified by the server instead of in the application.
+        self.inference_client = None
+        # Makes sure the result cache and the client are only made once when several jobs start at the same time
+        self.services_lock = threading.Lock()
+
+        # Whether the model has started loading in the background
+        self.warmed_up = False
+
+        # The settings of the tuning profile of this computer made by autotune.py, loaded when the model is, or None
+        # if there is no profile
+        self.tuning = None
+
+        # Results of the whole image, the image itself without boxes and whether it was classified with varied
+        # background. Used to find the letters in a crop of the image without classifying the crop again.
+        self.page_results = None
+        self.page_image = None
+        self.page_varied_background = None
+
+        # Spatial index over the classified letters, used to find the letters at a point or in a rectangle
+        self.letter_index = None
+
+    # Starts loading the model in the background the first time the window is shown
+    def showEvent(self, event):
+        super(App, self).showEvent(event)
+        if not self.warmed_up:
+            self.warmed_up = True
+            self.thread_pool.start(Worker(self.warm_up))
+
+    # Imports the segmentation and loads the model, applies the tuning profile if there is one, and classifies an
+    # empty image once so that the first classification does not have to wait for it
+    def warm_up(self):
+        import segmentation_to_classifier as segToClass
+        import autotune
+        classifier = segToClass.get_classifier(segToClass.MODEL_PATH)
+        self.tuning = autotune.apply_profile(classifier)
+        classifier.SimplyClassify(np.full((30, 30), 255, dtype=np.uint8))
+
     # Method that saves the letters that the segmentation detected when doing classification
     def crop_letters(self):
         if self.photo_viewer.empty is True:
@@ -482,11 +680,9 @@ class App(QWidget):
             msg = QtWidgets.QMessageBox()
             msg.information(self.photo_viewer, "Not Classified", "The image has not yet been classified")
         else:
-            if not self.photo_viewer.is_cropped:
-                # Reading the image
-                img = cv2.imread(self.image_path)
-            else:
-                img = cv2.imread("./cropped_img.png")
+            import cv2
+            # The letters are cut from the image they were classified in, without the boxes drawn on it
+            img = cv2.cvtColor(self.shown_job.classified_image, cv2.COLOR_RGB2BGR)
             if len(img.shape) == 3:
                 h_img, w_img, _ = img.shape
             else:
@@ -511,132 +707,350 @@ class App(QWidget):
             msg.exec_()
 
     def add_photo_to_scene(self):
+        from PIL import Image
         im = Image.fromarray(self.img)
         im.save("./classified_img.png")
 
         self.photo_viewer.set_photo_with_rectangle(pixmap=QPixmap("./classified_img.png"), rectangle=False)
 
     def add_cropped_photo_to_scene(self):
+        from PIL import Image
         im = Image.fromarray(self.img)
         im.save("./classified_img.png")
 
         self.photo_viewer.set_photo(pixmap=QPixmap("./classified_img.png"))
 
-    # Method that is run when the classify thread is done
-    def thread_complete(self):
-        # Enabling the buttons again
-        self.classify_button.setDisabled(False)
-        self.browse_button.setDisabled(False)
-        self.remove_button.setDisabled(False)
-        self.crop_button.setDisabled(False)
-        self.uncrop_button.setDisabled(False)
-        self.save_button.setDisabled(False)
-        self.help_button.setDisabled(False)
-        self.text_button.setDisabled(False)
-        self.group_box.setDisabled(False)
-        # Stops the loading gif
-        self.movie.stop()
-        self.loading_label.hide()
-        if len(self.segmented_letters) == 0:
+    # Method that returns the cropped rectangle (x, y, width, height) of the displayed image, None if it is not cropped
+    def displayed_rectangle(self):
+        rectangle = self.photo_viewer.rubber_band_item_geometry
+        if rectangle is None:
+            return None
+        return rectangle.x(), rectangle.y(), rectangle.width(), rectangle.height()
+
+    # Method that adds a job to the job queue and starts classifying it on the thread pool
+    def start_job(self, job):
+        self.jobs.append(job)
+        self.job_list.addItem(job.text())
+
+        worker = Worker(self.classify, job)
+        worker.signals.started.connect(lambda: self.job_started(job))
+        worker.signals.result.connect(self.job_done)
+        worker.signals.error.connect(lambda error: self.job_failed(job, error))
+        self.job_pool.start(worker)
+
+    # Method that updates the text of a job in the job queue
+    def update_job_item(self, job):
+        self.job_list.item(self.jobs.index(job)).setText(job.text())
+
+    # Method that is run when a job starts being classified
+    def job_started(self, job):
+        job.status = "Running"
+        self.update_job_item(job)
+        self.running_jobs += 1
+        # Starts the animation of the loading gif
+        self.loading_label.show()
+        self.movie.start()
+
+    # Method that is run when a job stops being classified
+    def job_stopped(self, job):
+        self.update_job_item(job)
+        self.running_jobs -= 1
+        if self.running_jobs == 0:
+            # Stops the loading gif
+            self.movie.stop()
+            self.loading_label.hide()
+
+    # Method that is run when a job is done. The results are shown if the image the job was made from is still
+    # displayed, otherwise they are shown when the job is clicked in the job queue.
+    def job_done(self, job):
+        job.status = "Done"
+        self.job_stopped(job)
+        if job.display_id != self.display_id or job.rectangle != self.displayed_rectangle():
+            return
+
+        self.show_job(job)
+        if len(job.results) == 0:
             # A message box will appear telling the user that there is no image displayed
             msg = TimerMessageBox("No Letters Detected", "No hebrew letters were detected", parent=self.photo_viewer)
             msg.exec_()
         else:
             # A message box will appear telling the user that there is no image displayed
-            msg = TimerMessageBox("Classified", "The image has been classified", parent=self.photo_viewer)
+            text = "The image has been classified"
+            if job.background_confidence is not None:
+                text += "\nA " + job.background_text()
+            msg = TimerMessageBox("Classified", text, parent=self.photo_viewer)
             msg.exec_()
 
-    # This is the method that runs when the classify button is pressed. It uses multithreading to
-    # let the loading icon spin when the image is being classified.
+    # Method that is run when the classification of a job fails
+    def job_failed(self, job, error):
+        job.status = "Failed"
+        job.error = error[1]
+        self.job_stopped(job)
+
+    # Method that shows the results of a finished job when it is clicked in the job queue
+    def job_clicked(self, item):
+        job = self.jobs[self.job_list.row(item)]
+        if job.status == "Done":
+            self.show_job(job)
+        elif job.status == "Failed":
+            msg = QtWidgets.QMessageBox()
+            msg.information(self.photo_viewer, "Classification Failed", job.name + " could not be classified:\n" +
+                            str(job.error))
+
+    # Method that displays the image of a finished job with the boxes of its letters
+    def show_job(self, job):
+        self.display_id += 1
+        self.shown_job = job
+        self.image_path = job.image_path
+        self.img = job.drawn
+        self.results_from_classifier = job.results
+        self.letter_index = job.letter_index
+        self.classified = True
+
+        # The results of the whole image are reused when the image is cropped
+        if job.rectangle is None:
+            self.page_results, self.page_image, self.page_varied_background = \
+                job.results, job.classified_image, job.varied_background
+        elif job.page is not None:
+            self.page_results, self.page_image, self.page_varied_background = job.page
+        else:
+            self.page_results, self.page_image, self.page_varied_background = None, None, None
+
+        self.photo_viewer.clear_highlight()
+        self.photo_viewer.rubber_bool = False
+        if job.rectangle is None:
+            self.photo_viewer.rubber_band_item_geometry = None
+            self.photo_viewer.is_cropped = False
+            self.photo_viewer.photo.setPos(0, 0)
+            self.add_photo_to_scene()
+        else:
+            self.photo_viewer.rubber_band_item_geometry = QtCore.QRect(*job.rectangle)
+            self.photo_viewer.is_cropped = True
+            self.add_cropped_photo_to_scene()
+
+        self.file_name_label.setText("Filename: " + job.name)
+        self.photo_viewer.zoom_label.setText("Zoom level: " + str(int(self.photo_viewer.zoom_level)) + "%")
+        self.group_box.show()
+
+    # This is the method that runs when the classify button is pressed. The displayed image is added to the job queue
+    # and classified on the thread pool, so the application can be used while it is classified.
     def button_classify(self):
         if self.photo_viewer.empty is True:
             # A message box will appear telling the user that there is no image displayed
             msg = QtWidgets.QMessageBox()
             msg.information(self.photo_viewer, "No Image Displayed", "There is no image to classify")
         else:
-            # Disabling the buttons
-            self.classify_button.setDisabled(True)
-            self.browse_button.setDisabled(True)
-            self.remove_button.setDisabled(True)
-            self.crop_button.setDisabled(True)
-            self.uncrop_button.setDisabled(True)
-            self.save_button.setDisabled(True)
-            self.help_button.setDisabled(True)
-            self.text_button.setDisabled(True)
-            self.group_box.setDisabled(True)
-            # Starts the animation of the loading gif
-            self.loading_label.show()
-            self.movie.start()
-
-            # Starts the classify method that classifies the image
-            self.worker = Worker(self.classify)
-            self.worker.signals.finished.connect(self.thread_complete)
-            self.worker.signals.add_photo.connect(self.add_photo_to_scene)
-            self.worker.signals.add_cropped_photo.connect(self.add_cropped_photo_to_scene)
-
-            self.thread_pool.start(self.worker)
-
-    # Method that classifies an image.
-    def classify(self):
-        # Checks if there is an image to classify
-        if self.photo_viewer.empty is True:
-            # A message box will appear telling the user that there is no image displayed
+            # Removes the highlight of selected letters from the previous classification
+            self.photo_viewer.clear_highlight()
+
+            # Gets the pixels of the image without the boxes of an earlier classification, which the job copies
+            img_array = self.clean_image()
+
+            # If the whole image has been classified before the crop, the job gets its results to find the letters
+            # inside the crop
+            page = None
+            if self.page_results is not None:
+                page = (self.page_results, self.page_image, self.page_varied_background)
+
+            self.start_job(ClassifyJob(self.image_path, img_array, self.group_box.varied_background(),
+                                       self.displayed_rectangle(), page, self.display_id))
+
+    # Method that returns the pixels of the displayed image as a numpy.ndarray without the boxes that are drawn on it
+    # when it is classified: the image file, cropped to the displayed rectangle if the image is cropped. The displayed
+    # pixels are used if the file can't be read.
+    def clean_image(self):
+        qimg = QPixmap(self.image_path).toImage() if self.image_path else QtGui.QImage()
+        if qimg.isNull():
+            return qimage2ndarray.rgb_view(self.photo_viewer.photo.pixmap().toImage())
+
+        img_array = qimage2ndarray.rgb_view(qimg)
+        rectangle = self.displayed_rectangle()
+        if rectangle is not None:
+            x, y, width, height = rectangle
+            img_array = img_array[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)]
+        return img_array
+
+    # Method that adds images to the job queue without displaying them. Their pixels are read here, on the gui thread.
+    def queue_images(self, file_paths):
+        for file_path in file_paths:
+            qimg = QPixmap(file_path).toImage()
+            if qimg.isNull():
+                continue
+            self.start_job(ClassifyJob(file_path, qimage2ndarray.rgb_view(qimg), self.group_box.varied_background()))
+
+    # Method that returns the result cache and the inference client, which are made the first time an image is
+    # classified
+    def classify_services(self):
+        with self.services_lock:
+            if self.result_cache is None:
+                from result_cache import cache_from_environment
+                import inference_server
+                # The results are only saved to a folder if the folder is set in the DSS_RESULT_CACHE_DIR environment
+                # variable
+                self.result_cache = cache_from_environment()
+                self.inference_client = inference_server.client_from_environment()
+            return self.result_cache, self.inference_client
+
+    # Method that classifies the image of a job. It is run on the thread pool, so it only uses the job and not the
+    # widgets of the application.
+    def classify(self, job):
+        import segmentation_to_classifier as segToClass
+        import region_results
+        from spatial_index import LetterIndex
+        import page_scale
+
+        from background_detection import detect_background
+
+        result_cache, inference_client = self.classify_services()
+
+        # Detects the background if it was not chosen
+        if job.varied_background is None:
+            job.varied_background, job.background_confidence = detect_background(job.image)
+
+        # Uses the machine learning model we have made and pytesseract to segment and classify
+        # the letters
+        # Images with large letters are scaled down before they are segmented, and the lines of text in the image
+        # are segmented at the same time on all the cores of the computer, or on as many line workers as the tuning
+        # profile says, divided between the images that are classified at the same time
+        line_workers = self.tuning["line_workers"] if self.tuning is not None else os.cpu_count()
+        line_workers = max(line_workers // CLASSIFY_JOBS, 1)
+        segmenter = segToClass.Segmentor(letter_height=page_scale.CANONICAL_LETTER_HEIGHT,
+                                         line_workers=line_workers)
+        img = job.image
+
+        results = None
+        # If the whole image has been classified before the crop, the letters inside the crop are taken from
+        # the results of the whole image instead of segmenting and classifying the crop again
+        if job.rectangle is not None and job.page is not None and job.page[2] == job.varied_background:
+            page_results, page_image, _ = job.page
+            classifier = segToClass.get_classifier(segToClass.MODEL_PATH)
+            results = region_results.results_in_region(page_results, job.rectangle, classifier, page_image.shape)
+            if results is not None:
+                # Draws on the crop of the image without the boxes of the whole image
+                x0, y0, x1, y1 = region_results.clip_rectangle(job.rectangle, page_image.shape)
+                img = page_image[y0:y1, x0:x1]
+
+        if results is None:
+            key = result_cache.key(img, job.varied_background, segToClass.MODEL_PATH, job.rectangle)
+
+            # Only segments and classifies the image if it has not been done before
+            results = result_cache.get(key)
+            if results is None:
+                if inference_client is not None:
+                    try:
+                        results = inference_client.segment(img, job.varied_background)
+                    except OSError:
+                        # The image is segmented and classified here instead if the server can't be reached
+                        traceback.print_exc()
+
+                if results is None:
+                    # The letters are classified line by line at the same time as they are segmented
+                    classifier = segToClass.get_classifier(segToClass.MODEL_PATH)
+
+                    # Checking if the "yes" radiobutton was toggled on when the job was made
+                    if job.varied_background:
+                        results = segmenter.segment_varied_background(img, classifier)
+                    else:
+                        results = segmenter.segment_clear_background(img, classifier)
+
+                result_cache.put(key, results)
+
+        job.results = results
+        job.letter_index = LetterIndex(results, img.shape[0])
+        job.classified_image = img
+
+        # Draws the squares around the letters on a copy of the image
+        job.drawn = np.array(img)
+        self.draw_letters(job.drawn, results)
+        return job
+
+    # Method that returns the classified letters that overlap the rectangle from (x0, y0) to (x1, y1).
+    # The coordinates are counted from the top left corner of the displayed image.
+    def letters_in_rect(self, x0, y0, x1, y1):
+        if self.letter_index is None:
+            return []
+        return [self.results_from_classifier[i] for i in self.letter_index.letters_in_rect(x0, y0, x1, y1)]
+
+    # Method that converts a point in the scene to a point in the displayed image
+    def scene_to_image(self, point):
+        position = self.photo_viewer.photo.pos()
+        return point.x() - int(position.x()), point.y() - int(position.y())
+
+    # Method that returns the classified letter at a point in the scene, or None if there is no letter there
+    def letter_at(self, point):
+        if self.letter_index is None or not self.classified:
+            return None
+        x, y = self.scene_to_image(point)
+        index = self.letter_index.letter_at(x, y)
+        if index is None:
+            return None
+        return self.results_from_classifier[index]
+
+    # Method that returns a text describing a letter
+    @staticmethod
+    def letter_text(letter):
+        return str(letter.label) + " " + str(letter.confidence) + "%"
+
+    # Method that shows the label and coordinates of the letter that is clicked
+    def inspect_letter(self, point):
+        letter = self.letter_at(point)
+        if letter is not None:
             msg = QtWidgets.QMessageBox()
-            msg.information(self.photo_viewer, "No Image Displayed", "There is no image to classify")
+            msg.information(self.photo_viewer, "Letter", "Letter: " + self.letter_text(letter) + "\nBox: x=" +
+                            str(letter.x) + ", y=" + str(letter.y) + ", w=" + str(letter.w) + ", h=" + str(letter.h))
+
+    # Method that shows the label of the letter under the mouse as a tooltip
+    def show_letter_tooltip(self, point):
+        letter = self.letter_at(point)
+        if letter is not None:
+            QtWidgets.QToolTip.showText(QtGui.QCursor.pos(), self.letter_text(letter), self.photo_viewer)
         else:
-            # Uses the machine learning model we have made and pytesseract to segment and classify
-            # the letters
-            segmenter = segToClass.Segmentor()
-            # img = cv2.imread(self.image_path)
-
-            # Gets the image from the pixmap
-            qimg = self.photo_viewer.photo.pixmap().toImage()
-
-            # Converts it to an numpy.ndarray
-            img_array = qimage2ndarray.rgb_view(qimg)
-
-            # For some reason it has to be copied as uint8 to avoid errors
-            self.img = img_array.astype(np.uint8).copy()
-
-            # Gets the height of the image
-            h_img = self.img.shape[0]
-
-            self.segmented_letters.clear()
-            # Checking if the "yes" radiobutton is toggled on or off
-            if self.group_box.selected_yes:
-                self.segmented_letters = segmenter.segment_varied_background(self.img)
-            else:
-                self.segmented_letters = segmenter.segment_clear_background(self.img)
-
-            classifier = segToClass.Classifier("./default_2.model")
-            self.results_from_classifier = classifier.Classify(self.segmented_letters)
-
-            # Draws the squares around the letters
-            i = 0
-            for letter in self.results_from_classifier:
-                letter_height = letter.h - letter.y
-                width = letter.w
-                height = letter.h
-                x = letter.x
-                y = letter.y
-                cv2.rectangle(self.img, (x, h_img - y), (width, h_img - height), (0, 0, 0), 1)
-
-                text = str(letter.label) + " " + str(letter.confidence) + "%"
-                # Alternates between writing the label on top and under the boxes
-                if i % 2 == 0:
-                    cv2.putText(self.img, text=text, org=(x, (h_img - y) + 10),
-                                fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=0.5, color=(0, 0, 0), thickness=1)
-                else:
-                    cv2.putText(self.img, text=text, org=(x, ((h_img - y) - letter_height) - 4),
-                                fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=0.5, color=(0, 0, 0), thickness=1)
-
-                i += 1
-            if self.photo_viewer.rubber_band_item_geometry is not None:
-                self.worker.signals.add_cropped_photo.emit()
+            QtWidgets.QToolTip.hideText()
+
+    # Method that highlights the letters inside a rectangle selected in the scene
+    def select_letters(self, rectangle):
+        if not self.classified:
+            return
+        x0, y0 = self.scene_to_image(rectangle.topLeft())
+        x1, y1 = self.scene_to_image(rectangle.bottomRight())
+        selected = self.letters_in_rect(x0, y0, x1 + 1, y1 + 1)
+
+        # Highlights the boxes of the selected letters
+        h_img = self.img.shape[0]
+        position = self.photo_viewer.photo.pos()
+        self.photo_viewer.highlight([(letter.x + position.x(), h_img - letter.h + position.y(),
+                                      letter.w - letter.x, letter.h - letter.y) for letter in selected])
+
+        msg = TimerMessageBox("Letters Selected", str(len(selected)) + " letters selected:\n" +
+                              ", ".join(str(letter.label) for letter in selected), parent=self.photo_viewer)
+        msg.exec_()
+
+    # Method that draws the boxes and labels of the letters on an image
+    def draw_letters(self, img, letters):
+        import cv2
+
+        # Gets the height of the image
+        h_img = img.shape[0]
+
+        i = 0
+        for letter in letters:
+            letter_height = letter.h - letter.y
+            width = letter.w
+            height = letter.h
+            x = letter.x
+            y = letter.y
+            cv2.rectangle(img, (x, h_img - y), (width, h_img - height), (0, 0, 0), 1)
+
+            text = str(letter.label) + " " + str(letter.confidence) + "%"
+            # Alternates between writing the label on top and under the boxes
+            if i % 2 == 0:
+                cv2.putText(img, text=text, org=(x, (h_img - y) + 10),
+                            fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=0.5, color=(0, 0, 0), thickness=1)
             else:
-                self.worker.signals.add_photo.emit()
+                cv2.putText(img, text=text, org=(x, ((h_img - y) - letter_height) - 4),
+                            fontFace=cv2.FONT_HERSHEY_PLAIN, fontScale=0.5, color=(0, 0, 0), thickness=1)
 
-            self.classified = True
+            i += 1
 
     # Method that saves the image to file
     def save_image(self):
@@ -674,7 +1088,11 @@ class App(QWidget):
             self.photo_viewer.set_photo_with_rectangle(pixmap=QPixmap(self.image_path), rectangle=False)
             self.photo_viewer.is_cropped = False
             self.photo_viewer.rubber_band_item_geometry = None
+            self.photo_viewer.clear_highlight()
             self.classified = False
+            self.letter_index = None
+            self.display_id += 1
+            self.shown_job = None
 
     # Method that displays a help box to the user
     def help_box(self):
@@ -684,12 +1102,19 @@ class App(QWidget):
                                       "When you save the letters on the scroll image it will be "
                                       "saved in a folder called 'letters' in the application folder.\n"
                                       "Classifying big scroll images might take a couple of minutes.\n"
-                                      "If the scroll image has varying background, meaning stains or darker areas "
-                                      "in the background, please select the 'Yes' radio button. If the image has a clean, "
-                                      "white background, please select the 'No' radio button.\n"
+                                      "With the 'Auto' radio button the application detects if the scroll image has "
+                                      "varying background, meaning stains or darker areas in the background. If the "
+                                      "detection is wrong, select the 'Yes' radio button for varying background or the "
+                                      "'No' radio button for a clean, white background.\n"
                                       "Shortcuts: \n-Exit app: Ctrl+Q\n-Open images: Ctrl+O\n-Remove image: "
                                       "Ctrl+R\n-Crop image: Ctrl+W\n-Open help menu: Ctrl+H\n-Uncrop image: "
-                                      "Ctrl+U\n-Save image: Ctrl+S\n-Classify image: Ctrl+C\n-Crop letters: Ctrl+L")
+                                      "Ctrl+U\n-Save image: Ctrl+S\n-Classify image: Ctrl+C\n-Crop letters: Ctrl+L\n"
+                                      "When the image is classified you can click a letter to see its label, hold the "
+                                      "mouse over a letter to see its label, and hold Shift while dragging to select "
+                                      "the letters inside a rectangle.\n"
+                                      "Several images can be opened or dropped at once. They are classified at the "
+                                      "same time and listed under 'Jobs', where a finished image is shown when it is "
+                                      "clicked.")
 
     # Method that creates shortcuts for the user
     def create_short_cuts(self):
@@ -730,44 +1155,58 @@ class App(QWidget):
         else:
             self.photo_viewer.rubber_bool = True
 
-    # Method to open file explorer and choose an image
-    def explore(self):
+    # Method that displays an image from a file
+    def display_image(self, file_path):
+        self.display_id += 1
+        self.shown_job = None
+        self.image_path = file_path
+        # Displays the image in the photoViewer label
+        self.photo_viewer.set_photo_with_rectangle(pixmap=QPixmap(file_path))
+        # Setting the position of the image to the upper right corner of the pixmap
+        self.photo_viewer.photo.setPos(0, 0)
+        # Fetches the filename from the path and sets it as the header
+        path_list = str(file_path).split("/")
+        self.file_name_label.setText("Filename: " + path_list[-1])
+
+        # Sets the zoomlevel of the image
+        self.photo_viewer.zoom_label.setText("Zoom level: " + str(int(self.photo_viewer.zoom_level)) + "%")
+
+        # Displays the group box
+        self.group_box.show()
+
+    # Method that displays the first of the opened images if no image is displayed, and adds the other images to the
+    # job queue. If several images are opened at once, or an image is already displayed, all of them are classified.
+    def open_images(self, file_paths):
         if self.photo_viewer.empty is True:
-            # Gets the path of the Pictures folder
-            path = Path.home()
-            path_str = str(path) + os.path.sep + "Pictures"
-
-            # Checks if the computer has a directory called %HOMEPATH%\Pictures
-            if os.path.exists(path_str):
-                # Opens the file explorer in
-                file_name = QtWidgets.QFileDialog.getOpenFileName(self, 'Open file', path_str,
-                                                                 'JPG files (*.jpg);;PNG files (*.png)')
-            # If the computer doesn't have a directory like that it will open the file explorer in the %HOMEPATH%
-            else:
-                file_name = QtWidgets.QFileDialog.getOpenFileName(self, 'Open file', str(path),
-                                                                 'JPG files (*.jpg);;PNG files (*.png)')
-
-            # Check if the user has specified a path or just closed the file explorer
-            if file_name[0] != "":
-                self.image_path = file_name[0]
-                # Displays the image in the photoViewer label
-                self.photo_viewer.set_photo_with_rectangle(pixmap=QPixmap(file_name[0]))
-                # Setting the position of the image to the upper right corner of the pixmap
-                self.photo_viewer.photo.setPos(0, 0)
-                # Fetches the filename from the path and sets it as the header
-                path_list = str(file_name[0]).split("/")
-                self.file_name_label.setText("Filename: " + path_list[-1])
-
-                # Sets the zoomlevel of the image
-                self.photo_viewer.zoom_label.setText("Zoom level: " + str(int(self.photo_viewer.zoom_level)) + "%")
-
-                # Displays the group box
-                self.group_box.show()
+            self.display_image(file_paths[0])
+            # A single image is only displayed, so that it can be cropped before it is classified
+            if len(file_paths) == 1:
+                return
+            self.button_classify()
+            file_paths = file_paths[1:]
+        self.queue_images(file_paths)
+
+    # Method to open file explorer and choose one or several images
+    def explore(self):
+        # Gets the path of the Pictures folder
+        path = Path.home()
+        path_str = str(path) + os.path.sep + "Pictures"
+
+        # Checks if the computer has a directory called %HOMEPATH%\Pictures
+        if os.path.exists(path_str):
+            # Opens the file explorer in
+            file_names = QtWidgets.QFileDialog.getOpenFileNames(self, 'Open files', path_str,
+                                                               'Images (*.jpg *.jpeg *.png);;JPG files (*.jpg);;'
+                                                               'PNG files (*.png)')
+        # If the computer doesn't have a directory like that it will open the file explorer in the %HOMEPATH%
         else:
-            # A message box will appear telling the user that there is already an image displayed
-            msg = QtWidgets.QMessageBox()
-            msg.information(self.photo_viewer, "Image Displayed", "There is already an image displayed.\nRemove it to "
-                                                                 "open another one.")
+            file_names = QtWidgets.QFileDialog.getOpenFileNames(self, 'Open files', str(path),
+                                                               'Images (*.jpg *.jpeg *.png);;JPG files (*.jpg);;'
+                                                               'PNG files (*.png)')
+
+        # Check if the user has specified a path or just closed the file explorer
+        if file_names[0]:
+            self.open_images(file_names[0])
 
     # Method that removes the Image from the drop zone
     def remove_image(self):
@@ -792,6 +1231,11 @@ class App(QWidget):
             self.group_box.hide()
 
             self.classified = False
+            self.page_results = None
+            self.page_image = None
+            self.letter_index = None
+            self.display_id += 1
+            self.shown_job = None
 
     # Checks if the file that enters the drop zone is an image
     def dragEnterEvent(self, event):
@@ -807,45 +1251,24 @@ class App(QWidget):
         else:
             event.ignore()
 
-    # Method that is run when you drop an image in the drop zone
+    # Method that is run when you drop one or several images in the drop zone
     def dropEvent(self, event):
-        if self.photo_viewer.empty is True:
-            # Gets the file extension of the chosen file
-            file_path = event.mimeData().urls()[0].toLocalFile()
-            _, extension = os.path.splitext(file_path)
-            # If the file is not of type png or jpg an error message will apear
-            if extension == ".png" or extension == ".PNG" or extension == ".JPG" or extension == ".jpg" or \
-                    extension == ".JPEG" or extension == ".jpeg":
-                if event.mimeData().hasImage:
-                    event.setDropAction(Qt.CopyAction)
-                    file_path = event.mimeData().urls()[0].toLocalFile()
-                    self.image_path = file_path
-                    # Displays the image in the photoViewer label
-                    self.photo_viewer.set_photo_with_rectangle(pixmap=QPixmap(file_path))
-                    # Setting the position of the image to the upper right corner of the pixmap
-                    self.photo_viewer.photo.setPos(0, 0)
-                    # Fetches the filename from the path and sets it as the header
-                    path_list = str(file_path).split("/")
-                    self.file_name_label.setText("Filename: " + path_list[-1])
-
-                    # Sets the zoomlevel of the image
-                    self.photo_viewer.zoom_label.setText("Zoom level: " + str(int(self.photo_viewer.zoom_level)) + "%")
-
-                    # Displays the group box
-                    self.group_box.show()
-                    event.accept()
-                else:
-                    event.ignore()
-            else:
-                event.ignore()
-                # A message box will appear telling the user that the file type must be jpg or png
-                msg = QtWidgets.QMessageBox()
-                msg.information(self, "Wrong File Type", "The file must be of type jpg or png")
+        # Gets the file extensions of the chosen files
+        file_paths = [url.toLocalFile() for url in event.mimeData().urls()]
+        image_paths = [file_path for file_path in file_paths
+                       if os.path.splitext(file_path)[1].lower() in (".png", ".jpg", ".jpeg")]
+        if image_paths and event.mimeData().hasImage:
+            event.setDropAction(Qt.CopyAction)
+            event.accept()
+            self.open_images(image_paths)
         else:
-            # A message box will appear telling the user that there is already an image displayed
+            event.ignore()
+
+        # If a file is not of type png or jpg an error message will apear
+        if len(image_paths) != len(file_paths):
+            # A message box will appear telling the user that the file type must be jpg or png
             msg = QtWidgets.QMessageBox()
-            msg.information(self.photo_viewer, "Image Displayed", "There is already an image displayed.\nRemove it to "
-                                                                 "open another one.")
+            msg.information(self, "Wrong File Type", "The files must be of type jpg or png")
 
 
 # Starts the application
@@ -0,0 +1,34 @@
+import hashlib
+import os
+
+import numpy as np
+
+
+# Returns a hash of the pixels in an image. The shape and the type of the image is part of the hash so that two
+# images with the same bytes but different shapes does not get the same hash.
+def image_hash(image):
+    image = np.ascontiguousarray(image)
+    hasher = hashlib.sha1()
+    hasher.update(str(image.shape).encode())
+    hasher.update(str(image.dtype).encode())
+    hasher.update(image.data)
+    return hasher.hexdigest()
+
+
+# Hashes of files that have already been read, saved together with the modification time and size of the file
+_file_hashes = {}
+
+
+# Returns a hash of the content of a file. The file is only read again if it has been changed.
+def file_hash(path):
+    stat = os.stat(path)
+    saved = _file_hashes.get(path)
+    if saved is not None and saved[0] == (stat.st_mtime, stat.st_size):
+        return saved[1]
+
+    hasher = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            hasher.update(block)
+    _file_hashes[path] = ((stat.st_mtime, stat.st_size), hasher.hexdigest())
+    return hasher.hexdigest()
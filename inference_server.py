@@ -0,0 +1,325 @@
+import argparse
+import io
+import json
+import math
+import os
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+import page_scale
+import segmentation_to_classifier as segToClass
+from hashing import file_hash
+
+
+# The address the server listens on if no other address is given. The server only listens on the local computer.
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+# Environment variable with the address of a running server. If it is set the user interface uses the server.
+SERVER_ENV = "DSS_INFERENCE_SERVER"
+
+
+# Saves arrays to the bytes of a .npz file
+def to_npz(**arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+# Loads the arrays in the bytes of a .npz file. Pickled objects are not allowed, so only plain arrays can be sent.
+def from_npz(data):
+    with np.load(io.BytesIO(data), allow_pickle=False) as saved:
+        return {name: saved[name] for name in saved.files}
+
+
+# Saves a list of letter images, where some of the images can be None, to the bytes of a .npz file
+def images_to_npz(images):
+    arrays = {"image_" + str(i): image for i, image in enumerate(images) if image is not None}
+    return to_npz(count=np.array(len(images)), **arrays)
+
+
+# Loads a list of letter images saved with images_to_npz
+def images_from_npz(data):
+    arrays = from_npz(data)
+    return [arrays.get("image_" + str(i)) for i in range(int(arrays["count"]))]
+
+
+# A request to classify some letter images, that is answered when the batch it is part of has been classified. caller
+# is the thread that made the request.
+class _Request:
+    def __init__(self, images, caller):
+        self.images = images
+        self.caller = caller
+        self.probabilities = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# Classifier that collects the letters that are classified at the same time by different threads and classifies them
+# together in one batch. While other threads are classifying letters that are not in the batch yet, the batch waits up
+# to max_delay seconds for them, and is classified when the time is up or when it has max_batch letters. A single
+# caller classifying one letter after the other never waits. Requests with more than max_batch letters are split into
+# several batches. max_delay can be set to 0 to never wait.
+# It can be used everywhere a Classifier is used.
+class BatchingClassifier:
+    def __init__(self, classifier, max_batch=64, max_delay=0.005):
+        self.classifier = classifier
+        self.classes = classifier.classes
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+
+        # How many threads are waiting for their letters to be classified
+        self.callers = 0
+        self.callers_lock = threading.Lock()
+
+        # How many batches and letters have been classified
+        self.batches = 0
+        self.letters = 0
+
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+
+    # Returns the probabilities of the classes for a list of letter images, after waiting for the batches they are in.
+    # The images are split into requests of at most max_batch letters.
+    def probabilities(self, images):
+        if len(images) == 0:
+            return np.empty((0, len(self.classes)), dtype=np.float32)
+
+        caller = threading.get_ident()
+        requests = [_Request(images[start:start + self.max_batch], caller)
+                    for start in range(0, len(images), self.max_batch)]
+        with self.callers_lock:
+            self.callers += 1
+        try:
+            for request in requests:
+                self.requests.put(request)
+            for request in requests:
+                request.done.wait()
+        finally:
+            with self.callers_lock:
+                self.callers -= 1
+
+        for request in requests:
+            if request.error is not None:
+                raise request.error
+        return np.concatenate([request.probabilities for request in requests])
+
+    # Collects the requests into batches and classifies them, one batch at a time
+    def _run(self):
+        # A request that did not fit in the last batch, which starts the next one
+        held = None
+        while True:
+            pending = [held if held is not None else self.requests.get()]
+            held = None
+            count = len(pending[0].images)
+            # The threads that have a request in the batch
+            callers = {pending[0].caller}
+            deadline = time.monotonic() + self.max_delay
+
+            # Takes the requests that are already there, and waits for requests from the other threads that are
+            # classifying letters until the deadline or until the batch is full
+            while count < self.max_batch:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.callers <= len(callers):
+                        break
+                    try:
+                        request = self.requests.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                if count + len(request.images) > self.max_batch:
+                    held = request
+                    break
+                pending.append(request)
+                callers.add(request.caller)
+                count += len(request.images)
+
+            try:
+                probabilities = self.classifier.Probabilities([image for request in pending
+                                                               for image in request.images])
+            except Exception as error:
+                for request in pending:
+                    request.error = error
+                    request.done.set()
+                continue
+
+            self.batches += 1
+            self.letters += count
+            start = 0
+            for request in pending:
+                request.probabilities = probabilities[start:start + len(request.images)]
+                start += len(request.images)
+                request.done.set()
+
+    def SimplyClassify(self, image):
+        result = self.probabilities([image])[0]
+        confidence = np.argmax(result)
+        return self.classes[confidence], result[confidence] * 100
+
+    def Classify(self, letters):
+        if len(letters) == 0:
+            return letters
+
+        results = self.probabilities([letter.image for letter in letters])
+        predictions = np.argmax(results, axis=1)
+        for i, prediction in enumerate(predictions):
+            letters[i].add_label(self.classes[prediction], math.trunc(float(results[i, prediction]) * 100))
+        return letters
+
+
+# Answers the requests to the server:
+# POST /classify          the letter images saved with images_to_npz. Answers with the labels and confidences as json.
+# POST /segment?varied=1  the image of a page saved as "image" in a .npz file. Answers with the boxes, labels and
+#                         confidences of the letters and the image they were cut from, as a .npz file.
+# GET /status             the model and the hash of its file, and how many batches and letters the server has
+#                         classified, as json.
+class _Handler(BaseHTTPRequestHandler):
+    def _send(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, answer):
+        self._send(json.dumps(answer).encode(), "application/json")
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/status":
+            self.send_error(404)
+            return
+        batcher = self.server.batcher
+        self._send_json({"model": self.server.model_path, "model_hash": self.server.model_hash,
+                         "batches": batcher.batches, "letters": batcher.letters})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if url.path == "/classify":
+                results = self.server.batcher.probabilities(images_from_npz(body))
+                predictions = np.argmax(results, axis=1)
+                self._send_json({"labels": [segToClass.CLASSES[i] for i in predictions],
+                                 "confidences": [float(results[i, p]) * 100 for i, p in enumerate(predictions)]})
+            elif url.path == "/segment":
+                varied_background = parse_qs(url.query).get("varied", ["0"])[0] == "1"
+                image = from_npz(body)["image"]
+                if varied_background:
+                    letters = self.server.segmentor.segment_varied_background(image, self.server.batcher)
+                else:
+                    letters = self.server.segmentor.segment_clear_background(image, self.server.batcher)
+                source = letters.source if letters.source is not None else np.zeros((0, 0), dtype=np.uint8)
+                self._send(to_npz(boxes=letters.boxes, label_ids=letters.label_ids,
+                                  confidences=letters.confidences, source=source), "application/octet-stream")
+            else:
+                self.send_error(404)
+        except Exception as error:
+            self.send_error(500, str(error))
+
+    # Only logs the errors, not every request
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+# Server that keeps the classifier loaded and classifies the letters of all its requests in shared batches
+class InferenceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=DEFAULT_ADDRESS, model_path=segToClass.MODEL_PATH, engine="tesseract",
+                 max_batch=64, max_delay=0.005):
+        host, port = address.rsplit(":", 1)
+        super(InferenceServer, self).__init__((host, int(port)), _Handler)
+        self.model_path = model_path
+        self.model_hash = file_hash(model_path)
+        self.batcher = BatchingClassifier(segToClass.Classifier(model_path), max_batch, max_delay)
+        self.segmentor = segToClass.Segmentor(letter_height=page_scale.CANONICAL_LETTER_HEIGHT, engine=engine,
+                                              line_workers=os.cpu_count())
+
+        # The letters that are checked while the wide boxes are split are also classified in the shared batches
+        segToClass.set_letter_checker(self.batcher)
+
+
+# Client for a running server. It can be used everywhere a Classifier is used, and can also segment whole images.
+class InferenceClient:
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=600):
+        self.url = "http://" + address
+        self.timeout = timeout
+        self.classes = segToClass.CLASSES
+
+    def _request(self, path, body=None):
+        request = urllib.request.Request(self.url + path, data=body, method="GET" if body is None else "POST",
+                                         headers={"Content-Type": "application/octet-stream"})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return response.read()
+
+    # Returns the model of the server and the hash of its file, and how many batches and letters the server has
+    # classified, or raises OSError if it can't be reached
+    def status(self):
+        return json.loads(self._request("/status"))
+
+    # Returns the labels and confidences (in percent) of a list of letter images
+    def _classify(self, images):
+        answer = json.loads(self._request("/classify", images_to_npz(images)))
+        return answer["labels"], answer["confidences"]
+
+    def SimplyClassify(self, image):
+        labels, confidences = self._classify([image])
+        return labels[0], confidences[0]
+
+    def Classify(self, letters):
+        if len(letters) == 0:
+            return letters
+
+        labels, confidences = self._classify([letter.image for letter in letters])
+        for i, (label, confidence) in enumerate(zip(labels, confidences)):
+            letters[i].add_label(label, math.trunc(confidence))
+        return letters
+
+    # Segments and classifies an image on the server and returns the letters. The letters do not have their images,
+    # but the table has the image they were cut from.
+    def segment(self, image, varied_background):
+        arrays = from_npz(self._request("/segment?varied=" + ("1" if varied_background else "0"),
+                                        to_npz(image=image)))
+        source = arrays["source"] if arrays["source"].size > 0 else None
+        return segToClass.LetterTable.from_columns(arrays["boxes"], arrays["label_ids"], arrays["confidences"],
+                                                   source=source)
+
+
+# Returns a client for the server in the DSS_INFERENCE_SERVER environment variable, or None if it is not set
+def client_from_environment():
+    address = os.environ.get(SERVER_ENV)
+    if not address:
+        return None
+    return InferenceClient(address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keeps the classifier loaded and segments and classifies images "
+                                                 "for other programs on this computer")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port to listen on")
+    parser.add_argument("--model", default=segToClass.MODEL_PATH, help="path to the model")
+    parser.add_argument("--engine", default="tesseract", choices=segToClass.ENGINES)
+    parser.add_argument("--max-batch", type=int, default=64, help="most letters classified in one batch")
+    parser.add_argument("--max-delay", type=float, default=5, help="milliseconds a letter waits for other letters")
+    args = parser.parse_args()
+
+    server = InferenceServer(args.address, args.model, args.engine, args.max_batch, args.max_delay / 1000)
+    print("Serving on http://" + args.address + ", set " + SERVER_ENV + "=" + args.address + " to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from shared_images import AttachedImage, SharedImage, window_in
+
+
+# Finds the lines of text in a binarized image with black letters on a white background, from the amount of black
+# pixels on each row (the horizontal projection profile). Rows with more than threshold times the most black pixels on
+# a row are text, and text rows closer than min_gap rows are on the same line. Lines lower than min_height are noise.
+# The image is split between two lines on the row with the fewest black pixels, so that letters that go above or
+# below the line are not cut more than needed. Returns a list of (top, bottom) rows, one for each line, from the top.
+def find_text_lines(binary, threshold=0.05, min_gap=3, min_height=5):
+    profile = np.count_nonzero(binary < 128, axis=1)
+    if profile.max() == 0:
+        return []
+
+    # Finds where the runs of text rows start and end
+    text = np.concatenate([[False], profile > max(threshold * profile.max(), 1), [False]])
+    changes = np.flatnonzero(text[1:] != text[:-1])
+    runs = list(zip(changes[0::2], changes[1::2]))
+
+    # Merges runs that are close to each other
+    lines = []
+    for start, end in runs:
+        if lines and start - lines[-1][1] < min_gap:
+            lines[-1] = (lines[-1][0], end)
+        else:
+            lines.append((start, end))
+    lines = [(start, end) for start, end in lines if end - start >= min_height]
+    if not lines:
+        return []
+
+    # Splits the image between the lines at the rows with the fewest black pixels
+    splits = [0]
+    for (_, end), (start, _) in zip(lines[:-1], lines[1:]):
+        splits.append(end + int(np.argmin(profile[end:start])) if start > end else end)
+    splits.append(len(profile))
+
+    return [(splits[i], splits[i + 1]) for i in range(len(lines))]
+
+
+# Moves the letters of a line to their coordinates in the whole image and orders them from right to left, which is
+# the reading order of the line
+def _place_line(letters, h_img, bottom):
+    # Imported here since segmentation_to_classifier imports this module
+    from segmentation_to_classifier import NO_COORDINATE
+
+    # y and h are counted from the bottom of the image, so they are moved by the rows below the line
+    letters.boxes[:, 1] += h_img - bottom
+    letters.boxes[:, 3] += h_img - bottom
+    in_word = letters.word_boxes[:, 0] != NO_COORDINATE
+    letters.word_boxes[in_word, 1] += h_img - bottom
+    letters.word_boxes[in_word, 3] += h_img - bottom
+
+    order = np.argsort(-letters.boxes[:, 2], kind="stable")
+    return letters.take(order)
+
+
+# Segments one line of the image and returns its letters with coordinates in the whole image. The letters are ordered
+# from right to left, which is the reading order of the line.
+def _segment_line(segmentor, binary, top, bottom, classifier, deadline):
+    letters = segmentor.segment_letters(binary[top:bottom], deadline)
+    if classifier is not None and len(letters) > 0:
+        letters = classifier.Classify(letters)
+
+    return _place_line(letters, binary.shape[0], bottom)
+
+
+# Segments a binarized image line by line, with the lines segmented at the same time on a pool of threads.
+# If a classifier is given the letters of each line are also classified on the pool. Returns a LetterTable with the
+# letters line by line from the top, and from right to left on each line. deadline is when the image should be done.
+def segment_lines(segmentor, binary, classifier=None, workers=None, deadline=None):
+    # Imported here since segmentation_to_classifier imports this module
+    from segmentation_to_classifier import LetterTable
+
+    lines = find_text_lines(binary)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        tables = list(pool.map(lambda line: _segment_line(segmentor, binary, line[0], line[1], classifier,
+                                                             deadline), lines))
+
+    return LetterTable.concatenate(tables, source=binary)
+
+
+# The segmentors of a worker process, saved by their engine, word workers, splitter and time budget
+_worker_segmentors = {}
+
+
+def _worker_segmentor(engine, word_workers, splitter, time_budget):
+    # Imported here since segmentation_to_classifier imports this module
+    from segmentation_to_classifier import Segmentor
+
+    key = (engine, word_workers, splitter, time_budget)
+    if key not in _worker_segmentors:
+        _worker_segmentors[key] = Segmentor(stage_cache=None, engine=engine, word_workers=word_workers,
+                                            splitter=splitter, time_budget=time_budget)
+    return _worker_segmentors[key]
+
+
+# Segments one line of the image and returns the boxes of its letters in the whole image and where their images are.
+# An image that is a part of the whole image is returned as its rows and columns in it, so that it does not have to be
+# sent back to the process that owns the image. Other images, like the letters cut from straightened words, are
+# returned as they are, by the index of their letter. The strategies the letters were split with and the wide boxes
+# they were split from are also returned.
+def _line_windows(segmentor, binary, top, bottom, deadline):
+    letters = _place_line(segmentor.segment_letters(binary[top:bottom], deadline), binary.shape[0], bottom)
+
+    windows = [window_in(image, binary) for image in letters.images]
+    copies = {i: image for i, image in enumerate(letters.images) if windows[i] is None and image is not None}
+    return letters.boxes.copy(), windows, copies, letters.strategies.copy(), letters.word_boxes.copy()
+
+
+# Segments one line of a shared image in a worker process. The deadline is from time.monotonic, which is the same
+# clock in all the processes.
+def _segment_shared_line(handle, top, bottom, engine, word_workers, splitter, time_budget, deadline):
+    attached = AttachedImage(handle)
+    try:
+        return _line_windows(_worker_segmentor(engine, word_workers, splitter, time_budget), attached.array, top,
+                             bottom, deadline)
+    finally:
+        attached.close()
+
+
+# The pool of processes used by segment_lines_in_processes. It is kept between images, since starting the processes
+# takes longer than segmenting a line.
+_process_pool = None
+_process_pool_workers = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool(workers):
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown()
+            _process_pool = ProcessPoolExecutor(max_workers=workers)
+            _process_pool_workers = workers
+        return _process_pool
+
+
+# Stops the processes used by segment_lines_in_processes. They are started again the next time they are needed.
+def shutdown_process_pool():
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown()
+        _process_pool = None
+        _process_pool_workers = None
+
+
+# Segments a binarized image line by line like segment_lines, but with the lines segmented on a pool of processes.
+# The image is copied into shared memory once, and only its handle and the rows of the lines are sent to the
+# processes, which send back the boxes of the letters and where their images are in the image. The shared memory is
+# removed when all the lines are done. The classifier stays in this process, so if it is given the letters of the
+# whole image are classified in one batch afterwards. The processes split the wide boxes with their own copy of the
+# classifier in MODEL_PATH.
+def segment_lines_in_processes(segmentor, binary, classifier=None, workers=None, deadline=None):
+    # Imported here since segmentation_to_classifier imports this module
+    from segmentation_to_classifier import LetterTable, NO_LABEL
+
+    lines = find_text_lines(binary)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = _get_process_pool(max(workers, 1))
+
+    with SharedImage(binary) as shared:
+        futures = [pool.submit(_segment_shared_line, shared.handle, top, bottom, segmentor.engine,
+                               segmentor.word_workers, segmentor.splitter, segmentor.time_budget, deadline)
+                   for top, bottom in lines]
+        # Waits for all the lines before the shared memory is removed, also if one of them fails
+        wait(futures)
+    results = [future.result() for future in futures]
+
+    tables = []
+    for boxes, windows, copies, strategies, word_boxes in results:
+        images = [binary[window[0]:window[1], window[2]:window[3]] if window is not None else copies.get(i)
+                  for i, window in enumerate(windows)]
+        tables.append(LetterTable.from_columns(boxes, np.full(len(boxes), NO_LABEL, dtype=np.uint8),
+                                               np.full(len(boxes), np.nan, dtype=np.float16), images,
+                                               strategies=strategies, word_boxes=word_boxes))
+    letters = LetterTable.concatenate(tables, source=binary)
+
+    if classifier is not None and len(letters) > 0:
+        letters = classifier.Classify(letters)
+    return letters
@@ -0,0 +1,188 @@
+import copy
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+import preprocessing
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+# The memory each stage is expected to use before it has been measured, per unit of its load: bytes per pixel for
+# the preprocessing, bytes per pixel and line worker for the segmentation and bytes per letter in a batch for the
+# classification. They are a bit above what was measured on test.jpg and on test.jpg scaled up three times.
+DEFAULT_COSTS = {"preprocess": 8.0, "segment": 6.0, "classify": 1024.0 * 1024}
+
+# How often the memory is sampled while a stage runs, in seconds
+SAMPLE_INTERVAL = 0.005
+
+
+# Returns how much memory the process uses now (the resident set size) in bytes, or None if it can't be measured
+def current_rss():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Returns the most memory the process has used since it started in bytes, or None if it can't be measured
+def peak_rss():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux counts it in kilobytes and macOS in bytes
+        return peak if sys.platform == "darwin" else peak * 1024
+    if psutil is not None and hasattr(psutil.Process().memory_info(), "peak_wset"):
+        return psutil.Process().memory_info().peak_wset
+    return None
+
+
+# Keeps the memory used to segment and classify a page under a budget (in bytes) by choosing how many line workers
+# the page is segmented on and how many letters are given to the classifier at once, and by keeping the outputs of the
+# preprocessing stages in its own stage cache of a quarter of the budget. The pool width and batch size are at most max_workers and max_batch, and
+# are made smaller when the page would not fit in the budget otherwise, which is logged.
+# The governor measures the highest memory use (the RSS high-water mark) of each stage of every page, and plans the
+# next pages from the most memory each stage has used per pixel, line worker or letter. The stages run after each
+# other, so each of them can use all the memory that is left of the budget.
+# It is used by setting the memory_governor of a Segmentor.
+class MemoryGovernor:
+    def __init__(self, budget, max_workers=None, max_batch=256, min_batch=8):
+        self.budget = budget
+        self.max_workers = max_workers if max_workers is not None else os.cpu_count() or 1
+        self.max_batch = max_batch
+        self.min_batch = min_batch
+        self.costs = dict(DEFAULT_COSTS)
+        # The stage cache used instead of the cache of a segmentor that can grow larger than a quarter of the budget
+        self.stage_cache = preprocessing.StageCache(budget // 4)
+        # The stages that have been measured, and the highest memory each of them has used above what the process used
+        # when it started
+        self.measured = set()
+        self.stage_peaks = {}
+        self.lock = threading.Lock()
+
+        if current_rss() is None:
+            logger.warning("The memory of the process can't be measured here, so the memory governor plans with "
+                           "its default costs. Install psutil to measure it.")
+
+    # Measures the highest memory use of a stage while the with statement runs, and saves it per unit of the load of
+    # the stage (the pixels, pixels times line workers or letters it works on)
+    @contextmanager
+    def measure(self, stage, load):
+        start = current_rss()
+        if start is None:
+            yield
+            return
+        start_peak = peak_rss()
+
+        highest = [start]
+        done = threading.Event()
+
+        def sample():
+            while not done.wait(SAMPLE_INTERVAL):
+                rss = current_rss()
+                if rss > highest[0]:
+                    highest[0] = rss
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        try:
+            yield
+        finally:
+            done.set()
+            sampler.join()
+            peak = max(highest[0], current_rss())
+            # The high-water mark of the process is exact, but only tells about the stage if the stage raised it
+            end_peak = peak_rss()
+            if start_peak is not None and end_peak is not None and end_peak > start_peak:
+                peak = max(peak, end_peak)
+
+            used = peak - start
+            with self.lock:
+                self.stage_peaks[stage] = max(self.stage_peaks.get(stage, 0), used)
+                if load > 0:
+                    cost = used / load
+                    if stage in self.measured:
+                        self.costs[stage] = max(self.costs[stage], cost)
+                    else:
+                        self.costs[stage] = cost
+                        self.measured.add(stage)
+
+    # Returns the number of line workers and the batch size to segment and classify an image with the shape, and
+    # logs when they are smaller than their maximum because of the budget
+    def plan(self, shape):
+        pixels = shape[0] * shape[1]
+        rss = current_rss()
+        available = self.budget - (rss if rss is not None else 0)
+
+        if self.costs["preprocess"] * pixels > available:
+            logger.warning("Preprocessing a %dx%d image is expected to use %.0f MB, but only %.0f MB of the memory "
+                           "budget is left", shape[1], shape[0], self.costs["preprocess"] * pixels / 2 ** 20,
+                           max(available, 0) / 2 ** 20)
+
+        workers = int(available // max(self.costs["segment"] * pixels, 1))
+        workers = min(max(workers, 1), self.max_workers)
+        if workers < self.max_workers:
+            logger.info("Memory budget: segmenting the %dx%d image on %d line workers instead of %d", shape[1],
+                        shape[0], workers, self.max_workers)
+
+        batch = int(available // max(self.costs["classify"], 1))
+        batch = min(max(batch, self.min_batch), self.max_batch)
+        if batch < self.max_batch:
+            logger.info("Memory budget: classifying %d letters at a time instead of %d", batch, self.max_batch)
+
+        return workers, batch
+
+    # Returns the stage cache to preprocess a page with: the cache of the segmentor, or the cache of the governor if the
+    # cache of the segmentor can grow larger than it. The cache of the segmentor is not limited itself, since it can be
+    # shared with other segmentors.
+    def stage_cache_for(self, cache):
+        if cache is not None and cache.max_bytes > self.stage_cache.max_bytes:
+            return self.stage_cache
+        return cache
+
+    # Preprocesses, segments and classifies an image that has been rescaled by the segmentor, with the pool width and
+    # batch size from plan, and measures each stage. The letters are classified after the whole page is segmented
+    # instead of on the line workers, so that the stages can be measured one at a time. The segmentor and the
+    # classifier are not changed, since they can be shared with other pages and threads: the page is preprocessed with
+    # the stage cache from stage_cache_for, segmented on a copy of the segmentor, and the letters are given to the
+    # classifier batch letters at a time.
+    def segment_page(self, segmentor, img, stages, classifier=None, deadline=None):
+        workers, batch = self.plan(img.shape)
+        pixels = img.shape[0] * img.shape[1]
+
+        with self.measure("preprocess", pixels):
+            binary = preprocessing.run_stages(img, stages, self.stage_cache_for(segmentor.stage_cache))
+
+        # Segmentors that do not segment line by line are left that way, since they can split the page differently
+        if segmentor.line_workers:
+            segmentor = copy.copy(segmentor)
+            segmentor.line_workers = workers
+        else:
+            workers = 1
+        with self.measure("segment", pixels * workers):
+            letters = segmentor.segment_page(binary, None, deadline)
+
+        if classifier is not None and len(letters) > 0:
+            with self.measure("classify", min(batch, len(letters))):
+                for start in range(0, len(letters), batch):
+                    indices = np.arange(start, min(start + batch, len(letters)))
+                    chunk = classifier.Classify(letters.take(indices))
+                    letters.label_ids[indices] = chunk.label_ids
+                    letters.confidences[indices] = chunk.confidences
+        return letters
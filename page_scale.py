@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+
+# The height in pixels the letters are scaled to before the image is segmented. The constants used when segmenting,
+# like the min_letter_width in word_splitter, are set by looking at test.jpg where the letters are about this high.
+CANONICAL_LETTER_HEIGHT = 30
+
+# Connected components smaller than this many pixels are seen as noise when the letter height is estimated
+MIN_COMPONENT_AREA = 30
+
+
+# Estimates the height of the letters in an image from the connected components of the thresholded image.
+# Returns None if no letters are found.
+def estimate_letter_height(image):
+    if len(image.shape) == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    else:
+        gray = image
+
+    # The letters are dark on a light background, so the thresholded image is inverted to make the letters white
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+
+    # Skips the background, which is the first component
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+
+    # Removes noise and components that are too large to be letters, like the border of the scroll
+    letters = (areas >= MIN_COMPONENT_AREA) & (heights >= 5) & (heights < gray.shape[0] / 4)
+    if not np.any(letters):
+        return None
+
+    return float(np.median(heights[letters]))
+
+
+# Scales an image down so that the letters in it gets the letter_height. Images where the letters already are
+# smaller than tolerance * letter_height are not scaled. Returns the image and the scale factor it was scaled with.
+def rescale_to_letter_height(image, letter_height=CANONICAL_LETTER_HEIGHT, tolerance=1.25):
+    estimated_height = estimate_letter_height(image)
+    if estimated_height is None or estimated_height <= letter_height * tolerance:
+        return image, 1.0
+
+    scale = letter_height / estimated_height
+    scaled = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return scaled, scale
+
+
+# Maps the boxes of the letters in a LetterTable from a scaled image back to the original image.
+# The y and h coordinates are counted from the bottom of the images, so they are converted to rows before scaling.
+def scale_boxes_back(table, scaled_shape, original_shape):
+    if len(table) == 0:
+        return table
+
+    scale_x = original_shape[1] / scaled_shape[1]
+    scale_y = original_shape[0] / scaled_shape[0]
+
+    boxes = table.boxes.astype(np.float64)
+    top = (scaled_shape[0] - boxes[:, 3]) * scale_y
+    bottom = (scaled_shape[0] - boxes[:, 1]) * scale_y
+
+    table.boxes[:, 0] = np.round(boxes[:, 0] * scale_x)
+    table.boxes[:, 2] = np.round(boxes[:, 2] * scale_x)
+    table.boxes[:, 1] = original_shape[0] - np.round(bottom)
+    table.boxes[:, 3] = original_shape[0] - np.round(top)
+    return table
@@ -0,0 +1,401 @@
+import argparse
+import importlib.util
+import inspect
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import page_scale
+import segmentation_to_classifier as segToClass
+
+
+# The functions the harness compares, from the smallest to the whole page:
+# "unshear"                    image_straighten.unshear on the thresholded words
+# "skeletonize"                skeletonize on the straightened words
+# "segmentation_point_finder"  the segmentation points of the columns of the skeletons
+# "word_cropper"               the letters the words are cropped into from the segmentation points
+# "classify"                   the letters classified one at a time with SimplyClassify by the reference, and in
+#                              batches with Classify by the candidate
+# "page"                       the letters segment_clear_background (or segment_varied_background) finds on the pages
+# "refine"                     the letters of the pages segmented by the candidate without a time budget, and with no
+#                              time left (so that no box is split) and then refined with Segmentor.refine. Both should
+#                              be the same letters, but the letters of a line can be in another order.
+FUNCTIONS = ["unshear", "skeletonize", "segmentation_point_finder", "word_cropper", "classify", "page", "refine"]
+
+# Where each function is found in an implementation. The functions that are not in an implementation are taken from
+# segmentation_to_classifier, so that a candidate only needs to have the functions that were changed.
+_ATTRIBUTES = {"unshear": "img_straighten.unshear", "skeletonize": "skeletonize",
+               "segmentation_point_finder": "segmentation_point_finder", "word_cropper": "word_cropper",
+               "classify": "Classifier", "page": "Segmentor", "refine": "Segmentor"}
+
+# The minimum letter width word_splitter uses
+MIN_LETTER_WIDTH = 12
+
+# What implementations that do not have an option do instead, for the options that change the results
+WITHOUT_OPTION = {"engine": "tesseract", "letter_height": None}
+
+
+# Returns the module in a Python file, like a copy of segmentation_to_classifier.py from an older commit, or
+# segmentation_to_classifier itself if the path is None
+def load_implementation(path, name):
+    if path is None:
+        return segToClass
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Makes an implementation check the letters while it splits words with the classifier of a model. Older
+# implementations load the model from a fixed path in class_letter_checker, which is then replaced by one that loads
+# the model the same way from the model path.
+def use_model(module, model):
+    if hasattr(module, "MODEL_PATH"):
+        module.MODEL_PATH = model
+    if not hasattr(module, "set_letter_checker"):
+        def class_letter_checker(image):
+            _, confidence_value = module.Classifier(model).SimplyClassify(image)
+            return confidence_value
+        module.class_letter_checker = class_letter_checker
+
+
+# Returns the options a function or class accepts as keyword arguments. Older implementations, like the Segmentor
+# from before it had options, accept fewer of them.
+def accepted_options(function, **options):
+    parameters = inspect.signature(function).parameters
+    return {name: value for name, value in options.items() if name in parameters}
+
+
+# Returns whether a function or class accepts an option as a keyword argument
+def accepts(function, name):
+    return name in inspect.signature(function).parameters
+
+
+# Returns the options of the reference and of the candidate of a function or class, with the options each of them
+# accepts, so that both are run with the same settings. An option in WITHOUT_OPTION that one of them does not have is
+# set to what implementations without it do for both. If the option was chosen by the user (its name is in chosen), a
+# ValueError is raised instead, since the user asked for something the implementation can't do.
+def same_options(reference, candidate, chosen=(), **options):
+    for function in (reference, candidate):
+        for name, value in WITHOUT_OPTION.items():
+            if name in options and options[name] != value and not accepts(function, name):
+                if name in chosen:
+                    raise ValueError(function.__module__ + "." + function.__name__ + " has no option '" + name +
+                                     "', so it can't be compared with " + name + "=" + str(options[name]) + ". Use " +
+                                     name + "=" + str(value) + " instead.")
+                options[name] = value
+    return accepted_options(reference, **options), accepted_options(candidate, **options)
+
+
+# Returns letters as a LetterTable. Implementations from before the LetterTable return lists of Letter objects.
+def as_table(letters):
+    if isinstance(letters, segToClass.LetterTable):
+        return letters
+    table = segToClass.LetterTable(capacity=max(len(letters), 1))
+    for letter in letters:
+        new_letter = table.append(letter.image, letter.x, letter.y, letter.w, letter.h)
+        if letter.label is not None:
+            new_letter.add_label(letter.label, letter.confidence)
+    return table
+
+
+# Returns the function or class of an implementation used for one of the FUNCTIONS
+def implementation_of(module, function):
+    for candidate in (module, segToClass):
+        value = candidate
+        for attribute in _ATTRIBUTES[function].split("."):
+            value = getattr(value, attribute, None)
+        if value is not None:
+            return value
+    raise ValueError("Unknown function '" + str(function) + "', choose one of: " + ", ".join(FUNCTIONS))
+
+
+# The pages, the crops of all the boxes on them and the crops of the words that are split into letters, which
+# the functions are compared on
+class Corpus:
+    def __init__(self, paths, engine="components", varied=False):
+        segmentor = segToClass.Segmentor(engine=engine, stage_cache=None)
+        self.pages = []
+        self.crops = []
+        self.words = []
+        for path in paths:
+            image = cv2.imread(path)
+            if image is None:
+                raise ValueError("The image " + str(path) + " could not be read")
+            self.pages.append(image)
+
+            if varied:
+                binary = segmentor.binarize_varied_background(image)
+            else:
+                binary = segmentor.binarize_clear_background(image)
+            binary = segToClass.denoise.denoise(binary, segmentor.denoiser)
+            h_img = binary.shape[0]
+            for x, y, w, h in segmentor.find_boxes(binary):
+                crop = binary[(h_img - h):(h_img - y), x:w]
+                if crop.shape[0] == 0 or crop.shape[1] == 0:
+                    continue
+                self.crops.append(crop)
+                # The same wide boxes that split_box splits
+                if crop.shape[1] > 30 and segToClass.class_letter_checker(crop) <= 90:
+                    self.words.append(crop)
+
+
+# Returns the sums of the columns of a skeleton in whole pixels, as word_splitter counts them
+def column_pixels(skel):
+    return [int(column) for column in skel.sum(axis=0) // 255]
+
+
+# Returns the segmentation points word_splitter crops a word with, with the points it adds at the left of the word
+def cropping_points(seg_points):
+    seg_points = list(seg_points)
+    if not seg_points:
+        seg_points.append(0)
+    elif seg_points[-1] <= MIN_LETTER_WIDTH / 2 and len(seg_points) > 1:
+        seg_points[-1] = 0
+    elif seg_points[-1] > MIN_LETTER_WIDTH / 2:
+        seg_points.append(0)
+    return seg_points
+
+
+# Returns whether two images differ in more than a fraction tolerance of their pixels, and the fraction that differs
+def diff_images(reference, candidate, tolerance):
+    if reference.shape != candidate.shape:
+        return True, 1.0
+    different = float(np.mean(reference != candidate))
+    return different > tolerance, different
+
+
+# Returns the letters of a LetterTable ordered by their boxes, for tables with the same letters in another order
+def in_box_order(letters):
+    return letters.take(np.lexsort(letters.boxes.T[::-1]))
+
+
+# Returns whether two lists of segmentation points differ
+def diff_points(reference, candidate):
+    return list(reference) != list(candidate), 0.0 if list(reference) == list(candidate) else 1.0
+
+
+# Returns whether two LetterTables, or lists of Letter objects, differ: when they have a different amount of letters,
+# a box that differs more than box_tolerance pixels, a different label or a confidence that differs more than
+# confidence_tolerance. Also returns the largest difference of a box or confidence.
+def diff_letters(reference, candidate, box_tolerance, confidence_tolerance):
+    reference, candidate = as_table(reference), as_table(candidate)
+    if len(reference) != len(candidate):
+        return True, float(abs(len(reference) - len(candidate)))
+    if len(reference) == 0:
+        return False, 0.0
+
+    box_diff = int(np.abs(reference.boxes.astype(np.int64) - candidate.boxes).max())
+    labels_differ = bool(np.any(reference.label_ids != candidate.label_ids))
+
+    # Letters that are not classified have no confidence in both tables
+    reference_confidences = np.nan_to_num(reference.confidences.astype(np.float64), nan=-1.0)
+    candidate_confidences = np.nan_to_num(candidate.confidences.astype(np.float64), nan=-1.0)
+    confidence_diff = float(np.abs(reference_confidences - candidate_confidences).max())
+
+    mismatch = box_diff > box_tolerance or labels_differ or confidence_diff > confidence_tolerance
+    return mismatch, max(float(box_diff), confidence_diff)
+
+
+# Runs the reference and the candidate of a function on each case and compares their outputs. Returns the report of
+# the function: how many cases there were and how many of them differed, the largest difference and how many seconds
+# the reference and the candidate took.
+def compare_function(name, cases, run_reference, run_candidate, diff):
+    report = {"function": name, "cases": len(cases), "mismatches": 0, "max_diff": 0.0, "reference_seconds": 0.0,
+              "candidate_seconds": 0.0, "first_mismatch": None}
+    for index, case in enumerate(cases):
+        start = time.perf_counter()
+        reference = run_reference(case)
+        report["reference_seconds"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        candidate = run_candidate(case)
+        report["candidate_seconds"] += time.perf_counter() - start
+
+        mismatch, difference = diff(reference, candidate)
+        report["max_diff"] = max(report["max_diff"], difference)
+        if mismatch:
+            report["mismatches"] += 1
+            if report["first_mismatch"] is None:
+                report["first_mismatch"] = index
+    return report
+
+
+# Compares the functions of the reference and candidate implementations on the corpus. Each function gets the same
+# inputs in both, made with the reference, so that a difference is only reported for the function that caused it.
+# Returns a report for each of the functions.
+def run(corpus, reference, candidate, functions=FUNCTIONS, model=segToClass.MODEL_PATH, batch_size=256,
+        engine="components", varied=False, pixel_tolerance=0.0, box_tolerance=0, confidence_tolerance=1.0):
+    for function in functions:
+        if function not in FUNCTIONS:
+            raise ValueError("Unknown function '" + str(function) + "', choose one of: " + ", ".join(FUNCTIONS))
+
+    # The inputs of each step of word_splitter on the words, made with the reference
+    thresholds = [cv2.threshold(word, 127, 255, 1)[1] for word in corpus.words]
+    straighten = getattr(reference, "image_straighten", segToClass.image_straighten)
+    skeleton_inputs = [np.invert(straighten(word)) for word in corpus.words]
+    skeletons = [implementation_of(reference, "skeletonize")(image) for image in skeleton_inputs]
+    pixels = [column_pixels(skel) for skel in skeletons]
+    find_points = implementation_of(reference, "segmentation_point_finder")
+    points = [cropping_points(find_points(column, MIN_LETTER_WIDTH)) for column in pixels]
+
+    reports = []
+    for function in functions:
+        reference_function = implementation_of(reference, function)
+        candidate_function = implementation_of(candidate, function)
+
+        if function == "unshear":
+            reports.append(compare_function(function, thresholds, reference_function, candidate_function,
+                                            lambda a, b: diff_images(a, b, pixel_tolerance)))
+        elif function == "skeletonize":
+            reports.append(compare_function(function, skeleton_inputs, reference_function, candidate_function,
+                                            lambda a, b: diff_images(a, b, pixel_tolerance)))
+        elif function == "segmentation_point_finder":
+            reports.append(compare_function(function, pixels,
+                                            lambda case: reference_function(list(case), MIN_LETTER_WIDTH),
+                                            lambda case: candidate_function(list(case), MIN_LETTER_WIDTH),
+                                            diff_points))
+        elif function == "word_cropper":
+            cases = list(zip(points, pixels, corpus.words))
+            reports.append(compare_function(
+                function, cases,
+                lambda case: reference_function(list(case[0]), list(case[1]), case[2], MIN_LETTER_WIDTH),
+                lambda case: candidate_function(list(case[0]), list(case[1]), case[2], MIN_LETTER_WIDTH),
+                lambda a, b: diff_letters(a, b, box_tolerance, confidence_tolerance)))
+        elif function == "classify":
+            reports.append(compare_classify(corpus.crops, reference_function(model),
+                                            candidate_function(model, **accepted_options(candidate_function,
+                                                                                         batch_size=batch_size)),
+                                            confidence_tolerance))
+        elif function == "page":
+            reference_classifier = implementation_of(reference, "classify")(model)
+            candidate_class = implementation_of(candidate, "classify")
+            candidate_classifier = candidate_class(model, **accepted_options(candidate_class, batch_size=batch_size))
+
+            # The engine is chosen by the user. If one of the segmentors can't scale the pages, neither does the other.
+            reference_options, candidate_options = same_options(
+                reference_function, candidate_function, chosen=["engine"],
+                letter_height=page_scale.CANONICAL_LETTER_HEIGHT, engine=engine, stage_cache=None)
+
+            def segment(segmentor_class, options, classifier):
+                segmentor = segmentor_class(**options)
+                method = segmentor.segment_varied_background if varied else segmentor.segment_clear_background
+                if "classifier" in inspect.signature(method).parameters:
+                    return lambda page: method(page, classifier)
+
+                # Older segmentors do not classify the letters, so they are classified after the page is segmented
+                def segment_and_classify(page):
+                    letters = method(page)
+                    return classifier.Classify(letters) if len(letters) > 0 else letters
+                return segment_and_classify
+
+            reports.append(compare_function(function, corpus.pages,
+                                            segment(reference_function, reference_options, reference_classifier),
+                                            segment(candidate_function, candidate_options, candidate_classifier),
+                                            lambda a, b: diff_letters(a, b, box_tolerance, confidence_tolerance)))
+        elif function == "refine":
+            candidate_class = implementation_of(candidate, "classify")
+            classifier = candidate_class(model, **accepted_options(candidate_class, batch_size=batch_size))
+            options = dict(letter_height=page_scale.CANONICAL_LETTER_HEIGHT, engine=engine, stage_cache=None)
+            unbudgeted = candidate_function(**options)
+            budgeted = candidate_function(time_budget=0, **options)
+
+            def segment(segmentor, page):
+                if varied:
+                    return segmentor.segment_varied_background(page, classifier)
+                return segmentor.segment_clear_background(page, classifier)
+
+            reports.append(compare_function(
+                function, corpus.pages,
+                lambda page: in_box_order(segment(unbudgeted, page)),
+                lambda page: in_box_order(budgeted.refine(segment(budgeted, page), classifier, page.shape)),
+                lambda a, b: diff_letters(a, b, box_tolerance, confidence_tolerance)))
+    return reports
+
+
+# Compares classifying the crops one at a time with SimplyClassify of the reference with classifying all of them in
+# batches with Classify of the candidate. Each crop is a case. Classify rounds the confidences down to whole percent,
+# so they differ from SimplyClassify by up to 1.
+def compare_classify(crops, reference, candidate, confidence_tolerance):
+    report = {"function": "classify", "cases": len(crops), "mismatches": 0, "max_diff": 0.0, "reference_seconds": 0.0,
+              "candidate_seconds": 0.0, "first_mismatch": None}
+    if not crops:
+        return report
+
+    start = time.perf_counter()
+    expected = [reference.SimplyClassify(crop) for crop in crops]
+    report["reference_seconds"] = time.perf_counter() - start
+
+    letters = segToClass.LetterTable()
+    for crop in crops:
+        letters.append(crop, None, None, None, None)
+    start = time.perf_counter()
+    candidate.Classify(letters)
+    report["candidate_seconds"] = time.perf_counter() - start
+
+    for index, ((label, confidence), letter) in enumerate(zip(expected, letters)):
+        difference = abs(float(confidence) - float(letter.confidence))
+        report["max_diff"] = max(report["max_diff"], difference)
+        if label != letter.label or difference > confidence_tolerance:
+            report["mismatches"] += 1
+            if report["first_mismatch"] is None:
+                report["first_mismatch"] = index
+    return report
+
+
+# Prints the reports as a table with the speed-up of each function
+def print_reports(reports):
+    print("{:<27}{:>7}{:>12}{:>11}{:>15}{:>15}{:>10}".format("function", "cases", "mismatches", "max diff",
+                                                             "reference (ms)", "candidate (ms)", "speed-up"))
+    for report in reports:
+        speed_up = report["reference_seconds"] / report["candidate_seconds"] if report["candidate_seconds"] else 0.0
+        print("{:<27}{:>7}{:>12}{:>11.3f}{:>15.1f}{:>15.1f}{:>9.2f}x".format(
+            report["function"], report["cases"], report["mismatches"], report["max_diff"],
+            report["reference_seconds"] * 1000, report["candidate_seconds"] * 1000, speed_up))
+    for report in reports:
+        if report["first_mismatch"] is not None:
+            print(report["function"] + ": the first case that differs is case " + str(report["first_mismatch"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks that a faster implementation of the segmentation and "
+                                                 "classification gives the same results as the reference, and how "
+                                                 "much faster it is. Exits with status 1 if any function differs.")
+    parser.add_argument("images", nargs="*", default=["test.jpg"], help="paths to scroll images")
+    parser.add_argument("--reference", help="Python file with the reference implementation, like an older copy of "
+                                            "segmentation_to_classifier.py. The default is the current one.")
+    parser.add_argument("--candidate", help="Python file with the candidate implementation of some of the "
+                                            "functions. The default is the current segmentation_to_classifier.py.")
+    parser.add_argument("--functions", nargs="+", default=FUNCTIONS, choices=FUNCTIONS)
+    parser.add_argument("--varied", action="store_true", help="the images have a varied background")
+    parser.add_argument("--engine", choices=segToClass.ENGINES,
+                        help="the default is components, or tesseract if the reference has no engine option")
+    parser.add_argument("--model", default=segToClass.MODEL_PATH, help="path to the model")
+    parser.add_argument("--batch-size", type=int, default=256, help="batch size of the candidate classifier")
+    parser.add_argument("--pixel-tolerance", type=float, default=0.0,
+                        help="fraction of the pixels of an image that may differ")
+    parser.add_argument("--box-tolerance", type=int, default=0, help="pixels a box may differ by")
+    parser.add_argument("--confidence-tolerance", type=float, default=1.0,
+                        help="percent a confidence may differ by")
+    args = parser.parse_args()
+
+    reference = load_implementation(args.reference, "reference_implementation")
+    candidate = load_implementation(args.candidate, "candidate_implementation")
+    for module in (segToClass, reference, candidate):
+        use_model(module, args.model)
+    if args.engine is None:
+        args.engine = "components" if accepts(implementation_of(reference, "page"), "engine") else "tesseract"
+    corpus = Corpus(args.images, args.engine, args.varied)
+    print(str(len(corpus.pages)) + " pages, " + str(len(corpus.crops)) + " boxes and " + str(len(corpus.words)) +
+          " words to compare on")
+
+    reports = run(corpus, reference, candidate, args.functions, args.model, args.batch_size, args.engine,
+                  args.varied, args.pixel_tolerance, args.box_tolerance, args.confidence_tolerance)
+    print_reports(reports)
+    sys.exit(1 if any(report["mismatches"] for report in reports) else 0)
+
+
+if __name__ == "__main__":
+    main()
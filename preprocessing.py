@@ -0,0 +1,159 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import cv2
+
+import denoise
+from hashing import image_hash
+
+
+# The stages the images are preprocessed with before they are segmented. Each stage takes the output of the stage
+# before it, and the outputs are cached per image so that only the stages after a changed parameter are run again.
+
+# Grayscales the image. Images that already are grayscale are copied so that the cached output does not change if
+# the image is changed afterwards.
+def to_gray(img):
+    if len(img.shape) == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img.copy()
+
+
+# Does adaptive histogram equalization
+def equalize(gray, clip_limit=1.0, tile_grid_size=80):
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid_size, tile_grid_size))
+    return clahe.apply(gray)
+
+
+# Otsu thresholding
+def otsu_threshold(gray):
+    _, otsu = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return otsu
+
+
+# Adaptive binarization
+def adaptive_threshold(gray, block_size=39, c=15):
+    return cv2.adaptiveThreshold(src=gray, maxValue=255, adaptiveMethod=cv2.ADAPTIVE_THRESH_MEAN_C,
+                                 thresholdType=cv2.THRESH_BINARY, blockSize=block_size, C=c)
+
+
+# Does a morphological operation on the letters. The image is inverted first since the letters are black.
+def _morphology(binary, operation, kernel_size):
+    inverted_img = cv2.bitwise_not(binary)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel_size, kernel_size))
+    return cv2.bitwise_not(cv2.morphologyEx(inverted_img, operation, kernel))
+
+
+# Opening
+def opening(binary, kernel_size=3):
+    return _morphology(binary, cv2.MORPH_OPEN, kernel_size)
+
+
+# Closing
+def closing(binary, kernel_size=3):
+    return _morphology(binary, cv2.MORPH_CLOSE, kernel_size)
+
+
+# Noise removal with one of the denoisers in the denoise module
+def denoising(binary, method=denoise.DEFAULT_DENOISER):
+    return denoise.denoise(binary, method)
+
+
+# A named stage of the preprocessing and the parameters it is run with
+class Stage:
+    def __init__(self, name, function, **params):
+        self.name = name
+        self.function = function
+        self.params = params
+
+    # The part of the cache key that belongs to this stage
+    def key(self):
+        return self.name + repr(sorted(self.params.items()))
+
+    def run(self, image):
+        return self.function(image, **self.params)
+
+
+# Returns the stages used if the background in the image isnt varied
+def clear_background_stages(denoiser=denoise.DEFAULT_DENOISER):
+    return [Stage("gray", to_gray),
+            Stage("equalize", equalize, clip_limit=1.0, tile_grid_size=80),
+            Stage("threshold", otsu_threshold),
+            Stage("close", closing, kernel_size=3),
+            Stage("denoise", denoising, method=denoiser)]
+
+
+# Returns the stages used if the background in the image is varied
+def varied_background_stages(denoiser=denoise.DEFAULT_DENOISER):
+    return [Stage("gray", to_gray),
+            Stage("threshold", adaptive_threshold, block_size=39, c=15),
+            Stage("open", opening, kernel_size=3),
+            Stage("close", closing, kernel_size=3),
+            Stage("denoise", denoising, method=denoiser)]
+
+
+# Cache for the outputs of the stages. The outputs that have been used least recently are removed when the outputs
+# take more than max_bytes of memory. The cached outputs can be shared by several runs, so they must not be changed.
+class StageCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, output):
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key).nbytes
+            self.entries[key] = output
+            self.size += output.nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, removed = self.entries.popitem(last=False)
+                self.size -= removed.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+# The cache that is shared by all the segmentors
+STAGE_CACHE = StageCache()
+
+
+# Runs the stages on an image and returns the output of the last stage. The key of the output of a stage is made from
+# the hash of the image and the names and parameters of all the stages up to it, so when a parameter is changed only
+# the stages from the changed one are run again.
+def run_stages(image, stages, cache=STAGE_CACHE):
+    key = image_hash(image)
+    output = image
+
+    keys = []
+    for stage in stages:
+        key = hashlib.sha1((key + "|" + stage.key()).encode()).hexdigest()
+        keys.append(key)
+
+    # Finds the last stage that has a cached output
+    first_stage = 0
+    if cache is not None:
+        for i in range(len(stages) - 1, -1, -1):
+            cached = cache.get(keys[i])
+            if cached is not None:
+                output = cached
+                first_stage = i + 1
+                break
+
+    # Runs the stages that are not cached
+    for i in range(first_stage, len(stages)):
+        output = stages[i].run(output)
+        if cache is not None:
+            cache.put(keys[i], output)
+
+    return output
@@ -0,0 +1,84 @@
+import numpy as np
+
+import segmentation_to_classifier as segToClass
+
+
+# Returns the boxes of a table as rows in the image: left, top, right and bottom, where top and bottom are counted
+# from the top of the image. The boxes in the table count y and h from the bottom of the image.
+def box_edges(table, h_img):
+    boxes = table.boxes
+    left = boxes[:, 0]
+    right = boxes[:, 2]
+    top = h_img - boxes[:, 3]
+    bottom = h_img - boxes[:, 1]
+    return left, top, right, bottom
+
+
+# Clips a rectangle (x, y, width, height) to an image with the shape (height, width) and returns the corners of it
+def clip_rectangle(rectangle, shape):
+    h_img, w_img = shape[:2]
+    x0, y0 = max(int(rectangle[0]), 0), max(int(rectangle[1]), 0)
+    x1, y1 = min(int(rectangle[0] + rectangle[2]), w_img), min(int(rectangle[1] + rectangle[3]), h_img)
+    return x0, y0, x1, y1
+
+
+# Returns the letters of a page that are inside a rectangle (x, y, width, height) in the page, with coordinates
+# relative to the rectangle. Letters that are fully inside the rectangle are reused as they are. Letters that are cut
+# by the border of the rectangle are clipped to it and classified again, and are left out if less than half of the
+# letter is inside the rectangle. Returns None if the page results does not have the image the letters were cropped
+# from, since the cut letters then can't be classified again.
+# The page_shape is the shape of the page the boxes are relative to. The image the letters were cropped from can be
+# smaller than the page if the page was scaled down before it was segmented.
+def results_in_region(page_results, rectangle, classifier, page_shape=None):
+    source = page_results.source
+    if source is None:
+        return None
+
+    if page_shape is None:
+        page_shape = source.shape
+    h_img = page_shape[0]
+    scale_y = source.shape[0] / page_shape[0]
+    scale_x = source.shape[1] / page_shape[1]
+
+    # Clips the rectangle to the page
+    x0, y0, x1, y1 = clip_rectangle(rectangle, page_shape)
+    if x1 <= x0 or y1 <= y0:
+        return segToClass.LetterTable(source[0:0, 0:0])
+
+    left, top, right, bottom = box_edges(page_results, h_img)
+
+    # Finds the letters that are inside, and the letters that are cut by the border of the rectangle
+    inside = (left >= x0) & (right <= x1) & (top >= y0) & (bottom <= y1)
+
+    clipped_left, clipped_right = np.maximum(left, x0), np.minimum(right, x1)
+    clipped_top, clipped_bottom = np.maximum(top, y0), np.minimum(bottom, y1)
+    clipped_area = np.clip(clipped_right - clipped_left, 0, None) * np.clip(clipped_bottom - clipped_top, 0, None)
+    area = (right - left) * (bottom - top)
+    cut = ~inside & (clipped_area > 0) & (2 * clipped_area >= area)
+
+    kept = np.flatnonzero(inside | cut)
+
+    # Boxes of the kept letters, clipped to the rectangle and with coordinates relative to the rectangle.
+    # y and h are counted from the bottom of the rectangle, the same way as they are counted from the bottom of the page.
+    h_crop = y1 - y0
+    boxes = np.stack([clipped_left[kept] - x0, h_crop - (clipped_bottom[kept] - y0),
+                      clipped_right[kept] - x0, h_crop - (clipped_top[kept] - y0)], axis=1)
+
+    label_ids = page_results.label_ids[kept].copy()
+    confidences = page_results.confidences[kept].copy()
+    region = source[int(y0 * scale_y):int(y1 * scale_y), int(x0 * scale_x):int(x1 * scale_x)]
+    images = [page_results.images[i] if inside[i] else
+              source[int(clipped_top[i] * scale_y):int(clipped_bottom[i] * scale_y),
+                     int(clipped_left[i] * scale_x):int(clipped_right[i] * scale_x)] for i in kept]
+
+    results = segToClass.LetterTable.from_columns(boxes, label_ids, confidences, images, source=region)
+
+    # Classifies the letters that were cut by the rectangle again
+    cut_rows = np.flatnonzero(cut[kept])
+    if len(cut_rows) > 0:
+        cut_letters = classifier.Classify(segToClass.LetterTable.from_columns(
+            boxes[cut_rows], label_ids[cut_rows], confidences[cut_rows], [images[i] for i in cut_rows]))
+        results.label_ids[cut_rows] = cut_letters.label_ids
+        results.confidences[cut_rows] = cut_letters.confidences
+
+    return results
@@ -0,0 +1,136 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import segmentation_to_classifier as segToClass
+from hashing import image_hash, file_hash
+
+
+# Saves the boxes, labels, confidences and strategies of a LetterTable to a .npz file. The table is written to a
+# temporary file first and then moved to the path, so that a crash never leaves a half written file.
+def save_table(path, table):
+    handle, temp_path = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            np.savez(file, boxes=table.boxes, label_ids=table.label_ids, confidences=table.confidences,
+                     strategies=table.strategies)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+# Loads a LetterTable saved with save_table. The letters do not have their images. Tables saved before the strategies
+# were saved are loaded with all their letters split with the full strategy.
+def load_table(path):
+    with np.load(path) as saved:
+        strategies = saved["strategies"] if "strategies" in saved.files else None
+        return segToClass.LetterTable.from_columns(saved["boxes"], saved["label_ids"], saved["confidences"],
+                                                   strategies=strategies)
+
+
+# Name of the environment variable with the folder the results are saved to, so that they are kept when the
+# application is restarted. If it is not set, the results are only kept in memory.
+CACHE_DIR_ENV = "DSS_RESULT_CACHE_DIR"
+
+
+# Cache for the results of segmenting and classifying a whole image. The results are kept in memory for the most
+# recently used images, and can also be saved to a folder so that they are kept when the application is restarted.
+# The results saved to the folder only contain the boxes, labels and confidences, not the letter images. At most
+# max_disk_entries results are kept in the folder, and the least recently used ones are removed first.
+# The cache can be used by several threads at the same time.
+class ResultCache:
+    def __init__(self, max_entries=16, cache_dir=None, max_disk_entries=256):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # Returns the key of an image. The key is made from the pixels of the image, whether the image has a varied
+    # background, the model used to classify it and the cropped rectangle (None if the image is not cropped)
+    @staticmethod
+    def key(image, varied_background, model_path=segToClass.MODEL_PATH, rectangle=None):
+        parts = [image_hash(image), "varied" if varied_background else "clear", file_hash(model_path),
+                 str(tuple(rectangle) if rectangle is not None else None)]
+        return hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    # Returns the cached LetterTable of a key, or None if the key is not cached
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+            try:
+                table = load_table(self._disk_path(key))
+                # Marks the file as recently used, so that it is removed last
+                os.utime(self._disk_path(key))
+            except OSError:
+                # The file was removed by another thread since it was found
+                return None
+            self._remember(key, table)
+            return table
+
+        return None
+
+    # Saves the results of a key in the cache
+    def put(self, key, table):
+        self._remember(key, table)
+
+        if self.cache_dir is not None:
+            save_table(self._disk_path(key), table)
+            self._evict_disk()
+
+    # Removes the least recently used results from the folder until there are at most max_disk_entries
+    def _evict_disk(self):
+        with self.lock:
+            paths = [os.path.join(self.cache_dir, name) for name in os.listdir(self.cache_dir)
+                     if name.endswith(".npz")]
+            if len(paths) <= self.max_disk_entries:
+                return
+            used = []
+            for path in paths:
+                try:
+                    used.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+            used.sort()
+            for _, path in used[:max(len(used) - self.max_disk_entries, 0)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _remember(self, key, table):
+        with self.lock:
+            self.entries[key] = table
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    # Removes all the results from the cache
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.cache_dir is not None:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".npz"):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+
+# Returns a result cache that saves the results to the folder in the CACHE_DIR_ENV environment variable, or that only
+# keeps them in memory if it is not set
+def cache_from_environment(max_entries=16, max_disk_entries=256):
+    return ResultCache(max_entries, os.environ.get(CACHE_DIR_ENV) or None, max_disk_entries)
@@ -1,4 +1,8 @@
 import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
 import numpy as np
@@ -8,31 +12,318 @@ import torch.nn as nn
 import torch.nn.functional as nnf
 from PIL import Image
 import image_straighten as img_straighten
+import page_scale
+import denoise
+import preprocessing
+import component_segmentation
+import word_sweep
+import line_segmentation
+
+
+# Path to the model used to classify the letters
+MODEL_PATH = "./default_2.model"
+
+# The letter classes the classifier can predict. The label ids stored in a LetterTable index into this list.
+CLASSES = ['ALEF', 'BET', 'GIMEL', 'DALET', 'HE', 'VAV', 'ZAYIN', 'HET', 'TET', 'YOD', 'KAF', 'LAMED',
+           'MEM', 'NUN', 'SAMEKH', 'AYIN', 'PE', 'TSADI', 'QOF', 'RESH', 'SHIN', 'TAV']
+
+# Label id used for letters that have not been classified yet
+NO_LABEL = 255
+
+# Coordinate value used for coordinates that are not known (None)
+NO_COORDINATE = -1
+
+# The strategies a box can be split into letters with, from the most to the least accurate. The cheaper strategies are
+# used when the time budget of a page runs low (see Segmentor), and the letters can then be refined later.
+# "full"        the word splitter with the letters unsheared first
+# "no_unshear"  the word splitter without unshearing the letters
+# "early_stop"  the word splitter without unshearing the letters and without widening them
+# "box"         the box is not split
+STRATEGIES = ["full", "no_unshear", "early_stop", "box"]
+
+# The values between 0 and 1 of the pixel values in an image, used to convert images to the input of the classifier
+_PIXEL_VALUES = (np.arange(256) / 255).astype(np.float32)
+
+
+# Compact table of letters stored as columns: the boxes as int32 (x, y, w, h), the label ids as uint8 and the
+# confidences as float16. The letters that were split from a wide box also have that box as a word box (see
+# word_boxes), so that the box can be split again by Segmentor.refine. The images are views into the image the letters were cropped from and not copies, so the
+# memory used by the table grows with the amount of letters and not with the size of the crops.
+class LetterTable:
+    def __init__(self, source=None, capacity=16):
+        # The image the letters are cropped from
+        self.source = source
+
+        capacity = max(capacity, 1)
+        self._boxes = np.full((capacity, 4), NO_COORDINATE, dtype=np.int32)
+        self._label_ids = np.full(capacity, NO_LABEL, dtype=np.uint8)
+        self._confidences = np.full(capacity, np.nan, dtype=np.float16)
+        self._strategies = np.zeros(capacity, dtype=np.uint8)
+        self._word_boxes = np.full((capacity, 4), NO_COORDINATE, dtype=np.int32)
+        self.images = []
+        self._count = 0
+
+    # Creates a table from already computed columns
+    @classmethod
+    def from_columns(cls, boxes, label_ids, confidences, images=None, source=None, strategies=None, word_boxes=None):
+        table = cls(source, capacity=len(boxes))
+        table._boxes[:len(boxes)] = boxes
+        table._label_ids[:len(boxes)] = label_ids
+        table._confidences[:len(boxes)] = confidences
+        if strategies is not None:
+            table._strategies[:len(boxes)] = strategies
+        if word_boxes is not None:
+            table._word_boxes[:len(boxes)] = word_boxes
+        table.images = list(images) if images is not None else [None] * len(boxes)
+        table._count = len(boxes)
+        return table
+
+    # Creates a table with the letters of several tables after each other
+    @classmethod
+    def concatenate(cls, tables, source=None):
+        if not tables:
+            return cls(source)
+        boxes = np.concatenate([table.boxes for table in tables])
+        label_ids = np.concatenate([table.label_ids for table in tables])
+        confidences = np.concatenate([table.confidences for table in tables])
+        strategies = np.concatenate([table.strategies for table in tables])
+        word_boxes = np.concatenate([table.word_boxes for table in tables])
+        images = [image for table in tables for image in table.images]
+        return cls.from_columns(boxes, label_ids, confidences, images, source, strategies, word_boxes)
+
+    # Returns a new table with the letters at the given indices, in the order of the indices
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        return LetterTable.from_columns(self.boxes[indices], self.label_ids[indices], self.confidences[indices],
+                                        [self.images[i] for i in indices], self.source, self.strategies[indices],
+                                        self.word_boxes[indices])
+
+    # Creates a table from a list of Letter objects
+    @classmethod
+    def from_letters(cls, letters, source=None):
+        table = cls(source, capacity=len(letters))
+        for letter in letters:
+            new_letter = table.append(letter.image, letter.x, letter.y, letter.w, letter.h, letter.strategy)
+            if letter.label is not None:
+                new_letter.add_label(letter.label, letter.confidence)
+        return table
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield Letter.from_row(self, index)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [Letter.from_row(self, i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError("letter index out of range")
+        return Letter.from_row(self, index)
+
+    # The boxes of the letters as an (N, 4) int32 array with the columns x, y, w, h
+    @property
+    def boxes(self):
+        return self._boxes[:self._count]
+
+    # The label ids of the letters as an uint8 array, NO_LABEL if the letter is not classified
+    @property
+    def label_ids(self):
+        return self._label_ids[:self._count]
+
+    # The confidences of the letters as a float16 array, nan if the letter is not classified
+    @property
+    def confidences(self):
+        return self._confidences[:self._count]
+
+    # The strategies the letters were split with as an uint8 array of indices into STRATEGIES
+    @property
+    def strategies(self):
+        return self._strategies[:self._count]
+
+    # The wide boxes the letters were split from as an (N, 4) int32 array, in the coordinates of the source and not
+    # scaled back like the boxes. The rows of letters that were not in a wide box are NO_COORDINATE.
+    @property
+    def word_boxes(self):
+        return self._word_boxes[:self._count]
+
+    # Doubles the size of the columns when they are full
+    def _grow(self):
+        capacity = len(self._label_ids) * 2
+
+        boxes = np.full((capacity, 4), NO_COORDINATE, dtype=np.int32)
+        boxes[:self._count] = self.boxes
+        label_ids = np.full(capacity, NO_LABEL, dtype=np.uint8)
+        label_ids[:self._count] = self.label_ids
+        confidences = np.full(capacity, np.nan, dtype=np.float16)
+        confidences[:self._count] = self.confidences
+        strategies = np.zeros(capacity, dtype=np.uint8)
+        strategies[:self._count] = self.strategies
+        word_boxes = np.full((capacity, 4), NO_COORDINATE, dtype=np.int32)
+        word_boxes[:self._count] = self.word_boxes
+
+        self._boxes, self._label_ids, self._confidences = boxes, label_ids, confidences
+        self._strategies, self._word_boxes = strategies, word_boxes
+
+    # Adds a letter to the table and returns it. strategy is the strategy in STRATEGIES the letter was split with, and
+    # word_box the (x, y, w, h) of the wide box it was split from, if it was.
+    def append(self, image, x, y, w, h, strategy="full", word_box=None):
+        if self._count == len(self._label_ids):
+            self._grow()
+
+        index = self._count
+        self._boxes[index] = [NO_COORDINATE if value is None else value for value in (x, y, w, h)]
+        self._strategies[index] = STRATEGIES.index(strategy)
+        if word_box is not None:
+            self._word_boxes[index] = word_box
+        self.images.append(image)
+        self._count += 1
+
+        return Letter.from_row(self, index)
+
+    # Sets the labels and confidences of all the letters in the table at once
+    def set_labels(self, label_ids, confidences):
+        self.label_ids[:] = label_ids
+        self.confidences[:] = confidences
+
+    # The labels of the letters as strings
+    def labels(self):
+        return [None if label_id == NO_LABEL else CLASSES[label_id] for label_id in self.label_ids]
+
+    # Removes all the letters from the table
+    def clear(self):
+        self._boxes[:] = NO_COORDINATE
+        self._label_ids[:] = NO_LABEL
+        self._confidences[:] = np.nan
+        self._strategies[:] = 0
+        self._word_boxes[:] = NO_COORDINATE
+        self.images = []
+        self._count = 0
 
 
 # Object for letters that contain the image, the coordinates, and the classification.
+# The values are stored in a row of a LetterTable, so a Letter is only a light view over that row.
 class Letter:
+    __slots__ = ('table', 'index')
+
     def __init__(self, image, x, y, w, h):
-        self.image = image
-        self.x = x
-        self.y = y
-        self.w = w
-        self.h = h
-        self.label = None
-        self.confidence = None
+        letter = LetterTable(capacity=1).append(image, x, y, w, h)
+        self.table = letter.table
+        self.index = letter.index
+
+    # Creates a letter that points to an existing row in a table
+    @classmethod
+    def from_row(cls, table, index):
+        letter = cls.__new__(cls)
+        letter.table = table
+        letter.index = index
+        return letter
+
+    def _get_coordinate(self, column):
+        value = int(self.table.boxes[self.index, column])
+        return None if value == NO_COORDINATE else value
+
+    def _set_coordinate(self, column, value):
+        self.table.boxes[self.index, column] = NO_COORDINATE if value is None else value
+
+    @property
+    def image(self):
+        return self.table.images[self.index]
+
+    @image.setter
+    def image(self, image):
+        self.table.images[self.index] = image
+
+    @property
+    def x(self):
+        return self._get_coordinate(0)
+
+    @x.setter
+    def x(self, value):
+        self._set_coordinate(0, value)
+
+    @property
+    def y(self):
+        return self._get_coordinate(1)
+
+    @y.setter
+    def y(self, value):
+        self._set_coordinate(1, value)
+
+    @property
+    def w(self):
+        return self._get_coordinate(2)
+
+    @w.setter
+    def w(self, value):
+        self._set_coordinate(2, value)
+
+    @property
+    def h(self):
+        return self._get_coordinate(3)
+
+    @h.setter
+    def h(self, value):
+        self._set_coordinate(3, value)
+
+    @property
+    def label(self):
+        label_id = self.table.label_ids[self.index]
+        return None if label_id == NO_LABEL else CLASSES[label_id]
+
+    @property
+    def confidence(self):
+        confidence = self.table.confidences[self.index]
+        return None if np.isnan(confidence) else int(confidence)
 
     def add_label(self, label, confidence):
-        self.label = label
-        self.confidence = confidence
+        self.table.label_ids[self.index] = CLASSES.index(label)
+        self.table.confidences[self.index] = confidence
+
+    # The strategy in STRATEGIES the letter was split with
+    @property
+    def strategy(self):
+        return STRATEGIES[self.table.strategies[self.index]]
 
 
 # Returns the confidence value of a letter as a boolean.
 def class_letter_checker(image):
-    classifier = Classifier("./default_2.model")
+    classifier = _letter_checker if _letter_checker is not None else get_classifier(MODEL_PATH)
+    # Classifiers like the cascade can answer how confident a letter is classified without classifying it
+    if hasattr(classifier, "LetterConfidence"):
+        return classifier.LetterConfidence(image)
     _, confidence_value = classifier.SimplyClassify(image)
     return confidence_value
 
 
+# The classifier used by class_letter_checker. If it is None the classifier of MODEL_PATH is used.
+_letter_checker = None
+
+
+# Sets the classifier class_letter_checker uses, for example a cascade.CascadeClassifier. None resets it.
+def set_letter_checker(classifier):
+    global _letter_checker
+    _letter_checker = classifier
+
+
+# The classifiers that have been loaded, saved by the path and modification time of the model
+_classifiers = {}
+_classifiers_lock = threading.Lock()
+
+
+# Returns a classifier for a model. The model is only loaded the first time, or again if the file has been changed,
+# so that the classifier can be shared by everything that classifies letters, also on different threads.
+def get_classifier(model=MODEL_PATH):
+    key = (os.path.abspath(model), os.path.getmtime(model))
+    with _classifiers_lock:
+        if key not in _classifiers:
+            _classifiers[key] = Classifier(model)
+        return _classifiers[key]
+
+
 # Straightens the letters in an image
 # Source: https://github.com/RiteshKH/Cursive_handwriting_recognition/blob/master/image-straighten.py
 # Date: 11.05.2022
@@ -120,10 +411,33 @@ def segmentation_point_finder(amount_vert_pixels, min_letter_width):
     return seg_points
 
 
+# The crops and confidences of the column ranges (left, right) of a word that have been checked while splitting it,
+# so that no range is cropped or classified more than once
+class WordWindows:
+    def __init__(self, word):
+        self.word = word
+        self.crops = {}
+        self.confidences = {}
+
+    # Returns the column range of the word with the white space over and under the letter removed
+    def crop(self, left, right):
+        if (left, right) not in self.crops:
+            self.crops[(left, right)] = image_cropper(self.word[:, left:right])
+        return self.crops[(left, right)]
+
+    # Returns the confidence value of the column range
+    def confidence(self, left, right):
+        if (left, right) not in self.confidences:
+            self.confidences[(left, right)] = class_letter_checker(self.crop(left, right))
+        return self.confidences[(left, right)]
+
+
 # Splits an image with multiple letters into multiple images each containing one letter.
-# The function uses the segmentation points as a baseline for the segments.
-def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
-    segmented_letters_in_word = []
+# The function uses the segmentation points as a baseline for the segments. If widen is False, the segments are not
+# widened when the classifier is not confident of them.
+def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width, widen=True):
+    segmented_letters_in_word = LetterTable(word)
+    windows = WordWindows(word)
     segmentation_index = len(amount_vert_pixels) - 1
 
     for i in seg_points:
@@ -133,20 +447,20 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
 
         # if the segmentation is on the far right side of the image
         if segmentation_index > len(amount_vert_pixels) - 5:
-            cropped_image = word[:, i:len(amount_vert_pixels)]
-            cropped_image = image_cropper(cropped_image)
+            window = (i, len(amount_vert_pixels))
+            cropped_image = windows.crop(*window)
 
             confidence_value = 0
             best_extend_image = 0
             while True:
-                new_confidence_value = class_letter_checker(cropped_image)
+                new_confidence_value = windows.confidence(*window)
                 if new_confidence_value > 60:
                     break
                 # checks if we have extended the cropped image too far or if we have gone out of bounds
                 # too far is defined here as more than half the min_letter_width
-                elif extend_image > min_letter_width / 2 or out_of_bounds is True:
-                    cropped_image = word[:, i - best_extend_image:len(amount_vert_pixels)]
-                    cropped_image = image_cropper(cropped_image)
+                elif not widen or extend_image > min_letter_width / 2 or out_of_bounds is True:
+                    window = (i - best_extend_image, len(amount_vert_pixels))
+                    cropped_image = windows.crop(*window)
                     break
                 else:
                     # checks if the new confidence value is higher than the current hightest one
@@ -157,8 +471,8 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
                         out_of_bounds = True
                     else:
                         # extends the image to the left until sufficient classification value
-                        cropped_image = word[:, i - extend_image:len(amount_vert_pixels)]
-                        cropped_image = image_cropper(cropped_image)
+                        window = (i - extend_image, len(amount_vert_pixels))
+                        cropped_image = windows.crop(*window)
                         extend_image += 2
             final_extend_image_left = i - best_extend_image
             if final_extend_image_left < 0:
@@ -167,26 +481,25 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
             if cropped_image is not None:
                 # Checks if the letter is thinner than the min_letter_width
                 if len(amount_vert_pixels) - final_extend_image_left >= min_letter_width:
-                    cropped_letter = Letter(cropped_image, final_extend_image_left, None, segmentation_index, None)
-                    segmented_letters_in_word.append(cropped_letter)
+                    segmented_letters_in_word.append(cropped_image, final_extend_image_left, None, segmentation_index, None)
 
         # if the segmentation point is on the left side of the image
         elif i < 4:
-            cropped_image = word[:, 0:segmentation_index]
-            cropped_image = image_cropper(cropped_image)
+            window = (0, segmentation_index)
+            cropped_image = windows.crop(*window)
 
             confidence_value = 0
             best_extend_image = 0
             while True:
-                new_confidence_value = class_letter_checker(cropped_image)
+                new_confidence_value = windows.confidence(*window)
                 if new_confidence_value > 60:
                     # finished
                     break
                 # checks if we have extended the cropped image too far or if we have gone out of bounds
                 # too far is defined here as more than half the min_letter_width
-                elif extend_image > min_letter_width / 2 or out_of_bounds is True:
-                    cropped_image = word[:, 0:segmentation_index + best_extend_image]
-                    cropped_image = image_cropper(cropped_image)
+                elif not widen or extend_image > min_letter_width / 2 or out_of_bounds is True:
+                    window = (0, segmentation_index + best_extend_image)
+                    cropped_image = windows.crop(*window)
                     break
                 else:
                     # Saves the best confidence value and its extend_image value
@@ -197,8 +510,8 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
                         out_of_bounds = True
                     else:
                         # extends the image to the right until sufficient classification value
-                        cropped_image = word[:, 0:segmentation_index + extend_image]
-                        cropped_image = image_cropper(cropped_image)
+                        window = (0, segmentation_index + extend_image)
+                        cropped_image = windows.crop(*window)
                         extend_image += 2
 
             final_extend_image_right = segmentation_index + best_extend_image
@@ -207,26 +520,25 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
 
                 # Checks if the letter is thinner than the min_letter_width
                 if width_cropped_image >= min_letter_width:
-                    cropped_letter = Letter(cropped_image, i, None, final_extend_image_right, None)
-                    segmented_letters_in_word.append(cropped_letter)
+                    segmented_letters_in_word.append(cropped_image, i, None, final_extend_image_right, None)
 
         # if the segmentation point is in the middle of the image
         else:
-            cropped_image = word[:, i - extend_image:segmentation_index + extend_image]
-            cropped_image = image_cropper(cropped_image)
+            window = (i - extend_image, segmentation_index + extend_image)
+            cropped_image = windows.crop(*window)
 
             confidence_value = 0
             best_extend_image = 0
             while True:
-                new_confidence_value = class_letter_checker(cropped_image)
+                new_confidence_value = windows.confidence(*window)
                 if new_confidence_value > 60:
                     # finished
                     break
                 # checks if we have extended the cropped image too far or if we have gone out of bounds
                 # too far is defined here as more than half the min_letter_width
-                elif extend_image > min_letter_width or out_of_bounds is True:
-                    cropped_image = word[:, i - best_extend_image:segmentation_index + best_extend_image]
-                    cropped_image = image_cropper(cropped_image)
+                elif not widen or extend_image > min_letter_width or out_of_bounds is True:
+                    window = (i - best_extend_image, segmentation_index + best_extend_image)
+                    cropped_image = windows.crop(*window)
                     break
                 else:
                     # Saves the best confidence value and its extend_image value
@@ -237,8 +549,8 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
                         out_of_bounds = True
                     else:
                         # extends the crop on both sides
-                        cropped_image = word[:, i - extend_image:segmentation_index + extend_image]
-                        cropped_image = image_cropper(cropped_image)
+                        window = (i - extend_image, segmentation_index + extend_image)
+                        cropped_image = windows.crop(*window)
                         extend_image += 2
 
             final_extend_image_left = i - best_extend_image
@@ -248,8 +560,8 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
                 _, width_cropped_image = cropped_image.shape
 
                 if width_cropped_image >= min_letter_width:
-                    cropped_letter = Letter(cropped_image, final_extend_image_left, None, final_extend_image_right, None)
-                    segmented_letters_in_word.append(cropped_letter)
+                    segmented_letters_in_word.append(cropped_image, final_extend_image_left, None,
+                                                     final_extend_image_right, None)
 
         # Changes the index to the segmentation point
         segmentation_index = i
@@ -257,10 +569,14 @@ def word_cropper(seg_points, amount_vert_pixels, word, min_letter_width):
     return segmented_letters_in_word
 
 
-# Splits a word into letters
-def word_splitter(word):
-    # straightens the letter/letters in the image
-    image = image_straighten(word)
+# Splits a word into letters. If unshear is False the letters are not straightened first, and if widen is False the
+# letters are not widened when the classifier is not confident of them, which is faster but less accurate.
+def word_splitter(word, unshear=True, widen=True):
+    # straightens the letter/letters in the image, or only thresholds it
+    if unshear:
+        image = image_straighten(word)
+    else:
+        image = cv2.threshold(word, 127, 255, cv2.THRESH_BINARY)[1]
 
     # skeletonizes the image
     skel = skeletonize(np.invert(image))
@@ -300,7 +616,7 @@ def word_splitter(word):
         seg_points.append(0)
 
     # Crops the image of the word using the seg_points array, amout_vert_pixels array and the min_letter_width
-    segmented_letters_in_word = word_cropper(seg_points, amount_vert_pixels, word, min_letter_width)
+    segmented_letters_in_word = word_cropper(seg_points, amount_vert_pixels, word, min_letter_width, widen)
 
     # Reverses the array so that the letters are in the right order
     # Most of the word splitter is performed reading the letters from right to left, which is why we need to reverse it
@@ -309,36 +625,179 @@ def word_splitter(word):
     return segmented_letters_correct
 
 
+# Makes a box around each letter/word on the scroll with Tesseract. Returns a list with the coordinates of the boxes:
+# x = Distance between the top left corner of the box to the left frame
+# y = Distance between the top of the box to the bottom frame
+# w = Distance between the right side of the box to the left frame
+# h = Distance between the bottom of the box to the bottom frame
+def tesseract_boxes(image):
+    # Necessary for running pytesseract
+    # Info on how to get it running: https://github.com/tesseract-ocr/tesseract/blob/main/README.md
+    pytesseract.pytesseract.tesseract_cmd = r'tesseract\tesseract.exe'
+
+    boxes = []
+    for b in pytesseract.image_to_boxes(image, lang="heb").splitlines():
+        # Splits the values of the box into an array
+        b = b.split(' ')
+        boxes.append((int(b[1]), int(b[2]), int(b[3]), int(b[4])))
+    return boxes
+
+
+# The engines the Segmentor can find the boxes around the letters/words with. "tesseract" uses Tesseract, and
+# "components" uses the connected components in the image, which does not need Tesseract to be installed.
+ENGINES = ["tesseract", "components"]
+
+
+# The splitters that can be used to split the boxes that are wider than a letter:
+# "cropper" widens each letter from the segmentation points until it is classified with a high confidence.
+# "sweep" classifies all the possible letters in the word in one batch and picks the best ones, see word_sweep.
+SPLITTERS = ["cropper", "sweep"]
+
+
+# Returns the letters in a box that is wider than 30 pixels, split by the splitter with the strategy in STRATEGIES.
+# The x and w of the letters are relative to the box. Returns None if the box is a large letter that should not be
+# split, or if the strategy is "box". The sweep splitter splits the box the same way with all the other strategies.
+def split_box(crop, splitter="cropper", strategy="full"):
+    if strategy == "box":
+        return None
+    # checks if the box is a large letter
+    if class_letter_checker(crop) > 90:
+        return None
+    if splitter == "cropper":
+        return word_splitter(crop, unshear=strategy == "full", widen=strategy != "early_stop")
+    elif splitter == "sweep":
+        return word_sweep.sweep_splitter(crop)
+    raise ValueError("Unknown word splitter '" + str(splitter) + "', choose one of: " + ", ".join(SPLITTERS))
+
+
 class Segmentor:
-    def __init__(self):
-        return
+    # If letter_height is set, images where the letters are larger than it are scaled down so that the letters get
+    # that height before the image is segmented. The boxes of the letters are then mapped back to the original image.
+    # denoiser is the name of the denoiser in denoise.DENOISERS that is used on the binarized image.
+    # The outputs of the preprocessing stages are saved in the stage_cache, so that they are not computed again when
+    # the same image is segmented with other parameters. It can be None to not cache them.
+    # engine is one of ENGINES and is used to find the boxes around the letters/words.
+    # If line_workers is set, the image is split into lines of text that are segmented at the same time on that many
+    # threads, or on that many processes if line_processes is True. If word_workers is set, the boxes that have to be
+    # split into letters are split at the same time on that many threads. splitter is one of SPLITTERS and is used to
+    # split them.
+    # If time_budget is set, a page should be segmented in about that many seconds. The boxes are split with cheaper
+    # strategies (see STRATEGIES) as the time runs out, and each letter is marked with the strategy it was split with
+    # so that it can be refined later with refine.
+    # If iou_threshold is set, the letters that overlap a letter with a higher confidence by more than that
+    # intersection over union are removed after the letters are classified, or merged into it if overlap_mode is
+    # "merge" (see box_suppression).
+    # If memory_governor is set to a memory_governor.MemoryGovernor, it chooses the line workers and the batch size of
+    # the classifier for each image so that the memory used stays under its budget.
+    def __init__(self, letter_height=None, denoiser=denoise.DEFAULT_DENOISER, stage_cache=preprocessing.STAGE_CACHE,
+                 engine="tesseract", line_workers=None, word_workers=None, line_processes=False, splitter="cropper",
+                 time_budget=None, iou_threshold=None, overlap_mode="suppress", memory_governor=None):
+        self.letter_height = letter_height
+        self.denoiser = denoiser
+        self.stage_cache = stage_cache
+        self.engine = engine
+        self.line_workers = line_workers
+        self.word_workers = word_workers
+        self.line_processes = line_processes
+        self.splitter = splitter
+        self.time_budget = time_budget
+        self.iou_threshold = iou_threshold
+        self.overlap_mode = overlap_mode
+        self.memory_governor = memory_governor
+
+    # Returns the time (from time.monotonic) a page that is started now should be done by, or None if there is no
+    # time budget
+    def deadline(self):
+        if self.time_budget is None:
+            return None
+        return time.monotonic() + self.time_budget
+
+    # Returns the strategy a box should be split with, from how much of the time budget of the page is left
+    def strategy(self, deadline):
+        if deadline is None:
+            return "full"
+        if self.time_budget <= 0:
+            return "box"
+        left = (deadline - time.monotonic()) / self.time_budget
+        if left > 0.5:
+            return "full"
+        elif left > 0.25:
+            return "no_unshear"
+        elif left > 0:
+            return "early_stop"
+        return "box"
+
+    # Splits the crops of the boxes into letters with split_box, on a pool of threads if word_workers is set.
+    # Returns the letters of each crop and the strategy it was split with, in the same order as the crops.
+    def split_boxes(self, crops, deadline=None):
+        def split(crop):
+            strategy = self.strategy(deadline)
+            return split_box(crop, self.splitter, strategy), strategy
+
+        if self.word_workers and len(crops) > 1:
+            with ThreadPoolExecutor(max_workers=self.word_workers) as pool:
+                return list(pool.map(split, crops))
+        return [split(crop) for crop in crops]
+
+    # Scales the image down to the letter height of the segmentor. Returns the image and the scale factor.
+    def rescale(self, image):
+        if self.letter_height is None:
+            return image, 1.0
+        return page_scale.rescale_to_letter_height(image, self.letter_height)
+
+    # Maps the boxes of the letters back to the original image if the image was scaled
+    @staticmethod
+    def scale_back(letters, scaled_shape, original_shape):
+        if scaled_shape[:2] != original_shape[:2]:
+            page_scale.scale_boxes_back(letters, scaled_shape, original_shape)
+        return letters
 
-    def segment_letters(self, image):
-        # Necessary for running pytesseract
-        # Info on how to get it running: https://github.com/tesseract-ocr/tesseract/blob/main/README.md
-        pytesseract.pytesseract.tesseract_cmd = r'tesseract\tesseract.exe'
+    # Segments a preprocessed image, line by line if line_workers is set. If a classifier is given, the letters are
+    # also classified, on the same threads as the lines are segmented on. deadline is when the page should be done.
+    def segment_page(self, image, classifier=None, deadline=None):
+        if self.line_workers and self.line_processes:
+            return line_segmentation.segment_lines_in_processes(self, image, classifier, self.line_workers, deadline)
+        if self.line_workers:
+            return line_segmentation.segment_lines(self, image, classifier, self.line_workers, deadline)
+
+        letters = self.segment_letters(image, deadline)
+        if classifier is not None and len(letters) > 0:
+            letters = classifier.Classify(letters)
+        return letters
 
+    # Removes or merges the letters that overlap each other if iou_threshold is set. shape is the shape of the image
+    # the boxes are in.
+    def suppress_overlaps(self, letters, shape):
+        if self.iou_threshold is None:
+            return letters
+
+        # Imported here since box_suppression imports segmentation_to_classifier through spatial_index
+        import box_suppression
+        return box_suppression.suppress_overlaps(letters, shape[0], self.iou_threshold, self.overlap_mode)
+
+    # Makes a box around each letter/word on the scroll with the engine of the segmentor
+    def find_boxes(self, image):
+        if self.engine == "tesseract":
+            return tesseract_boxes(image)
+        elif self.engine == "components":
+            return component_segmentation.component_boxes(image)
+        raise ValueError("Unknown segmentation engine '" + str(self.engine) + "', choose one of: " + ", ".join(ENGINES))
+
+    def segment_letters(self, image, deadline=None):
         # Crops the images around the letters/words
         # Saves the height and width of the images
         h_img, w_img = image.shape
 
-        # array for the segmented letters
-        segmented_letters = []
+        # table for the segmented letters
+        segmented_letters = LetterTable(image)
 
-        # Makes a box around each letter/word on the scroll
-        boxes = pytesseract.image_to_boxes(image, lang="heb")
-
-        # For each box
-        for b in boxes.splitlines():
-            # Splits the values of the box into an array
-            b = b.split(' ')
-            # Save the coordinates of the box:
-            # x = Distance between the top left corner of the box to the left frame
-            # y = Distance between the top of the box to the bottom frame
-            # w = Distance between the right side of the box to the left frame
-            # h = Distance between the bottom of the box to the bottom frame
-            x, y, w, h = int(b[1]), int(b[2]), int(b[3]), int(b[4])
+        # The boxes that are kept, and the crops of the boxes that are wider than 30 pixels. The wide boxes are split
+        # into letters after all the boxes have been found so that they can be split at the same time.
+        kept_boxes = []
+        wide_crops = []
 
+        # For each box around a letter/word on the scroll
+        for x, y, w, h in self.find_boxes(image):
             # Crop the image so that we only get the letter/word
             # Structure image[rows, col]
             crop = image[(h_img - h):(h_img - y), x:w]
@@ -350,105 +809,148 @@ class Segmentor:
             if h_box != 0 and w_box != 0:
                 # Checks if the crop is too small or too large
                 if h_box > (1 / h_box * 100) and w_box > (1 / h_box * 100):
-                    # If the segment is larger than 30 pixels wide
+                    # If the segment is larger than 30 pixels wide it is split later
                     if w_box > 30:
-                        # checks if the box is a large letter
-                        if class_letter_checker(crop) > 90:
-                            # Saves each segmented letter as a Letter object with the correct coordinate values
-                            cropped_letter = Letter(crop, x, y, w, h)
-
-                            # appends the cropped letter to the array
-                            segmented_letters.append(cropped_letter)
-                        else:
-                            for i in word_splitter(crop):
-                                # Saves each segmented letter as a Letter object with the correct coordinate values
-                                cropped_letter = Letter(i.image, x + i.x, y, x + i.w, h)
-
-                                # appends the cropped letter to the array
-                                segmented_letters.append(cropped_letter)
+                        kept_boxes.append((x, y, w, h, len(wide_crops)))
+                        wide_crops.append(crop)
 
                     # Found single letter
                     else:
-                        # Saves each segmented letter as a Letter object with the correct coordinate values
-                        cropped_letter = Letter(crop, x, y, w, h)
-
-                        # appends the cropped letter to the array
-                        segmented_letters.append(cropped_letter)
+                        kept_boxes.append((x, y, w, h, None))
+
+        # Checks if the wide boxes are large letters, and splits them into letters if they are not
+        letters_in_wide_crops = self.split_boxes(wide_crops, deadline)
+
+        for x, y, w, h, wide_index in kept_boxes:
+            if wide_index is None:
+                # Saves each segmented letter in the table with the correct coordinate values
+                segmented_letters.append(image[(h_img - h):(h_img - y), x:w], x, y, w, h)
+            else:
+                letters_in_crop, strategy = letters_in_wide_crops[wide_index]
+                self.append_split_box(segmented_letters, image[(h_img - h):(h_img - y), x:w], (x, y, w, h),
+                                      letters_in_crop, strategy)
         # Saves the image with all the rectangles
         return segmented_letters
 
-    # Method that is run if the background in the image isnt varied
-    def segment_clear_background(self, image):
-        # Reads image of scroll
-        img = image
-
-        # Grayscales image
-        if len(img.shape) == 3:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Adds the letters a wide box was split into to a table, or the box itself if it was not split. The box is saved
+    # as the word box of the letters.
+    @staticmethod
+    def append_split_box(table, crop, box, letters_in_crop, strategy):
+        x, y, w, h = box
+        if letters_in_crop is None:
+            table.append(crop, x, y, w, h, strategy, box)
         else:
-            gray = img
-
-        # Does adaptive histogram equalization
-        clahe = cv2.createCLAHE(clipLimit=1.0, tileGridSize=(80, 80))
-        equalized = clahe.apply(gray)
-
-        # otsu thresholding
-        _, otsu = cv2.threshold(equalized, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-        # closing
-        inverted_img = cv2.bitwise_not(otsu)
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        closed_img = cv2.morphologyEx(inverted_img, cv2.MORPH_CLOSE, kernel)
-
-        inverted_back = cv2.bitwise_not(closed_img)
-
-        # Denoises the closed otsu image
-        de_noise_otsu = cv2.fastNlMeansDenoising(inverted_back, h=60.0, templateWindowSize=7, searchWindowSize=21)
-
-        return self.segment_letters(de_noise_otsu)
-
-    # Method that is run if the background in the image is varied
-    def segment_varied_background(self, image):
-        # Reads image of scroll
-        img = image
-
-        # Grayscales image
-        if len(img.shape) == 3:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = img
-
-        # Adaptive binarization
-        binarize_im = cv2.adaptiveThreshold(src=gray, maxValue=255, adaptiveMethod=cv2.ADAPTIVE_THRESH_MEAN_C,
-                                           thresholdType=cv2.THRESH_BINARY, blockSize=39, C=15)
-
-        # Opening
-        inverted_img = cv2.bitwise_not(binarize_im)
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-
-        opened_img = cv2.morphologyEx(inverted_img, cv2.MORPH_OPEN, kernel)
-
-        inverted_back = cv2.bitwise_not(opened_img)
-
-        # Closing
-        inverted_img = cv2.bitwise_not(inverted_back)
-
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        closed_img = cv2.morphologyEx(inverted_img, cv2.MORPH_CLOSE, kernel)
-
-        inverted_back = cv2.bitwise_not(closed_img)
-
-        # Noise removal
-        de_noise_otsu = cv2.fastNlMeansDenoising(inverted_back, h=60.0, templateWindowSize=7, searchWindowSize=21)
-
-        return self.segment_letters(de_noise_otsu)
+            for i in letters_in_crop:
+                # Saves each segmented letter in the table with the correct coordinate values
+                table.append(i.image, x + i.x, y, x + i.w, h, strategy, box)
+
+    # Splits the wide boxes of the letters that were split with a cheaper strategy than "full" again with the full
+    # strategy, for example when there is time after a page was segmented with a time budget. Each box is split the
+    # same way as segment_letters splits it without a time budget, from the word boxes of the letters and the source
+    # of the table. page_shape is the shape of the image the boxes are in, if it is not the source, like for the
+    # letters of a rescaled image. The new letters are classified if a classifier is given, and the overlaps are
+    # suppressed again if the segmentor suppresses them. Returns a new table where the letters of each box are replaced
+    # by the letters it is split into.
+    def refine(self, letters, classifier=None, page_shape=None):
+        source = letters.source
+        if source is None:
+            raise ValueError("The letters can only be refined if their table has the image they were segmented from")
+        if page_shape is None:
+            page_shape = source.shape
+
+        # The letters of each wide box that was split with a cheaper strategy, in the order of the first letter of
+        # the box
+        cheap = (letters.strategies != STRATEGIES.index("full")) & (letters.word_boxes[:, 0] != NO_COORDINATE)
+        groups = {}
+        for i in np.flatnonzero(cheap):
+            groups.setdefault(tuple(int(value) for value in letters.word_boxes[i]), []).append(i)
+        if not groups:
+            return letters
+
+        boxes = list(groups)
+        h_source = source.shape[0]
+        crops = [source[(h_source - h):(h_source - y), x:w] for x, y, w, h in boxes]
+        letters_in_crops = [letters_in_crop for letters_in_crop, _ in self.split_boxes(crops)]
+
+        # The letters of each box are put where the first letter of the box was, and the other letters of the box are
+        # left out
+        firsts = [indices[0] for indices in groups.values()]
+        tables = []
+        # The indices of the new letters in the result, and how many letters are in the tables so far
+        refined = []
+        count = 0
+        end = 0
+        for index in np.argsort(firsts, kind="stable"):
+            tables.append(letters.take([i for i in range(end, firsts[index]) if not cheap[i]]))
+            count += len(tables[-1])
+            end = firsts[index] + 1
+
+            table = LetterTable(source)
+            self.append_split_box(table, crops[index], boxes[index], letters_in_crops[index], "full")
+            tables.append(self.scale_back(table, source.shape, page_shape))
+            refined.extend(range(count, count + len(table)))
+            count += len(table)
+        tables.append(letters.take([i for i in range(end, len(letters)) if not cheap[i]]))
+        result = LetterTable.concatenate(tables, source=source)
+
+        # The new letters are classified in one batch
+        if classifier is not None and refined:
+            new_letters = classifier.Classify(result.take(refined))
+            result.label_ids[refined] = new_letters.label_ids
+            result.confidences[refined] = new_letters.confidences
+        return self.suppress_overlaps(result, page_shape)
+
+    # Preprocesses a rescaled image with the stages and segments it, under the memory budget of the memory governor if
+    # the segmentor has one
+    def segment_stages(self, img, stages, classifier=None, deadline=None):
+        if self.memory_governor is not None:
+            return self.memory_governor.segment_page(self, img, stages, classifier, deadline)
+        de_noise_otsu = preprocessing.run_stages(img, stages, self.stage_cache)
+        return self.segment_page(de_noise_otsu, classifier, deadline)
+
+    # Method that is run if the background in the image isnt varied. The letters are classified if a classifier is given.
+    def segment_clear_background(self, image, classifier=None):
+        # Reads image of scroll, scaled down if the letters are too large
+        img, _ = self.rescale(image)
+        deadline = self.deadline()
+
+        # Grayscales, equalizes, thresholds, closes and denoises the image
+        stages = preprocessing.clear_background_stages(self.denoiser)
+        letters = self.segment_stages(img, stages, classifier, deadline)
+
+        letters = self.suppress_overlaps(letters, img.shape)
+        return self.scale_back(letters, img.shape, image.shape)
+
+    # Binarizes an image that doesnt have a varied background, without denoising it
+    def binarize_clear_background(self, img):
+        stages = preprocessing.clear_background_stages(self.denoiser)[:-1]
+        return preprocessing.run_stages(img, stages, self.stage_cache)
+
+    # Method that is run if the background in the image is varied. The letters are classified if a classifier is given.
+    def segment_varied_background(self, image, classifier=None):
+        # Reads image of scroll, scaled down if the letters are too large
+        img, _ = self.rescale(image)
+        deadline = self.deadline()
+
+        # Grayscales, binarizes, opens, closes and denoises the image
+        stages = preprocessing.varied_background_stages(self.denoiser)
+        letters = self.segment_stages(img, stages, classifier, deadline)
+
+        letters = self.suppress_overlaps(letters, img.shape)
+        return self.scale_back(letters, img.shape, image.shape)
+
+    # Binarizes an image that has a varied background, without denoising it
+    def binarize_varied_background(self, img):
+        stages = preprocessing.varied_background_stages(self.denoiser)[:-1]
+        return preprocessing.run_stages(img, stages, self.stage_cache)
 
 
 class Classifier:
-    def __init__(self, model, input_size=100):
+    # The letters are classified batch_size letters at a time, so that the memory used does not grow with the amount
+    # of letters on the page
+    def __init__(self, model, input_size=100, batch_size=256):
         self.input_size = input_size
+        self.batch_size = batch_size
 
         # Setup model
         self.model = Convolutional(input_size)
@@ -456,28 +958,50 @@ class Classifier:
         self.model.eval()
 
         # Setup classes
-        self.classes = ['ALEF', 'BET', 'GIMEL', 'DALET', 'HE', 'VAV', 'ZAYIN', 'HET', 'TET', 'YOD', 'KAF', 'LAMED',
-                        'MEM', 'NUN', 'SAMEKH', 'AYIN', 'PE', 'TSADI', 'QOF', 'RESH', 'SHIN', 'TAV']
+        self.classes = CLASSES
         self.names = None
         self.values = None
 
-    def ___load_images(self, letters):
-        image_batch = np.zeros((len(letters), self.input_size, self.input_size))
-        for i, letter in enumerate(letters):
-            if letter.image is not None:
-                # Load image from array
-                image = Image.fromarray(letter.image)
-
-                # Fix the dimensions of the image
-                new_image = Image.new(image.mode, (100, 100), 255)
-                x, y = int((100 / 2)) - int(image.width / 2), int(100 / 2) - int(image.height / 2)
-                new_image.paste(image, (x, y))
-
-                #  Converts back into numpy array
-                np_image = np.array(new_image) / 255
-                image_batch[i] = np_image
-
-        return image_batch
+    # Puts each letter image in the middle of a white image of the input size, with the pixel values between 0 and 1.
+    # Parts of a letter that are outside of the image are cut off, the same way as when it is pasted with PIL. Missing
+    # images are black. The images are written to the buffer, which is made if it isnt given.
+    def ___load_images(self, images, buffer=None):
+        size = self.input_size
+        if buffer is None:
+            buffer = np.empty((len(images), size, size), dtype=np.float32)
+
+        for i, letter_image in enumerate(images):
+            if letter_image is None:
+                buffer[i] = 0
+                continue
+            buffer[i] = 1
+
+            # Where the letter starts in the white image, and the part of the letter that is inside it
+            h, w = letter_image.shape[:2]
+            x, y = int(size / 2) - int(w / 2), int(size / 2) - int(h / 2)
+            left, top = max(-x, 0), max(-y, 0)
+            width, height = min(w - left, size - max(x, 0)), min(h - top, size - max(y, 0))
+            if width > 0 and height > 0:
+                part = letter_image[top:top + height, left:left + width]
+                if part.dtype == np.uint8:
+                    part = _PIXEL_VALUES[part]
+                else:
+                    part = part / 255
+                buffer[i, max(y, 0):max(y, 0) + height, max(x, 0):max(x, 0) + width] = part
+
+        return buffer
+
+    # Returns the probabilities of the classes for a list of letter images, with one row for each image
+    def Probabilities(self, images):
+        probabilities = np.empty((len(images), len(self.classes)), dtype=np.float32)
+        buffer = np.empty((min(self.batch_size, len(images)), self.input_size, self.input_size), dtype=np.float32)
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start:start + self.batch_size]
+            batch = self.___load_images(chunk, buffer[:len(chunk)])
+            with torch.no_grad():
+                results = self.model(torch.from_numpy(batch).unsqueeze(1))
+            probabilities[start:start + len(chunk)] = nnf.softmax(results, dim=1).numpy()
+        return probabilities
 
     def SimplyClassify(self, image):
         # Fix the dimensions of the image
@@ -492,8 +1016,9 @@ class Classifier:
 
         # Fix the shape of the array
         image = image.unsqueeze(0).unsqueeze(0)
-        # Predict
-        result = self.model(image)
+        # Predict, without keeping track of the gradients since the model is not trained here
+        with torch.no_grad():
+            result = self.model(image)
         result = result[0]
         # Convert the predictions to a numpy array
 
@@ -503,28 +1028,13 @@ class Classifier:
         prediction = self.classes[confidence]
         return prediction, result[confidence] * 100
 
+    # Classifies the letters in a LetterTable, batch_size letters at a time. The confidences are in whole percent,
+    # rounded down.
     def Classify(self, letters):
-
-        images = self.___load_images(letters)
-
-        # Convert the numpy arrays into tensors
-        images = torch.from_numpy(images).float()
-
-        # Fix the shape of the array
-        images = images.unsqueeze(1)
-
-        # Predict
-        results = self.model(images)
-
-        # Convert the predictions to a numpy array
-
-        for i, result in enumerate(results):
-            result = nnf.softmax(result, dim=0)
-            result = result.detach().numpy()
-
-            confidence = np.argmax(result)
-            prediction = self.classes[confidence]
-            letters[i].add_label(prediction, math.trunc(result[confidence] * 100))
+        results = self.Probabilities(letters.images)
+        predictions = np.argmax(results, axis=1)
+        confidences = np.trunc(results[np.arange(len(results)), predictions].astype(np.float64) * 100)
+        letters.set_labels(predictions, confidences)
         return letters
 
     def getDict(self):
@@ -0,0 +1,69 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# An image copied into a block of shared memory, so that worker processes can use it without it being pickled and
+# copied to each of them. Only the handle of the image, which is the name of the block and the shape and data type of
+# the image, is sent to the workers, which attach to the block with AttachedImage.
+# The process that makes the shared image owns the block and removes it when the shared image is closed, so it must be
+# kept open until the workers are done with it. It can be used in a with statement to close it afterwards.
+class SharedImage:
+    def __init__(self, image):
+        image = np.ascontiguousarray(image)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(image.nbytes, 1))
+        self.array = np.ndarray(image.shape, dtype=image.dtype, buffer=self.memory.buf)
+        self.array[...] = image
+        self.handle = (self.memory.name, image.shape, image.dtype.str)
+
+    # Removes the block of shared memory. The array of the shared image can't be used afterwards.
+    def close(self):
+        if self.memory is None:
+            return
+        self.array = None
+        self.memory.close()
+        self.memory.unlink()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+# A shared image that a worker process has attached to from its handle. The array is the image in the shared memory,
+# so nothing is copied. The worker must close it when it is done, after it has let go of all the views of the array.
+class AttachedImage:
+    def __init__(self, handle):
+        name, shape, dtype = handle
+        self.memory = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.memory.buf)
+
+    def close(self):
+        if self.memory is None:
+            return
+        self.array = None
+        try:
+            self.memory.close()
+        except BufferError:
+            # Views of the array are still used somewhere, for example by the traceback of an error. The memory is
+            # then unmapped when they are garbage collected instead.
+            pass
+        self.memory = None
+
+
+# Returns the rows and columns (top, bottom, left, right) of the part of an image that a view is of, or None if the
+# view is not a rectangle in the image, for example if it has been copied
+def window_in(view, image):
+    if view is None or view.ndim != 2 or image.ndim != 2 or view.dtype != image.dtype or \
+            view.strides != image.strides or not np.shares_memory(view, image):
+        return None
+
+    offset = view.__array_interface__["data"][0] - image.__array_interface__["data"][0]
+    top, left = divmod(offset, image.strides[0])
+    left //= image.strides[1]
+    bottom, right = top + view.shape[0], left + view.shape[1]
+    if top < 0 or left < 0 or bottom > image.shape[0] or right > image.shape[1]:
+        return None
+    return top, bottom, left, right
@@ -0,0 +1,91 @@
+import numpy as np
+
+from region_results import box_edges
+
+
+# Spatial index over the boxes of the letters in a LetterTable, used to find the letters at a point or inside a
+# rectangle without going through all the letters. The image is divided into a grid of square cells, and each cell
+# has the letters that overlap it. The coordinates given to the index are counted from the top left corner of the
+# image, the same way as the pixels in the image.
+class LetterIndex:
+    def __init__(self, table, h_img, cell_size=None):
+        self.table = table
+
+        left, top, right, bottom = box_edges(table, h_img)
+        self.left = left.astype(np.int64)
+        self.top = top.astype(np.int64)
+        self.right = np.maximum(right, left + 1).astype(np.int64)
+        self.bottom = np.maximum(bottom, top + 1).astype(np.int64)
+
+        # The size of the cells is set from the size of the letters so that most letters only are in a few cells
+        if cell_size is None:
+            if len(table) > 0:
+                cell_size = int(2 * np.median(np.maximum(self.right - self.left, self.bottom - self.top)))
+            else:
+                cell_size = 64
+        self.cell_size = max(cell_size, 8)
+
+        # The first and last cell in each direction that each letter overlaps
+        cell_left = np.clip(self.left, 0, None) // self.cell_size
+        cell_top = np.clip(self.top, 0, None) // self.cell_size
+        cell_right = np.maximum(np.clip(self.right - 1, 0, None) // self.cell_size, cell_left)
+        cell_bottom = np.maximum(np.clip(self.bottom - 1, 0, None) // self.cell_size, cell_top)
+
+        self.columns = int(cell_right.max()) + 1 if len(table) > 0 else 1
+        self.rows = int(cell_bottom.max()) + 1 if len(table) > 0 else 1
+
+        # Makes an entry for every cell that every letter overlaps
+        span_x = cell_right - cell_left + 1
+        span_y = cell_bottom - cell_top + 1
+        counts = span_x * span_y
+        letters = np.repeat(np.arange(len(table)), counts)
+        first_entry = np.repeat(np.cumsum(counts) - counts, counts)
+        offset = np.arange(len(letters)) - first_entry
+        span_x = np.repeat(span_x, counts)
+        cells = (np.repeat(cell_top, counts) + offset // span_x) * self.columns + \
+            np.repeat(cell_left, counts) + offset % span_x
+
+        # Sorts the entries by cell, so that the letters in a cell are next to each other in the entries array,
+        # and the letters in cell c are entries[cell_starts[c]:cell_starts[c + 1]]
+        order = np.argsort(cells, kind="stable")
+        self.entries = letters[order]
+        self.cell_starts = np.zeros(self.rows * self.columns + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=self.rows * self.columns), out=self.cell_starts[1:])
+
+    def __len__(self):
+        return len(self.table)
+
+    # Returns the indices of the letters that overlap the rectangle from (x0, y0) to (x1, y1), in the order they have
+    # in the table
+    def letters_in_rect(self, x0, y0, x1, y1):
+        x0, x1 = min(x0, x1), max(x0, x1)
+        y0, y1 = min(y0, y1), max(y0, y1)
+        if len(self.table) == 0 or x1 <= 0 or y1 <= 0:
+            return np.zeros(0, dtype=np.int64)
+
+        column_first = max(int(x0) // self.cell_size, 0)
+        column_last = min(int(np.ceil(x1)) // self.cell_size, self.columns - 1)
+        row_first = max(int(y0) // self.cell_size, 0)
+        row_last = min(int(np.ceil(y1)) // self.cell_size, self.rows - 1)
+        if column_first > column_last or row_first > row_last:
+            return np.zeros(0, dtype=np.int64)
+
+        # The cells on a row are next to each other in the entries, so each row is one slice of the entries
+        candidates = [self.entries[self.cell_starts[row * self.columns + column_first]:
+                                   self.cell_starts[row * self.columns + column_last + 1]]
+                      for row in range(row_first, row_last + 1)]
+        candidates = np.unique(np.concatenate(candidates))
+
+        overlaps = (self.left[candidates] < x1) & (self.right[candidates] > x0) & \
+                   (self.top[candidates] < y1) & (self.bottom[candidates] > y0)
+        return candidates[overlaps]
+
+    # Returns the index of the letter at the point (x, y), or None if there is no letter there.
+    # If several letters overlap the point the smallest of them is returned.
+    def letter_at(self, x, y):
+        candidates = self.letters_in_rect(x, y, x + 1, y + 1)
+        if len(candidates) == 0:
+            return None
+
+        areas = (self.right[candidates] - self.left[candidates]) * (self.bottom[candidates] - self.top[candidates])
+        return int(candidates[np.argmin(areas)])
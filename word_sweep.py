@@ -0,0 +1,205 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+
+# Word splitter that classifies all the possible letters in a word at once, instead of widening each letter until it
+# is classified with a high confidence like word_splitter does.
+# The word is cut only at the columns with little ink, and every window between two cuts that is as wide as a letter
+# is classified in one batch. The windows get a score from the confidence of the classifier in a score matrix
+# with one row and one column for each cut, and the letters are the windows with the highest total score that cover
+# the word from left to right, which is found with dynamic programming.
+# The classifier takes a letter in the middle of a white image, so the windows are classified as separate images in
+# one batch rather than by sliding the network over the word.
+
+# Returns the columns the word can be cut at, from left to right. These are the columns with the least ink around
+# them, and the first and last column of each run of columns without ink, so that the space between letters can be
+# left out. The left and right side of the word are always cuts.
+def cut_candidates(word, low=0.3, min_gap=2):
+    ink = np.count_nonzero(word < 128, axis=0)
+    w_word = len(ink)
+    threshold = low * max(int(ink.max()), 1)
+
+    cuts = {0, w_word}
+    padded = np.concatenate([[ink.max() + 1], ink, [ink.max() + 1]])
+    minima = (ink <= padded[:-2]) & (ink <= padded[2:]) & (ink <= threshold)
+
+    # Keeps the middle of each run of minima, and the ends of the runs without ink
+    changes = np.flatnonzero(np.diff(np.concatenate([[0], minima.astype(np.int8), [0]])))
+    for start, end in zip(changes[0::2], changes[1::2]):
+        if ink[start:end].max() == 0:
+            cuts.update([int(start), int(end)])
+        else:
+            cuts.add(int((start + end) // 2))
+
+    # Removes the cuts that are closer than min_gap to the cut before them, but keeps the right side of the word
+    merged = [0]
+    for cut in sorted(cuts)[1:]:
+        if cut - merged[-1] >= min_gap:
+            merged.append(cut)
+        elif cut == w_word and len(merged) > 1:
+            merged[-1] = cut
+    if merged[-1] != w_word:
+        merged.append(w_word)
+    return merged
+
+
+# Classifies every window between two cuts that is between min_letter_width and max_letter_width wide in one batch.
+# Returns the score matrix, where scores[i, j] is the log of the confidence of the window from cuts[i] to cuts[j] times
+# its width (-inf if it is not a possible letter, and 0 if the window has no ink so that it can be left out), and the
+# cropped images of the windows. The scores are weighted by the width so that the total score of a word does not
+# depend on how many letters it is split into.
+def window_scores(word, cuts, classifier, min_letter_width, max_letter_width):
+    # Imported here since segmentation_to_classifier imports this module
+    from segmentation_to_classifier import image_cropper
+
+    n = len(cuts)
+    scores = np.full((n, n), -np.inf)
+    crops = {}
+    for i in range(n):
+        for j in range(i + 1, n):
+            width = cuts[j] - cuts[i]
+            if width > max_letter_width:
+                break
+            window = word[:, cuts[i]:cuts[j]]
+            if not np.any(window < 128):
+                scores[i, j] = 0.0
+            elif width >= min_letter_width:
+                crops[(i, j)] = image_cropper(window)
+
+    if crops:
+        probabilities = classifier.Probabilities(list(crops.values()))
+        for (i, j), result in zip(crops, probabilities):
+            scores[i, j] = (cuts[j] - cuts[i]) * np.log(max(float(result.max()), 1e-12))
+    return scores, crops
+
+
+# Finds the windows with the highest total score that cover the word from the first to the last cut. Returns the
+# windows as (i, j) pairs of indices into the cuts from left to right, or None if the word can't be covered.
+def best_segmentation(scores):
+    n = len(scores)
+    best = np.full(n, -np.inf)
+    previous = np.full(n, -1)
+    best[0] = 0.0
+    for j in range(1, n):
+        totals = best[:j] + scores[:j, j]
+        i = int(np.argmax(totals))
+        if totals[i] > -np.inf:
+            best[j] = totals[i]
+            previous[j] = i
+
+    if best[-1] == -np.inf:
+        return None
+
+    windows = []
+    j = n - 1
+    while j > 0:
+        windows.append((int(previous[j]), j))
+        j = previous[j]
+    return windows[::-1]
+
+
+# Splits an image of a word into letters like word_splitter, and returns the letters from left to right with x and w
+# relative to the word. Windows without ink are left out. If the word can't be split, it is returned as one letter.
+def sweep_splitter(word, min_letter_width=12, max_letter_width=None, classifier=None):
+    # Imported here since segmentation_to_classifier imports this module
+    from segmentation_to_classifier import LetterTable, MODEL_PATH, get_classifier, image_cropper
+
+    if classifier is None:
+        classifier = get_classifier(MODEL_PATH)
+    if max_letter_width is None:
+        max_letter_width = max(2 * min_letter_width, int(1.5 * word.shape[0]))
+
+    cuts = cut_candidates(word)
+    scores, crops = window_scores(word, cuts, classifier, min_letter_width, max_letter_width)
+    windows = best_segmentation(scores)
+
+    letters = LetterTable(word)
+    if windows is None:
+        letters.append(image_cropper(word), 0, None, word.shape[1], None)
+    else:
+        for i, j in windows:
+            if (i, j) in crops:
+                letters.append(crops[(i, j)], cuts[i], None, cuts[j], None)
+    return letters[:]
+
+
+# Classifier that counts how many letters it has classified, used to compare the splitters
+class _CountingClassifier:
+    def __init__(self, classifier):
+        self.classifier = classifier
+        self.count = 0
+
+    def SimplyClassify(self, image):
+        self.count += 1
+        return self.classifier.SimplyClassify(image)
+
+    def Probabilities(self, images):
+        self.count += len(images)
+        return self.classifier.Probabilities(images)
+
+
+# Prints a report comparing sweep_splitter with word_splitter on the wide boxes in the images: how long they take,
+# how many times they run the classifier, how many letters they find and how confident the classifier is of them.
+# The repository has no labelled letters, so the splitters are compared with each other and not with the truth.
+def main():
+    # Imported here since segmentation_to_classifier imports this module
+    import segmentation_to_classifier as segToClass
+
+    parser = argparse.ArgumentParser(description="Compares the sweep word splitter with the word splitter")
+    parser.add_argument("images", nargs="*", default=["test.jpg"], help="paths to scroll images")
+    parser.add_argument("--varied", action="store_true", help="the images have a varied background")
+    parser.add_argument("--engine", default="components", choices=segToClass.ENGINES)
+    args = parser.parse_args()
+
+    classifier = segToClass.get_classifier(segToClass.MODEL_PATH)
+    segmentor = segToClass.Segmentor(engine=args.engine)
+
+    # The wide boxes that segment_letters would split
+    words = []
+    for path in args.images:
+        image = cv2.imread(path)
+        if args.varied:
+            binary = segmentor.binarize_varied_background(image)
+        else:
+            binary = segmentor.binarize_clear_background(image)
+        binary = segToClass.denoise.denoise(binary, segmentor.denoiser)
+        h_img = binary.shape[0]
+        for x, y, w, h in segmentor.find_boxes(binary):
+            crop = binary[(h_img - h):(h_img - y), x:w]
+            if crop.shape[1] > 30 and crop.shape[0] > 0 and segToClass.class_letter_checker(crop) <= 90:
+                words.append(crop)
+    print(str(len(words)) + " words to split")
+    if not words:
+        return
+
+    counting = _CountingClassifier(classifier)
+    results = {}
+    for name in ["word_splitter", "sweep_splitter"]:
+        counting.count = 0
+        start = time.perf_counter()
+        if name == "word_splitter":
+            segToClass.set_letter_checker(counting)
+            try:
+                letters = [segToClass.word_splitter(word) for word in words]
+            finally:
+                segToClass.set_letter_checker(None)
+        else:
+            letters = [sweep_splitter(word, classifier=counting) for word in words]
+        seconds = time.perf_counter() - start
+
+        images = [letter.image for word_letters in letters for letter in word_letters if letter.image is not None]
+        confidences = classifier.Probabilities(images).max(axis=1) * 100 if images else np.zeros(0)
+        results[name] = [len(word_letters) for word_letters in letters]
+        print("{:<15} {:8.1f} ms {:8.1f} classified/word {:6d} letters  mean confidence {:5.1f}".format(
+            name, seconds * 1000, counting.count / len(words), len(images),
+            float(np.mean(confidences)) if len(confidences) else 0.0))
+
+    same = np.mean(np.array(results["word_splitter"]) == np.array(results["sweep_splitter"]))
+    print("words split into the same amount of letters: {:.1%}".format(same))
+
+
+if __name__ == "__main__":
+    main()